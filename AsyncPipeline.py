@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""AsyncPipeline overlaps XML parsing and PostgreSQL writes with asyncio
+
+Stages:
+  1. file discovery: next_file in a thread
+  2. decompress/parse: documents are parsed into rows in an executor,
+     processes with --jobs > 1, otherwise a thread
+  3. bounded buffer: parsed documents wait here, bounded by bytes.
+     The parser blocks when it is full, or spills to disk, see BatchBuffer
+  4. writers: --writers asyncpg connections, each deletes the old rows of
+     its batch then COPY the new rows in one transaction, so several batches
+     are in flight at the same time
+
+Requires: asyncpg
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import time
+
+from argparse import Namespace
+from BatchBuffer import BatchBuffer
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import CommonFunctions
+
+from CommonArgParser import ExitStatus
+from DbHandler import DbHandler, RowBatch, RowCollector
+
+try:
+    from typing import Dict  # noqa: F401
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+
+class AsyncPipeline(object):
+    """Pipeline of discovery, parse and DB writers
+
+    Args:
+        args (Namespace): Parsed arguments of db sub-command
+        files (Iterable[str]): Files to be exported
+    """
+
+    def __init__(self, args: Namespace, files):
+        self.args = args
+        self.files = iter(files)
+        # Formats buffered times as timedelta for asyncpg
+        self.formatter = RowCollector(args, native_interval=True)
+        self.buffer = BatchBuffer(
+                args.queue_mb << 20,
+                None if args.queue_low_mb is None else args.queue_low_mb << 20,
+                args.queue_size, args.queue_spill_dir)
+        self.documents = 0
+        self.rows = 0
+
+    def columns(self, table_name: str):
+        """asyncpg quotes column names, so they have to be lower case"""
+        if table_name.startswith('words_'):
+            columns = DbHandler.WORDS_COLUMNS
+        elif table_name.startswith('time_'):
+            columns = DbHandler.TIME_COLUMNS + (
+                    ['StartMs', 'EndMs'] if self.args.time_ms else [])
+        elif table_name.startswith('documents_'):
+            columns = DbHandler.DOCUMENT_COLUMNS
+        else:
+            columns = DbHandler.META_COLUMNS
+        return [c.lower() for c in columns]
+
+    async def write_batch(self, pool, batch: RowBatch):
+        lang = self.args.lang
+        # (table, row count, rows)
+        tables = [
+                (f"words_{lang}", len(batch.words), batch.words),
+                (f"time_{lang}", len(batch.times),
+                 self.formatter.time_rows(batch.times)),
+                ("meta", len(batch.metas), batch.metas),
+                (f"documents_{lang}", len(batch.document_rows),
+                 batch.document_rows)]
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                for table_name, _, _ in tables:
+                    await conn.execute(
+                            f"DELETE FROM {table_name}"
+                            " WHERE DocumentId = ANY($1::int[]);",
+                            list(batch.delete_ids))
+                for table_name, count, rows in tables:
+                    if count:
+                        await conn.copy_records_to_table(
+                                table_name, records=rows,
+                                columns=self.columns(table_name))
+        self.documents += batch.documents
+        self.rows += len(batch.words) + len(batch.times) + len(batch.metas)
+        logging.info(
+                "Written %d documents: %d words, %d times, %d metas;"
+                " buffered %d batches, %d bytes",
+                batch.documents, len(batch.words), len(batch.times),
+                len(batch.metas), len(self.buffer.items), self.buffer.bytes)
+
+    async def writer(self, pool):
+        """Take parsed documents from buffer, write them in batches"""
+        batch = RowBatch()
+        while True:
+            item = await self.buffer.get()
+            if item is None:
+                break
+            batch.extend(item)
+            if batch.documents >= self.args.batch_documents:
+                await self.write_batch(pool, batch)
+                batch = RowBatch()
+        if batch.documents:
+            await self.write_batch(pool, batch)
+
+    async def producer(self, executor):
+        """Discover files and parse them in executor"""
+        # Imported here to avoid circular import
+        from XmlExporter import parse_document
+        loop = asyncio.get_running_loop()
+        # Future of parse_document(): its file
+        in_flight = {}  # type: Dict[asyncio.Future, str]
+        max_in_flight = max(2, self.args.jobs * 2)
+        while True:
+            in_file = await loop.run_in_executor(
+                    None, next, self.files, None)
+            if in_file is None:
+                break
+            logging.info(f"Reading {in_file}")
+            future = loop.run_in_executor(
+                    executor, parse_document, in_file, self.args)
+            in_flight[future] = in_file
+            if len(in_flight) >= max_in_flight:
+                done, _ = await asyncio.wait(
+                        in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    await self.put_parsed(future, in_flight.pop(future))
+        for future, in_file in in_flight.items():
+            await self.put_parsed(future, in_file)
+
+    async def put_parsed(self, future, in_file: str):
+        """Buffer the rows of a parsed file, but with --quarantine-dir
+        a malformed file is quarantined and skipped"""
+        # Imported here to avoid circular import
+        from XmlExporter import MALFORMED_FILE_ERRORS, quarantine_file
+        try:
+            batch = await future
+        except MALFORMED_FILE_ERRORS as e:
+            if not getattr(self.args, 'quarantine_dir', None):
+                raise
+            logging.error("Quarantining malformed %s: %s", in_file, e)
+            quarantine_file(in_file, e, self.args)
+            return
+        await self.buffer.put(batch)
+
+    async def run(self):
+        try:
+            import asyncpg
+        except ImportError:
+            logging.critical("asyncpg is required for --pipeline")
+            sys.exit(ExitStatus.FATAL_MISSING_DEPENDENCY.value)
+        # The DSN of --shard has the DB name, asyncpg takes DSN as URI
+        dsn = DbHandler.shard_dsn(self.args)
+        credential = {'dsn': dsn} if dsn else {'database': self.args.db_name}
+        if self.args.db_user:
+            credential['user'] = self.args.db_user
+        if self.args.db_password:
+            credential['password'] = self.args.db_password
+        if self.args.jobs > 1:
+            executor = ProcessPoolExecutor(self.args.jobs)
+        else:
+            executor = ThreadPoolExecutor(1)
+        start = time.perf_counter()
+        async with asyncpg.create_pool(
+                min_size=self.args.writers, max_size=self.args.writers,
+                **credential) as pool:
+            writers = [
+                    asyncio.ensure_future(self.writer(pool))
+                    for _ in range(self.args.writers)]
+            producer = asyncio.ensure_future(self.producer(executor))
+            try:
+                # Writers only finish early when they fail,
+                # which must stop the producer waiting for the buffer
+                done, _ = await asyncio.wait(
+                        [producer] + writers,
+                        return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception():
+                        raise task.exception()
+                await self.buffer.close()
+                await asyncio.gather(*writers)
+            except BaseException:
+                for task in [producer] + writers:
+                    task.cancel()
+                raise
+            finally:
+                executor.shutdown()
+                self.buffer.remove_spill_files()
+        elapsed = time.perf_counter() - start
+        logging.info(
+                "Written %d documents, %d rows in %.1fs (%.0f rows/s),"
+                " buffer: %s",
+                self.documents, self.rows, elapsed,
+                self.rows / elapsed if elapsed else 0,
+                ', '.join(
+                        "%s=%s" % item
+                        for item in self.buffer.metrics().items()))
+
+
+def run(args: Namespace, files):
+    """Export files with the asyncio pipeline"""
+    pipeline_args = Namespace(**{
+            k: v for k, v in vars(args).items()
+            if k not in ['db_handler', 'ingest_cache']})
+    asyncio.run(AsyncPipeline(pipeline_args, files).run())
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
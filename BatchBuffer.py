@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""BatchBuffer bounds the memory of parsed rows waiting for DB writers
+
+It is the queue of AsyncPipeline: the parser puts RowBatch of documents,
+writers take them. Memory is bounded by bytes with two watermarks:
+once the buffered rows reach high_bytes, the parser blocks until the
+writers drain it down to low_bytes, so it does not wake up for every
+batch written.
+
+With spill_dir, the parser does not block on bytes: batches beyond
+high_bytes are pickled to spill_dir and read back in their turn. A slow
+DB then costs disk instead of memory. max_items still blocks it.
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+import CommonFunctions
+
+from DbHandler import RowBatch
+
+try:
+    from typing import Any, Deque, Set, Tuple, Union  # noqa: F401
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+
+class BatchBuffer(object):
+    """Byte bounded FIFO of RowBatch between asyncio tasks
+
+    Args:
+        high_bytes (int): Buffered bytes that block put()
+        low_bytes (int, optional): Defaults to high_bytes // 2.
+            Blocked put() resumes when the buffer drains to this
+        max_items (int, optional): Defaults to 0. Also block when this
+            many batches are buffered, 0 for no limit
+        spill_dir (str, optional): Defaults to None.
+            Spill to this directory instead of blocking on high_bytes
+
+    Examples:
+    >>> async def demo(buffer):
+    ...     batch = RowBatch()
+    ...     batch.words.append(1, 1, 1, 'word')
+    ...     for _ in range(3):
+    ...         await buffer.put(batch)
+    ...     await buffer.close()
+    ...     taken = 0
+    ...     while await buffer.get():
+    ...         taken += 1
+    ...     return taken
+    >>> import tempfile
+    >>> buffer = BatchBuffer(1, spill_dir=tempfile.mkdtemp())
+    >>> asyncio.run(demo(buffer))
+    3
+    >>> metrics = buffer.metrics()
+    >>> metrics['spilled'], metrics['buffered'], metrics['peak_bytes'] > 0
+    (2, 0, True)
+    >>> async def fail(buffer):
+    ...     for _ in range(2):
+    ...         await buffer.put(RowBatch())
+    >>> asyncio.run(fail(buffer))
+    >>> buffer.remove_spill_files()
+    >>> os.listdir(buffer.spill_dir)
+    []
+    """
+
+    def __init__(self, high_bytes: int, low_bytes=None, max_items=0,
+                 spill_dir=None):
+        # type: (int, int, int, str) -> None
+        self.high_bytes = high_bytes
+        self.low_bytes = high_bytes // 2 if low_bytes is None else low_bytes
+        self.max_items = max_items
+        self.spill_dir = spill_dir
+        # (batch or spill file, bytes in memory)
+        self.items = collections.deque()  # type: Deque[Tuple[Any, int]]
+        self.bytes = 0
+        self.closed = False
+        self.changed = None  # type: asyncio.Condition
+        # Spill files not read back yet
+        self.spill_files = set()  # type: Set[str]
+        # Metrics
+        self.peak_bytes = 0
+        self.blocked_puts = 0
+        self.blocked_seconds = 0.0
+        self.spilled = 0
+
+    def condition(self):
+        # Created in the running loop
+        if self.changed is None:
+            self.changed = asyncio.Condition()
+        return self.changed
+
+    def is_full(self):
+        return self.items and (
+                self.bytes >= self.high_bytes or self.is_max_items())
+
+    def is_drained(self):
+        return self.bytes <= self.low_bytes and not self.is_max_items()
+
+    def is_max_items(self):
+        return self.max_items and len(self.items) >= self.max_items
+
+    async def put(self, batch: RowBatch):
+        """Add batch, block or spill while the buffer is full"""
+        changed = self.condition()
+        nbytes = batch.nbytes()
+        item = batch  # type: Union[RowBatch, str]
+        if self.is_full():
+            if self.spill_dir and not self.is_max_items():
+                item = await asyncio.get_running_loop().run_in_executor(
+                        None, self.spill, batch)
+                nbytes = 0
+            else:
+                start = time.perf_counter()
+                self.blocked_puts += 1
+                async with changed:
+                    await changed.wait_for(self.is_drained)
+                self.blocked_seconds += time.perf_counter() - start
+        async with changed:
+            self.items.append((item, nbytes))
+            self.bytes += nbytes
+            self.peak_bytes = max(self.peak_bytes, self.bytes)
+            changed.notify_all()
+
+    async def get(self):
+        # type: () -> RowBatch
+        """Take the oldest batch, None when closed and empty"""
+        changed = self.condition()
+        async with changed:
+            await changed.wait_for(lambda: self.items or self.closed)
+            if not self.items:
+                return None
+            item, nbytes = self.items.popleft()
+            self.bytes -= nbytes
+            changed.notify_all()
+        if isinstance(item, RowBatch):
+            return item
+        return await asyncio.get_running_loop().run_in_executor(
+                None, self.load, item)
+
+    async def close(self):
+        """No more put(), get() returns None after the last batch"""
+        changed = self.condition()
+        async with changed:
+            self.closed = True
+            changed.notify_all()
+
+    def spill(self, batch: RowBatch):
+        """Pickle batch to a file of spill_dir, returns the file name"""
+        fd, spill_file = tempfile.mkstemp(
+                prefix='batch-', suffix='.pickle', dir=self.spill_dir)
+        self.spill_files.add(spill_file)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+        self.spilled += 1
+        logging.debug(
+                "Spilled %d documents to %s", batch.documents, spill_file)
+        return spill_file
+
+    def load(self, spill_file: str):
+        with open(spill_file, 'rb') as f:
+            batch = pickle.load(f)
+        os.remove(spill_file)
+        self.spill_files.discard(spill_file)
+        return batch
+
+    def remove_spill_files(self):
+        """Remove the spill files of the batches that were not taken,
+        e.g. when a writer failed"""
+        for spill_file in list(self.spill_files):
+            try:
+                os.remove(spill_file)
+            except FileNotFoundError:
+                pass
+            self.spill_files.discard(spill_file)
+
+    def metrics(self):
+        """Fill level, peak and time the producer was blocked"""
+        return {
+                'buffered': len(self.items),
+                'buffered_bytes': self.bytes,
+                'peak_bytes': self.peak_bytes,
+                'blocked_puts': self.blocked_puts,
+                'blocked_seconds': round(self.blocked_seconds, 3),
+                'spilled': self.spilled}
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
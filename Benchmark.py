@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+"""Benchmark startup, parse, traversal, DbHandler insert and FileExtractor
+throughput
+
+The corpus is generated by CorpusGenerator with a fixed seed, so results of
+different versions are comparable.
+Results are written as JSON, use the compare sub-command to find regressions.
+
+    python Benchmark.py run -b sqlite -o new.json
+    python Benchmark.py compare old.json new.json
+"""
+
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import CommonFunctions
+
+from argparse import Namespace
+from CommonArgParser import CommonArgParser
+from CommonArgParser import ExitStatus
+from CorpusGenerator import CorpusGenerator
+from DbHandler import DbHandler
+from Profiler import Profiler
+
+import FileExtractor
+import XmlExporter
+
+try:
+    from typing import List, Dict  # noqa: F401 # pylint: disable=W0611
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+
+class Benchmark(object):
+    """Run benchmark stages against a generated corpus
+
+    Args:
+        work_dir (str): Directory for the corpus and throwaway DB
+        args (Namespace): Parsed arguments of the run sub-command
+    """
+    STAGES = ['startup', 'parse', 'traversal', 'insert', 'extract']
+    # Entry points run by the startup stage, they are also started per job
+    ENTRY_POINTS = ['XmlExporter.py', 'FileExtractor.py', 'CorpusGenerator.py']
+
+    def __init__(self, work_dir: str, args: Namespace):
+        self.work_dir = work_dir
+        self.args = args
+        self.files = []  # type: List[str]
+        self.bytes = 0
+        self.nodes = 0
+
+    def generate(self):
+        generator = CorpusGenerator(
+                self.work_dir, self.args.lang, self.args.sentences,
+                self.args.words, not self.args.no_gzip, self.args.spread,
+                self.args.seed)
+        self.files = generator.write(self.args.files)
+        self.bytes = sum(os.path.getsize(f) for f in self.files)
+
+    def _result(self, seconds: float, files=None, nbytes=None, nodes=None):
+        """Throughput of a stage, in nodes only if it went through the
+        XML nodes of the files"""
+        files = len(self.files) if files is None else files
+        nbytes = self.bytes if nbytes is None else nbytes
+        result = {
+                'seconds': seconds,
+                'files': files,
+                'bytes': nbytes,
+                'files_per_s': files / seconds if seconds else 0,
+                'mb_per_s': nbytes / seconds / 1048576 if seconds else 0}
+        if nodes:
+            result['nodes'] = nodes
+            result['nodes_per_s'] = nodes / seconds if seconds else 0
+        return result
+
+    def bench_startup(self):
+        """Wall time of running each entry point with --help"""
+        import subprocess  # nosec
+        start = time.perf_counter()
+        for script in self.ENTRY_POINTS:
+            subprocess.run(  # nosec
+                    [sys.executable,
+                     os.path.join(CommonFunctions.SCRIPT_DIR, script),
+                     '--help'],
+                    stdout=subprocess.DEVNULL, check=True)
+        return self._result(
+                time.perf_counter() - start, len(self.ENTRY_POINTS), 0)
+
+    def bench_parse(self):
+        nodes = 0
+        start = time.perf_counter()
+        for f in self.files:
+            root = XmlExporter.parse_xml_file(f)
+            nodes += sum(1 for _ in root.iter())
+        elapsed = time.perf_counter() - start
+        self.nodes = nodes
+        return self._result(elapsed, nodes=nodes)
+
+    def bench_traversal(self):
+        args = Namespace(lang=self.args.lang)
+        start = time.perf_counter()
+        for f in self.files:
+            XmlExporter.export_xml_file(f, args)
+        # Nodes are counted by the parse stage
+        return self._result(time.perf_counter() - start, nodes=self.nodes)
+
+    def bench_insert(self):
+        db_args = Namespace(**vars(self.args))
+        if db_args.db_product == 'sqlite':
+            db_args.db_name = os.path.join(self.work_dir, 'bench.sqlite3')
+        else:
+            db_args.db_name = "opensubtitle_bench_%d" % os.getpid()
+        db_handler = DbHandler.get_handler(db_args)
+        db_handler.prepare()
+        setattr(db_args, 'db_handler', db_handler)
+        try:
+            start = time.perf_counter()
+            for f in self.files:
+                XmlExporter.export_xml_file(f, db_args)
+            elapsed = time.perf_counter() - start
+        finally:
+            db_handler.conn.close()
+            db_handler.admin_connect()
+            db_handler.drop_db(db_args.db_name)
+        return self._result(elapsed, nodes=self.nodes)
+
+    def bench_extract(self):
+        tgz_dir = os.path.join(self.work_dir, 'tgz')
+        out_dir = os.path.join(self.work_dir, 'extracted')
+        CommonFunctions.mkdir_p(tgz_dir)
+        tgz_files = []
+        # One archive per year, like smaller OPUS downloads
+        by_dir = {}  # type: Dict[str, List[str]]
+        for f in self.files:
+            by_dir.setdefault(
+                    os.path.dirname(os.path.dirname(f)), []).append(f)
+        for idx, d in enumerate(sorted(by_dir)):
+            tgz_filename = os.path.join(tgz_dir, "%d.tar.gz" % idx)
+            with tarfile.open(tgz_filename, 'w:gz') as tgz:
+                for f in by_dir[d]:
+                    tgz.add(f, arcname=os.path.relpath(f, self.work_dir))
+            tgz_files.append(tgz_filename)
+        nbytes = sum(os.path.getsize(f) for f in tgz_files)
+        start = time.perf_counter()
+        for f in CommonFunctions.next_file(tgz_dir, ['*.tgz', '*.tar.gz']):
+            FileExtractor.untgz(f, out_dir)
+        elapsed = time.perf_counter() - start
+        shutil.rmtree(out_dir)
+        return self._result(elapsed, len(tgz_files), nbytes)
+
+    def run(self):
+        """Run the stages, each repeated and the fastest one kept"""
+        self.generate()
+        results = {}
+        for stage in self.STAGES:
+            if stage not in self.args.stages:
+                continue
+            best = None
+            for _ in range(self.args.repeat):
+                result = getattr(self, 'bench_' + stage)()
+                if not best or result['seconds'] < best['seconds']:
+                    best = result
+            logging.info(
+                    "%-10s %8.3fs %10.1f files/s %8.2f MB/s%s",
+                    stage, best['seconds'], best['files_per_s'],
+                    best['mb_per_s'],
+                    " %12.0f nodes/s" % best['nodes_per_s']
+                    if 'nodes_per_s' in best else '')
+            results[stage] = best
+        return results
+
+
+def version():
+    """Git version of the code, or 'unknown'"""
+    import subprocess  # nosec
+    try:
+        return CommonFunctions.exec_check_output(
+                ['git', 'describe', '--always', '--dirty'],
+                cwd=CommonFunctions.SCRIPT_DIR,
+                stderr=subprocess.DEVNULL).decode('utf-8')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(args: Namespace):
+    """Run the benchmark and write the JSON report"""
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='opensubtitle-bench-')
+    try:
+        results = Benchmark(work_dir, args).run()
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+    report = {
+            'version': version(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': {
+                    k: getattr(args, k) for k in [
+                            'files', 'sentences', 'words', 'spread',
+                            'seed', 'no_gzip', 'repeat', 'db_product']},
+            'stages': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    logging.info("Results written to %s", args.output)
+
+
+def compare(args: Namespace):
+    """Compare throughput of two JSON reports
+
+    Returns:
+        ExitStatus: RETURN_FALSE if any stage regressed more than threshold
+    """
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    if base['parameters'] != new['parameters']:
+        logging.warning("Parameters differ, results may not be comparable")
+    status = ExitStatus.OK
+    print("%-10s %12s %12s %8s" % (
+            'stage', base['version'][:12], new['version'][:12], 'ratio'))
+    for stage in Benchmark.STAGES:
+        if stage not in base['stages'] or stage not in new['stages']:
+            continue
+        old_s = base['stages'][stage]['seconds']
+        new_s = new['stages'][stage]['seconds']
+        ratio = new_s / old_s if old_s else 0
+        regressed = ratio > 1 + args.threshold
+        print("%-10s %11.3fs %11.3fs %7.2fx%s" % (
+                stage, old_s, new_s, ratio, ' REGRESSED' if regressed else ''))
+        if regressed:
+            status = ExitStatus.RETURN_FALSE
+    return status
+
+
+def main():
+    """Run as command line program"""
+    parser = CommonArgParser(__file__)
+    parser.add_sub_command(
+            'run',
+            [
+                    ('-A --db-admin-password', {
+                            'type': str,
+                            'help': 'The DB admin password'}),
+                    ('-b --db-product', {
+                            'type': str, 'default': 'sqlite',
+                            'help': 'The DB to benchmark (Default: sqlite)'}),
+                    ('-p --db-password', {
+                            'type': str,
+                            'help': 'The DB password'}),
+                    ('-u --db-user', {
+                            'type': str,
+                            'help': 'The DB username'}),
+                    ('-l --lang', {
+                            'type': str, 'default': 'en',
+                            'help': 'Language code (Default: en)'}),
+                    ('-n --files', {
+                            'type': int, 'default': 50,
+                            'help': 'Number of documents (Default: 50)'}),
+                    ('-s --sentences', {
+                            'type': int, 'default': 500,
+                            'help': 'Sentences per document (Default: 500)'}),
+                    ('-w --words', {
+                            'type': int, 'default': 8,
+                            'help': 'Mean words per sentence (Default: 8)'}),
+                    ('--spread', {
+                            'type': float, 'default': 0.0,
+                            'help': 'Log-normal sigma of document sizes'}),
+                    ('--seed', {
+                            'type': int, 'default': 0,
+                            'help': 'Random seed (Default: 0)'}),
+                    ('--no-gzip', {
+                            'action': 'store_true',
+                            'help': 'Use plain .xml instead of .xml.gz'}),
+                    ('-r --repeat', {
+                            'type': int, 'default': 3,
+                            'help': 'Repeat each stage, keep the fastest'}),
+                    ('--stages', {
+                            'type': lambda s: s.split(','),
+                            'default': Benchmark.STAGES,
+                            'help': 'Comma separated stages (Default: %s)'
+                            % ','.join(Benchmark.STAGES)}),
+                    ('-d --work-dir', {
+                            'type': str,
+                            'help': 'Keep corpus in this directory'
+                            ' (Default: a removed temporary directory)'}),
+                    ('-o --output', {
+                            'type': str, 'default': 'benchmark.json',
+                            'help': 'JSON result file'}),
+                    ],
+            help='Run benchmark')
+    parser.add_sub_command(
+            'compare',
+            [
+                    ('-t --threshold', {
+                            'type': float, 'default': 0.1,
+                            'help': 'Allowed slow down ratio (Default: 0.1)'}),
+                    ('base', {'help': 'JSON result of the baseline'}),
+                    ('new', {'help': 'JSON result to be compared'}),
+                    ],
+            help='Compare two JSON results')
+    args = parser.parse_all()
+    if not hasattr(args, 'sub_command'):
+        parser.parse_args(['-h'])
+        sys.exit(ExitStatus.FATAL_INVALID_ARGUMENTS.value)
+    with Profiler.init_from_parsed_args(args, __file__).run():
+        if args.sub_command == 'run':
+            run(args)
+        else:
+            sys.exit(compare(args).value)
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
+    main()
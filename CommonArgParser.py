@@ -2,7 +2,9 @@
 """CommonArgParser is an sub-class of ArgumentParser
 that handles sub-parser, environments more easily.
 
-This also handles logging with color format.
+This also handles logging with color format. Logging can be moved to a
+background thread with --log-queue, and repeated debug messages can be
+sampled with --log-sample.
 The color formattting part is borrowed from KurtJacobson's colored_log.py
 
 https://gist.github.com/KurtJacobson/c87425ad8db411c73c6359933e5db9f9
@@ -11,14 +13,12 @@ Requires: python >=3.4  (Enum support)
 """
 
 from enum import Enum, unique
-import inspect
 import logging
 import os
-import platform
 import re
 import sys
 
-from argparse import ArgumentParser, ArgumentError
+from argparse import ArgumentParser, ArgumentError, SUPPRESS
 # Following are for mypy
 from argparse import Action  # noqa: F401 # pylint: disable=W0611
 from argparse import Namespace  # noqa: F401 # pylint: disable=W0611
@@ -34,6 +34,10 @@ except ImportError:
     sys.stderr.write("python typing module is not installed" + os.linesep)
 
 
+# Logger, listener, queue handler and console handlers of --log-queue
+_log_queue = None  # type: Optional[Tuple[logging.Logger, Any, Any, list]]
+
+
 @unique
 class ExitStatus(Enum):
     """Return value of
@@ -191,12 +195,113 @@ class ColoredLogHandler(logging.StreamHandler):
             self.handleError(record)
 
     def emit(self, record):
-        if platform.system() == 'Windows':
+        if os.name == 'nt':
             self.emit_windows(record)
         else:
             self.emit_ansi(record)
 
 
+class SampledDebugFilter(logging.Filter):
+    """Pass only 1 of every n DEBUG records of each call site
+
+    Other levels always pass, so per-row debug messages of a run on real
+    data do not drown everything else.
+
+    Examples:
+    >>> sampler = SampledDebugFilter(3)
+    >>> record = logging.LogRecord(
+    ...         'root', logging.DEBUG, 'x.py', 1, 'row', None, None)
+    >>> [sampler.filter(record) for _ in range(5)]
+    [True, False, False, True, False]
+    >>> record.levelno = logging.INFO
+    >>> sampler.filter(record)
+    True
+    """
+
+    def __init__(self, n: int):
+        super(SampledDebugFilter, self).__init__()
+        self.n = n
+        self.counts = {}  # type: Dict[Tuple[str, int], int]
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        key = (record.pathname, record.lineno)
+        count = self.counts.get(key, 0)
+        self.counts[key] = count + 1
+        return count % self.n == 0
+
+
+def start_log_queue(logger):
+    # type: (logging.Logger) -> None
+    """Move formatting and writing of the logger to a background thread
+
+    The handlers of the logger are replaced with a QueueHandler,
+    a QueueListener thread formats and emits the records through them.
+    A forked child process starts its own listener,
+    as the thread does not survive fork.
+    """
+    global _log_queue
+    import atexit
+    import queue
+    from logging.handlers import QueueHandler, QueueListener
+
+    class RecordQueueHandler(QueueHandler):
+        def prepare(self, record):
+            # The listener of the same process formats the record
+            return record
+
+    if _log_queue is None:
+        atexit.register(stop_log_queue)
+        # Windows has no fork, its child processes start afresh
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_restart_log_queue_in_child)
+    else:
+        stop_log_queue()
+    handlers = logger.handlers[:]
+    records = queue.SimpleQueue()  # type: queue.SimpleQueue
+    queue_handler = RecordQueueHandler(records)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    _log_queue = (logger, listener, queue_handler, handlers)
+
+
+def _detach_log_queue():
+    """Put the handlers back to the logger, returns the listener"""
+    global _log_queue
+    if not _log_queue or not _log_queue[1]:
+        return None, None
+    logger, listener, queue_handler, handlers = _log_queue
+    _log_queue = (logger, None, queue_handler, handlers)
+    logger.removeHandler(queue_handler)
+    for handler in handlers:
+        logger.addHandler(handler)
+    return logger, listener
+
+
+def stop_log_queue():
+    """Emit the queued records and log through the handlers directly"""
+    _, listener = _detach_log_queue()
+    if listener:
+        listener.stop()
+
+
+def _restart_log_queue_in_child():
+    """Forked children start their own listener thread"""
+    # The queue belongs to the listener of the parent, leave it alone
+    logger, _ = _detach_log_queue()
+    if not logger:
+        return
+    start_log_queue(logger)
+    if 'multiprocessing' in sys.modules:
+        # Pool workers leave with os._exit(), which skips atexit
+        from multiprocessing.util import Finalize
+        Finalize(None, stop_log_queue, exitpriority=0)
+
+
 class CommonArgParser(ArgumentParser):
     """Zanata Argument Parser that support sub-commands and environment
 
@@ -229,6 +334,33 @@ class CommonArgParser(ArgumentParser):
                 metavar='VERBOSE_LEVEL',
                 help='Valid values: %s'
                 % 'DEBUG, INFO, WARNING, ERROR, CRITICAL, NONE')
+        self.add_argument(
+                '--profile', type=int, nargs='?', const=0, default=None,
+                metavar='N',
+                help="""Profile with cProfile. Without N, profile the whole
+                run; otherwise keep profiles of the N slowest files""")
+        self.add_argument(
+                '--trace-memory', type=int, nargs='?', const=0,
+                default=None, metavar='N',
+                help="""Trace allocations with tracemalloc. Without N, trace
+                the whole run; otherwise keep the N files with highest peak""")
+        self.add_argument(
+                '--profile-dir', type=str,
+                default=os.getenv('PROFILE_DIR', '.'),
+                help="""Directory to write pstats and allocation reports.
+                (Default: environment PROFILE_DIR or current directory)""")
+        self.add_argument(
+                '--profile-every', type=int, default=1, metavar='N',
+                help="""Only profile every Nth file in per-file mode,
+                to limit overhead. (Default: 1)""")
+        self.add_argument(
+                '--log-queue', action='store_true',
+                help="""Format and write logs in a background thread,
+                so logging does not block the work""")
+        self.add_argument(
+                '--log-sample', type=int, default=1, metavar='N',
+                help="""Only log 1 of every N debug messages of the same
+                source line. (Default: 1)""")
 
         self.sub_parsers = None  # type: Union[None, _SubParsersAction]
         self.sub_command_obj_dict = {}  # type: Dict[str, Any]
@@ -260,6 +392,13 @@ class CommonArgParser(ArgumentParser):
             >>> args = parser.parse_all(['module-help'])
             >>> print(args.sub_command)
             module-help
+
+            Options of the parser itself go before or after it:
+            >>> args = parser.parse_all(['--profile', '3', 'module-help'])
+            >>> args.profile, args.profile_every
+            (3, 1)
+            >>> parser.parse_all(['module-help', '--profile', '5']).profile
+            5
         """
         if not self.sub_parsers:
             self.sub_parsers = self.add_subparsers(
@@ -276,6 +415,16 @@ class CommonArgParser(ArgumentParser):
 
         anonymous_parser = self.sub_parsers.add_parser(
                 name, **kwargs)
+        # The sub-command parser is a CommonArgParser too. Its copies of
+        # -v, --profile and so on have no default, so they do not reset
+        # the values given before the sub-command
+        # pylint: disable=W0212
+        own_dests = {
+                action.dest for action in self._actions
+                if action.option_strings and action.dest != 'help'}
+        for action in anonymous_parser._actions:
+            if action.dest in own_dests:
+                action.default = SUPPRESS
         if arguments:
             for arg in arguments:
                 k = arg[0]
@@ -321,6 +470,7 @@ class CommonArgParser(ArgumentParser):
             name_pattern (str, optional): Defaults to '.*'.
                     Method name should match the pattern.
         """
+        import inspect
         method_list = inspect.getmembers(obj)
         for m in method_list:
             if not re.match(name_pattern, m[0]):
@@ -341,7 +491,7 @@ class CommonArgParser(ArgumentParser):
                 # No need to be in sub-commands
                 continue
 
-            argspec = inspect.getargspec(m_obj)
+            argspec = inspect.getfullargspec(m_obj)
             sub_args = None
             try:
                 start_idx = len(argspec.args) - len(argspec.defaults)
@@ -396,11 +546,26 @@ class CommonArgParser(ArgumentParser):
         """Whether this parser parses this environment"""
         return env_name in self.env_def
 
-    def set_logger(self, verbose='INFO', **get_logger_kwargs):
-        # type: (str, str) -> None
+    def set_logger(  # pylint: disable=too-many-arguments
+            self, verbose='INFO', log_queue=False, log_sample=1,
+            **get_logger_kwargs):
+        # type: (str, bool, int, str) -> None
         """Handle logger
-        Inspired from KurtJacobson's colored_log.py"""
+        Inspired from KurtJacobson's colored_log.py
+
+        Args:
+            verbose (str, optional): Defaults to 'INFO'. Log level
+            log_queue (bool, optional): Defaults to False.
+                Log from a background thread, see start_log_queue()
+            log_sample (int, optional): Defaults to 1.
+                Only log 1 of every log_sample debug records of a call site
+        """
         self.logger = logging.getLogger(**get_logger_kwargs)
+        for log_filter in self.logger.filters[:]:
+            if isinstance(log_filter, SampledDebugFilter):
+                self.logger.removeFilter(log_filter)
+        if log_sample > 1:
+            self.logger.addFilter(SampledDebugFilter(log_sample))
         # Add console handler
 
         c_handler = ColoredLogHandler()
@@ -415,15 +580,18 @@ class CommonArgParser(ArgumentParser):
             self.logger.setLevel(getattr(logging, verbose))
         else:
             ArgumentError(None, "Invalid verbose level: %s" % verbose)
+        if log_queue:
+            start_log_queue(self.logger)
 
     def parse_args(self, args=None, namespace=None):
         # type: (Optional[List[Any]], Optional[Namespace]) -> Namespace
         """Parse arguments"""
         result = super(CommonArgParser, self).parse_args(args, namespace)
-        self.set_logger(result.verbose)
+        self.set_logger(result.verbose, result.log_queue, result.log_sample)
 
-        # We do not need verbose for the caller
-        delattr(result, 'verbose')
+        # We do not need the logging options for the caller
+        for option in ('verbose', 'log_queue', 'log_sample'):
+            delattr(result, option)
         return result
 
     @staticmethod
@@ -495,6 +663,7 @@ class CommonArgParser(ArgumentParser):
                     args,
                     "sub-command %s is not associated with any object" %
                     args.sub_command)
+        import inspect
         obj = self.sub_command_obj_dict[args.sub_command]
         if inspect.isclass(obj):
             cls = obj
@@ -504,7 +673,7 @@ class CommonArgParser(ArgumentParser):
             obj = getattr(cls, 'init_from_parsed_args')(args)
 
         sub_cmd_obj = getattr(obj, args.sub_command)
-        argspec = inspect.getargspec(sub_cmd_obj)
+        argspec = inspect.getfullargspec(sub_cmd_obj)
         arg_values = []
         for a in argspec.args:
             if a == 'self' or a == 'cls':
@@ -1,20 +1,19 @@
 #!/usr/bin/env python
-"""Common Helper Function"""
+"""Common Helper Function
+
+Only the lean core is imported at startup. subprocess is imported when
+a command is run, and the helpers of external tools (GitHelper, SshHost,
+TgzHelper, UrlHelper) are imported from ExternalTools on first access.
+"""
 
 import errno
 import fnmatch
 import logging
-import platform
 import os
 import re
-import subprocess  # nosec
 import sys
-import urllib.parse
-import urllib.request
 
 from contextlib import contextmanager
-from distutils.version import LooseVersion
-from CommonArgParser import CommonArgParser
 
 try:
     from typing import List, Any  # noqa: F401 # pylint: disable=unused-import
@@ -23,6 +22,26 @@ except ImportError:
 
 
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+# Names of ExternalTools that are still accessible from CommonFunctions
+EXTERNAL_TOOLS = [
+        'GitHelper', 'HTTPBasicAuthHandler', 'SshHost', 'TgzHelper',
+        'UrlHelper']
+# Same components as distutils LooseVersion
+VERSION_COMPONENT_PATTERN = re.compile(r'(\d+|[a-z]+|\.)')
+
+# Per worker process function of imap_jobs()
+_job = None  # type: Any
+
+
+def __getattr__(name):
+    """Import ExternalTools and subprocess on first access"""
+    if name in EXTERNAL_TOOLS:
+        import ExternalTools
+        return getattr(ExternalTools, name)
+    if name == 'subprocess':
+        import subprocess  # nosec
+        return subprocess
+    raise AttributeError("module %s has no attribute %s" % (__name__, name))
 
 
 def exec_call(cmd_list, **kwargs):
@@ -39,6 +58,7 @@ def exec_call(cmd_list, **kwargs):
     Returns:
         int: exit status of command.
     """
+    import subprocess  # nosec
     logging.debug("Running command: %s", " ".join(cmd_list))
     return subprocess.call(cmd_list, **kwargs)  # nosec
 
@@ -63,6 +83,7 @@ def exec_check_call(cmd_list, **kwargs):
     Raises:
         CalledProcessError: When command exit status is not 0
     """
+    import subprocess  # nosec
     logging.debug("Running command: %s", " ".join(cmd_list))
     try:
         return subprocess.check_call(cmd_list, **kwargs)  # nosec
@@ -91,6 +112,7 @@ def exec_check_output(cmd_list, **kwargs):
     Raises:
         CalledProcessError: When command exit status is not 0
     """
+    import subprocess  # nosec
     logging.debug("Running command: %s", " ".join(cmd_list))
     try:
         return subprocess.check_output(cmd_list, **kwargs).rstrip()  # nosec
@@ -98,28 +120,228 @@ def exec_check_output(cmd_list, **kwargs):
         raise e
 
 
+def compile_filename_patterns(filename_patterns=None):
+    # type (List[str]) -> Any
+    """Compile shell patterns into one regex match function
+
+    Args:
+        filename_patterns (list, optional): Defaults to None.
+
+    Returns:
+        Callable[[str], Any]: match function, or None to match everything
+
+    Examples:
+    >>> match = compile_filename_patterns(['*.xml.gz', '*.xml'])
+    >>> bool(match('1.xml.gz')), bool(match('1.xml')), bool(match('1.txt'))
+    (True, True, False)
+    """
+    if not filename_patterns:
+        return None
+    if os.path.normcase('A') == 'A':
+        return re.compile('|'.join(
+                fnmatch.translate(p) for p in filename_patterns)).match
+    # Case insensitive file system like Windows
+    return re.compile('|'.join(
+            fnmatch.translate(p) for p in filename_patterns),
+            re.IGNORECASE).match
+
+
+class OpusDirFilter(object):
+    """Prune directories of OPUS layout: xml/<lang>/<year>/<imdb_id>/
+
+    Directories that are not under a 'xml' directory are never pruned.
+
+    Args:
+        langs (List[str], optional): Defaults to None. Languages to keep
+        years (str, optional): Defaults to None. Years to keep,
+            e.g. '1990-1999,2005'
+
+    Examples:
+    >>> f = OpusDirFilter(['en'], '1990-1999,2005')
+    >>> f('data/xml/en/1995'), f('data/xml/en/2000'), f('data/xml/fr')
+    (True, False, False)
+    >>> f('data/xml'), f('data/other/2000')
+    (True, True)
+    """
+
+    def __init__(self, langs=None, years=None):
+        # type (List[str], str) -> None
+        self.langs = set(langs) if langs else None
+        self.years_spec = years
+        self.years = None
+        if years:
+            self.years = set()
+            for r in years.split(','):
+                start, _, end = r.partition('-')
+                end = end or start
+                self.years.update(
+                        str(y) for y in range(int(start), int(end) + 1))
+
+    def __bool__(self):
+        return bool(self.langs or self.years)
+
+    def __repr__(self):
+        return "OpusDirFilter(%s, %s)" % (
+                sorted(self.langs) if self.langs else None, self.years_spec)
+
+    def __call__(self, dir_path):
+        # type (str) -> bool
+        """Whether to walk into dir_path"""
+        parts = dir_path.replace(os.sep, '/').split('/')
+        try:
+            xml_idx = len(parts) - 1 - parts[::-1].index('xml')
+        except ValueError:
+            return True
+        parts = parts[xml_idx + 1:]
+        if self.langs and len(parts) >= 1 and parts[0] not in self.langs:
+            return False
+        if self.years and len(parts) >= 2 and parts[1] not in self.years:
+            return False
+        return True
+
+
+def opus_lang(path: str):
+    """Language of a file in OPUS layout xml/<lang>/..., or None
+
+    >>> opus_lang('/data/xml/zh_cn/1999/123/4000000.xml.gz')
+    'zh_cn'
+    >>> print(opus_lang('/data/extra/a.xml'))
+    None
+    """
+    parts = path.replace(os.sep, '/').split('/')
+    # The last 'xml' directory with a directory under it
+    for idx in range(len(parts) - 3, -1, -1):
+        if parts[idx] == 'xml':
+            return parts[idx + 1]
+    return None
+
+
+def _scan_dir(dir_name, match, dir_filter, with_size):
+    """Scan a directory, returns (files, sub_dirs)"""
+    files = []
+    sub_dirs = []
+    try:
+        with os.scandir(dir_name) as it:
+            for entry in it:
+                if entry.is_dir():
+                    # Like os.walk, do not follow symlinks to directories
+                    if not entry.is_symlink() and (
+                            not dir_filter or dir_filter(entry.path)):
+                        sub_dirs.append(entry.path)
+                elif match is None or match(entry.name):
+                    if with_size:
+                        files.append((entry.stat().st_size, entry.path))
+                    else:
+                        files.append(entry.path)
+    except OSError as e:
+        logging.warning("Cannot scan %s: %s", dir_name, e)
+    return files, sub_dirs
+
+
+def scan_files(
+            src_dir: str,
+            filename_patterns: List[str] = None,
+            dir_filter=None,
+            jobs: int = 1,
+            with_size: bool = False):
+    """Generator that recursively find matching files with os.scandir
+
+    Files are yielded as soon as their directory is scanned.
+
+    Args:
+        src_dir (str): directory to work on
+        filename_patterns (list, optional): Defaults to None.
+        dir_filter (Callable[[str], bool], optional): Defaults to None.
+                Only walk into directories that dir_filter returns True
+        jobs (int, optional): Defaults to 1. Number of threads to scan
+                directories, helps on network file systems.
+        with_size (bool, optional): Defaults to False.
+                Yield (size, path) instead of path.
+
+    Yields:
+        str: Full path of next file
+    """
+    match = compile_filename_patterns(filename_patterns)
+    if jobs <= 1:
+        stack = [src_dir]
+        while stack:
+            files, sub_dirs = _scan_dir(
+                    stack.pop(), match, dir_filter, with_size)
+            yield from files
+            stack.extend(reversed(sub_dirs))
+        return
+
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+    with ThreadPoolExecutor(jobs) as executor:
+        pending = {executor.submit(
+                _scan_dir, src_dir, match, dir_filter, with_size)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, sub_dirs = future.result()
+                for d in sub_dirs:
+                    pending.add(executor.submit(
+                            _scan_dir, d, match, dir_filter, with_size))
+                yield from files
+
+
 def next_file(
             src_dir: str,
-            filename_patterns: List[str] = None):
+            filename_patterns: List[str] = None,
+            dir_filter=None,
+            jobs: int = 1):
     """Generator that recursively find next matching file in a directory
 
     Args:
         src_dir (str): directory to work on
         filename_patterns (list, optional): Defaults to None.
+        dir_filter (Callable[[str], bool], optional): Defaults to None.
+                Only walk into directories that dir_filter returns True
+        jobs (int, optional): Defaults to 1. Threads to scan directories.
 
     Yields:
         str: Full path of next file
     """
-    for dir_name, subdir_list, file_list in os.walk(  # pylint: disable=W0612
-                src_dir):
-        for f in file_list:
-            if not filename_patterns:
-                yield os.path.join(dir_name, f)
-                continue
-            for p in filename_patterns:
-                if fnmatch.fnmatch(f, p):
-                    yield os.path.join(dir_name, f)
-                    break
+    return scan_files(src_dir, filename_patterns, dir_filter, jobs)
+
+
+def _init_job_worker(func, args):
+    global _job
+    _job = (func, args)
+
+
+def _run_job(item):
+    func, args = _job
+    return func(item, args)
+
+
+def imap_jobs(func, items, args, jobs: int, chunksize=16):
+    """Yield func(item, args) of each item, with a pool of jobs processes
+
+    args is passed once to each worker, not with every item. With jobs
+    of 1 the items are done in this process, in order; otherwise the
+    results come as they are done. An error stops the pool.
+
+    >>> list(imap_jobs(divmod, [7, 9], 4, 1))
+    [(1, 3), (2, 1)]
+    >>> sorted(imap_jobs(divmod, range(40), 8, 2))[-1]
+    (4, 7)
+    """
+    if jobs <= 1:
+        for item in items:
+            yield func(item, args)
+        return
+    import multiprocessing
+    pool = multiprocessing.Pool(
+            jobs, initializer=_init_job_worker, initargs=(func, args))
+    try:
+        yield from pool.imap_unordered(_run_job, items, chunksize=chunksize)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
 
 
 class CLIException(Exception):
@@ -136,395 +358,6 @@ class CLIException(Exception):
         return self.msg
 
 
-class GitHelper(object):
-    """Git Helper functions"""
-    GIT_CMD = '/usr/bin/git'
-
-    def __init__(
-            self, user=None, token=None,
-            url='https://github.com/zanata/zanata-platform.git',
-            remote='origin'):
-        # type: (str, str, str, str) -> None
-        self.user = user
-        self.token = token
-
-        parsed = urllib.parse.urlsplit(url)
-        data = list(parsed)
-
-        # replace if user is specify
-        if user:
-            userrec = user
-            if token:
-                userrec += ":" + token
-            netloc = "%s@%s" % (userrec, parsed.hostname)
-            data[1] = netloc
-
-        self.url = url
-        self.auth_url = urllib.parse.urlunparse(data)
-        self.remote = remote
-
-    @classmethod
-    def init_from_parsed_args(cls, args):
-        """Init from command line arguments"""
-        kwargs = {}
-        for k in ['user', 'token', 'url', 'remote']:
-            if hasattr(args, k):
-                kwargs[k] = getattr(args, k)
-        return cls(**kwargs)
-
-    @staticmethod
-    def git_check_output(arg_list, **kwargs):
-        """Run git command and return stdout as string
-
-        This is just a wrapper of run_check_output()
-
-        Arguments:
-            arg_list {LIST[str]} -- git argument lists.
-
-        Keyword Arguments:
-            kwarg {Namespace} -- keyword args for subprocess.check_output
-
-        Returns:
-            str -- stdout output
-        """
-        cmd_list = [GitHelper.GIT_CMD] + arg_list
-        return exec_check_output(cmd_list, **kwargs)
-
-    @staticmethod
-    def branch_get_current():
-        # type () -> str
-        """Return current branch name, or HEAD when detach."""
-        return GitHelper.git_check_output([
-                'rev-parse', '--abbrev-ref', 'HEAD'])
-
-    def branch_forced_pull(self, branch=None, remote=None):
-        # type (str, str, str) -> None
-        """Withdraw local changes and pull the remote,
-        which, by default, is self.remote or 'origin'
-        Note that function does nothing to a detached HEAD"""
-        if not branch:
-            branch = self.branch_get_current()
-        if branch == 'HEAD':
-            return None
-        if not remote:
-            remote = self.remote if self.remote else 'origin'
-        msg = self.git_check_output(
-                ['fetch', remote, branch])
-        logging.info(msg)
-        msg = self.git_check_output([
-                'reset', '--hard',
-                "{}/{}".format(remote, branch)])
-        logging.info(msg)
-
-    @staticmethod
-    def detect_remote_repo_latest_version(
-            tag_prefix='', remote_repo='.'):
-        # type (str, str) -> str
-        """Get the latest version from remote repo without clone the whole repo
-
-        Known Bug: "latest version" does not mean version of latest tag,
-        but just the biggest version.
-
-        For example, if you tag v2.0, then tag v1.8.
-        The returned verion will be v2.0
-
-        Keyword Arguments:
-            tag_prefix {str} -- prefix of a tag to be strip (default: {''})
-            remote_repo {str} -- the remote git repo, can be URL, repo name,
-                    '.' for local repository,
-                    or None to use the self.url (default: {None})
-
-        Returns:
-            str -- the latest version
-        """
-        lines = GitHelper.git_check_output([
-                'ls-remote', '--tags', remote_repo,
-                'refs/tags/%s*[^^{{}}]' % tag_prefix]).strip().split('\n')
-        index = len('refs/tags/%s' % tag_prefix)
-        versions = version_sort([l.split()[1][index:] for l in lines], True)
-        return versions[0]
-
-
-class HTTPBasicAuthHandler(urllib.request.HTTPBasicAuthHandler):
-    """Handle Basic Authentication"""
-
-    def http_error_401(  # pylint: disable=too-many-arguments,unused-argument
-            self, req, fp, code, msg, headers):
-        """retry with basic auth when facing a 401"""
-        host = req.get_host()
-        realm = None
-        return self.retry_http_basic_auth(host, req, realm)
-
-    def http_error_403(  # pylint: disable=too-many-arguments,unused-argument
-            self, req, fp, code, msg, hdrs):
-        """retry with basic auth when facing a 403"""
-        host = req.get_host()
-        realm = None
-        return self.retry_http_basic_auth(host, req, realm)
-
-
-class SshHost(object):
-    """SSH/SCP helper functions"""
-
-    SCP_CMD = '/usr/bin/scp'
-    SSH_CMD = '/usr/bin/ssh'
-    RSYNC_CMD = '/usr/bin/rsync'
-    RSYNC_OPTIONS = [
-            '--cvs-exclude', '--recursive', '--verbose', '--links',
-            '--update', '--compress', '--exclude', '*.core', '--stats',
-            '--progress', '--archive', '--keep-dirlinks']
-
-    def __init__(self, host, ssh_user=None, identity_file=None):
-        # type (str, str, str) -> None
-        self.host = host
-        self.ssh_user = ssh_user
-        self.identity_file = identity_file
-        if self.identity_file:
-            self.opt_list = ['-i', identity_file]
-        else:
-            self.opt_list = []
-
-        # Produce [user@]hostname
-        self.user_host = "%s%s" % (
-                '' if not self.ssh_user else self.ssh_user + '@', self.host)
-
-    @classmethod
-    def add_parser(cls, arg_parser=None):
-        # type (CommonArgParser) -> CommonArgParser
-        """Add SshHost parameters to a parser"""
-        if not arg_parser:
-            arg_parser = CommonArgParser(
-                    description=cls.__doc__)
-        arg_parser.add_common_argument(
-                '-u', '--ssh-user', type=str,
-                help='Connect SSH/SCP as this user')
-        arg_parser.add_common_argument(
-                '-i', '--identity-file', type=str,
-                help='SSH/SCP ident-files')
-        arg_parser.add_common_argument(
-                'host', type=str,
-                help='host name')
-        return arg_parser
-
-    @classmethod
-    def init_from_parsed_args(cls, args):
-        """Init from command line arguments"""
-        kwargs = {'host': args.host}
-        for k in ['ssh_user', 'identity_file']:
-            if hasattr(args, k):
-                kwargs[k] = getattr(args, k)
-        return cls(**kwargs)
-
-    def _obtain_cmd_list(self, command, sudo):
-        # type (str, bool) -> List[str]
-        """Return cmd_list"""
-        cmd_list = [SshHost.SSH_CMD]
-        cmd_list += self.opt_list
-        cmd_list += [self.user_host]
-        cmd_list += [('sudo ' if sudo else '') + command]
-        return cmd_list
-
-    def run_check_call(self, command, sudo=False):
-        # type (str, bool) -> None
-        """Check the command run through ssh
-
-        Args:
-            command (str): Command to be run through ssh
-            sudo (bool, optional): Defaults to False. Whether to use 'sudo'
-
-        Returns:
-            int: command exit status
-        """
-        return exec_check_call(self._obtain_cmd_list(command, sudo))
-
-    def run_check_output(self, command, sudo=False):
-        # type (str, bool) -> str
-        """Check the command run through ssh, and return stdout as string
-
-        Args:
-            command (str): Command to be run through ssh
-            sudo (bool, optional): Defaults to False. Whether to use 'sudo'
-
-        Returns:
-            str: stdout of command
-        """
-        return exec_check_output(self._obtain_cmd_list(command, sudo))
-
-    def run_chown(self, user, group, filename, options=None):
-        # type (str, str, str, List[str]) -> int
-        """Run and check chown through ssh
-
-        Args:
-            user (str): user of new owner
-            group (str): group of new owner
-            filename (str): file to be chown
-            options (List[str], optional): Defaults to None. chown option list
-
-        Returns:
-            int: command exit status
-        """
-        self.run_check_call(
-                "chown %s %s:%s %s" % (
-                        '' if not options else ' '.join(options),
-                        user, group, filename),
-                True)
-
-    def scp_to_host(
-            self, source_path, dest_path,
-            sudo=False, rm_old=False):
-        # type (str, str, bool, bool) -> None
-        """scp to host"""
-        if rm_old:
-            self.run_check_call(
-                    "rm -fr %s" % dest_path, sudo)
-
-        cmd_list = ["/usr/bin/scp", "-p"] + self.opt_list + [
-                source_path,
-                "%s:%s" % (self.user_host, dest_path)]
-        exec_check_call(cmd_list)
-
-    def rsync(self, src, dest, options=None):
-        # type (str, str, List[Str]) -> None
-        """Run rsync
-
-        Args:
-            src (str): src file/dir in rsync
-            dest (str): src file/dir in rsync
-            options (List[str], optional): Defaults to None.
-                    List of rsync options.
-        """
-        cmd_prefix = [SshHost.RSYNC_CMD] + SshHost.RSYNC_OPTIONS
-        if self.ssh_user:
-            ssh_cmd = "ssh -l {} {} {}".format(
-                    self.ssh_user,
-                    "" if not self.identity_file else "-i",
-                    "" if not self.identity_file else self.identity_file)
-            cmd_prefix += ["-e", ssh_cmd]
-
-        if options:
-            cmd_prefix += options
-        exec_check_call(cmd_prefix + [src, dest])
-
-
-class TgzHelper(object):
-    """Extract tar gz
-
-    This class uses external tar executiable, for it has better verbose output
-    """
-
-    COMMAND = '/usr/bin/tar'
-    if platform.system() == 'Windows':
-        COMMAND = "C:\\WINDOWS\\system32\\tar.exe"
-
-    def __init__(self, tgz_filename, output_dir=None):
-        self.tgz_filename = tgz_filename
-        self.output_dir = output_dir
-
-    @staticmethod
-    def run_tar(arg_list):
-        """Run the tar command
-
-        Args:
-            arg_list (List[str]): Arguments for tar
-
-        Returns:
-            int: exit status of command.
-
-        Raises:
-            CalledProcessError: When command exit status is not 0
-        """
-        print(type(arg_list))
-        print(" ".join(arg_list))
-        try:
-
-            return exec_check_call([TgzHelper.COMMAND] + arg_list)
-        except subprocess.CalledProcessError as e:
-            raise e
-
-    def list(self, extra_option_list=["-v"]):
-        """List the archive
-            extra_option_list (List[str], optional): Defaults to ["-v"].
-                Options for tar
-        """
-        option_list = ["-tzf", self.tgz_filename]
-        if extra_option_list:
-            option_list += extra_option_list
-        TgzHelper.run_tar(option_list)
-
-    def extract(self, extra_option_list=["-v"]):
-        """Extract the archive
-            extra_option_list (List[str], optional): Defaults to ["-v"].
-                Options for tar
-        """
-        option_list = ["-xzf", self.tgz_filename]
-        if extra_option_list:
-            option_list += extra_option_list
-        with working_directory(self.output_dir):
-            TgzHelper.run_tar(option_list)
-
-
-class UrlHelper(object):
-    """URL helper functions"""
-
-    def __init__(self, base_url, user, token):
-        """install the authentication handler."""
-        self.base_url = base_url
-        auth_handler = HTTPBasicAuthHandler()
-        auth_handler.add_password(
-                realm='',
-                uri=self.base_url,
-                user=user,
-                passwd=token)
-        opener = urllib.request.build_opener(auth_handler)
-        # install it for all urllib2.urlopen calls
-        urllib.request.install_opener(opener)
-
-    @staticmethod
-    def read(url):
-        # type (str) -> str
-        """Read URL"""
-        logging.debug("Reading from %s", url)
-        return urllib.request.urlopen(url).read()  # nosec
-
-    @staticmethod
-    def download_file(url, dest_file='', download_dir='.'):
-        # type (str, str, str) -> None
-        """Download file"""
-        target_file = dest_file
-        if not target_file:
-            url_parsed = urllib.request.urlparse(url)
-            target_file = os.path.basename(url_parsed.path)
-        chunk = 128 * 1024  # 128 KiB
-        target_dir = os.path.abspath(download_dir)
-        target_path = os.path.join(target_dir, target_file)
-        try:
-            os.makedirs(target_dir)
-        except OSError as exc:
-            if exc.errno == errno.EEXIST and os.path.isdir(target_dir):
-                # Dir already exists
-                pass
-            else:
-                raise
-
-        logging.info("Downloading to %s from %s", target_path, url)
-        response = urllib.request.urlopen(url)  # nosec
-        chunk_count = 0
-        with open(target_path, 'wb') as out_file:
-            while True:
-                buf = response.read(chunk)
-                if not buf:
-                    break
-                out_file.write(buf)
-                chunk_count += 1
-                if chunk_count % 100 == 0:
-                    sys.stderr.write('#')
-                    sys.stderr.flush()
-                elif chunk_count % 10 == 0:
-                    sys.stderr.write('.')
-                    sys.stderr.flush()
-        return response
-
-
 def mkdir_p(directory, mode=0o755):
     # type(str) -> None
     """Ensure the directory and intermediate directories exists,
@@ -537,6 +370,18 @@ def mkdir_p(directory, mode=0o755):
             raise
 
 
+def loose_version_key(version):
+    """Sort key of a version, compares like distutils LooseVersion
+
+    >>> loose_version_key('1.10.0-rc-1')
+    [1, 10, 0, '-', 'rc', '-', 1]
+    """
+    return [
+            int(c) if c.isdigit() else c
+            for c in VERSION_COMPONENT_PATTERN.split(version)
+            if c and c != '.']
+
+
 def version_sort(version_list, reverse=False):
     """Sort the version from list
 
@@ -558,7 +403,7 @@ def version_sort(version_list, reverse=False):
     sorted_dirty_version = sorted(
             [re.sub(
                     '^([.0-9]+)$', r'\1-zfinal', v) for v in version_list],
-            key=LooseVersion, reverse=reverse)
+            key=loose_version_key, reverse=reverse)
 
     return [re.sub('-zfinal', '', v) for v in sorted_dirty_version]
 
@@ -575,7 +420,7 @@ def run_doctest_and_quit_if_enabled():
         return
     import doctest
     test_result = doctest.testmod()
-    print(doctest.testmod(), file=sys.stderr)
+    print(test_result, file=sys.stderr)
     sys.exit(0 if test_result.failed == 0 else 1)
 
 
@@ -597,6 +442,8 @@ def working_directory(directory):
 
 def main():
     """Run as command line program"""
+    from CommonArgParser import CommonArgParser
+    from ExternalTools import GitHelper
     parser = CommonArgParser(__file__)
     parser.add_methods_as_sub_commands(GitHelper)
     parser.add_sub_command(
@@ -604,11 +451,13 @@ def main():
             help='Show Python Module help')
     args = parser.parse_all()
 
-    if hasattr(args, 'sub_command'):
-        if args.sub_command == 'module-help':
-            help(sys.modules[__name__])
-        else:
-            parser.run_sub_command(args)
+    from Profiler import Profiler
+    with Profiler.init_from_parsed_args(args, __file__).run():
+        if hasattr(args, 'sub_command'):
+            if args.sub_command == 'module-help':
+                help(sys.modules[__name__])
+            else:
+                parser.run_sub_command(args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+"""Generate a synthetic OpenSubtitles corpus in the OPUS XML format
+
+The files are written as <out_dir>/xml/<lang>/<year>/<imdb_id>/<doc_id>.xml.gz
+like the OPUS OpenSubtitles releases, so it can be fed to both
+XmlExporter and FileExtractor (after tar).
+
+The same seed always generates the same corpus.
+"""
+
+import gzip
+import logging
+import os
+import random
+import zlib
+import CommonFunctions
+
+from xml.sax.saxutils import escape
+from CommonArgParser import CommonArgParser
+from Profiler import Profiler
+
+VOCABULARY_SIZE = 5000
+FIRST_DOCUMENT_ID = 4000000
+# DocumentIds of other languages than en start in one of LANG_ID_SLOTS
+# ranges of LANG_ID_RANGE ids after those of en, see first_document_id()
+LANG_ID_SLOTS = 1000
+LANG_ID_RANGE = 1000000
+
+
+def first_document_id(lang: str):
+    """First DocumentId of the documents of a language
+
+    Like in OPUS, DocumentIds are unique across languages: each language
+    gets its own range by a stable hash of its code, which differs for
+    all OPUS languages. en keeps FIRST_DOCUMENT_ID.
+
+    >>> first_document_id('en'), first_document_id('fr')
+    (4000000, 723000000)
+    """
+    if lang == 'en':
+        return FIRST_DOCUMENT_ID
+    slot = zlib.crc32(lang.encode('utf-8')) % LANG_ID_SLOTS
+    return FIRST_DOCUMENT_ID + (slot + 1) * LANG_ID_RANGE
+
+
+class CorpusGenerator(object):
+    """Generate OPUS-shaped XML documents
+
+    Args:
+        out_dir (str): Output directory
+        lang (str, optional): Defaults to 'en'. Language code in the path.
+        sentences (int, optional): Defaults to 500. Sentences per document.
+        words (int, optional): Defaults to 8. Mean words per sentence.
+        gzipped (bool, optional): Defaults to True. Write .xml.gz
+        spread (float, optional): Defaults to 0. Log-normal sigma of
+            sentences per document, 0 makes all documents the same size.
+        seed (int, optional): Defaults to 0. Random seed.
+        first_id (int, optional): Defaults to first_document_id(lang).
+            DocumentId of the first document
+
+    Examples:
+    >>> g = CorpusGenerator('/tmp', seed=1)
+    >>> g.relative_path(FIRST_DOCUMENT_ID)
+    'xml/en/2010/100000/4000000.xml.gz'
+    >>> xml = g.document(FIRST_DOCUMENT_ID, 2)
+    >>> xml.count('<s id='), xml.count('<time id=')
+    (2, 4)
+    """
+
+    def __init__(
+            self, out_dir, lang='en', sentences=500, words=8, gzipped=True,
+            spread=0.0, seed=0, first_id=None):
+        # type: (str, str, int, int, bool, float, int, int) -> None
+        self.out_dir = out_dir
+        self.lang = lang
+        self.first_id = (
+                first_document_id(lang) if first_id is None else first_id)
+        self.sentences = sentences
+        self.words = words
+        self.gzipped = gzipped
+        self.spread = spread
+        self.seed = seed
+        rand = random.Random(seed)
+        self.vocabulary = [
+                ''.join(rand.choice('abcdefghijklmnopqrstuvwxyz')
+                        for _ in range(rand.randint(1, 10)))
+                for _ in range(VOCABULARY_SIZE)]
+        # Zipf-like weights, so word frequency looks like natural language
+        self.cum_weights = []
+        total = 0.0
+        for rank in range(1, VOCABULARY_SIZE + 1):
+            total += 1.0 / rank
+            self.cum_weights.append(total)
+
+    def relative_path(self, doc_id: int):
+        """Path of the document relative to out_dir"""
+        year = 1950 + doc_id % 70
+        # The n-th documents of all languages are of the same movies
+        imdb_id = 100000 + (doc_id - self.first_id) // 3
+        return "xml/%s/%d/%d/%d.xml%s" % (
+                self.lang, year, imdb_id, doc_id,
+                '.gz' if self.gzipped else '')
+
+    @staticmethod
+    def format_time(ms: int):
+        """Format milliseconds as OPUS time
+
+        >>> CorpusGenerator.format_time(3723004)
+        '01:02:03,004'
+        """
+        seconds, ms = divmod(ms, 1000)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return "%02d:%02d:%02d,%03d" % (hours, minutes, seconds, ms)
+
+    def document(self, doc_id: int, sentences: int = None):
+        """Return XML content of a document"""
+        rand = random.Random(self.seed * 1000003 + doc_id)
+        if sentences is None:
+            sentences = max(1, int(
+                    self.sentences * rand.lognormvariate(0, self.spread)))
+        lines = [
+                '<?xml version="1.0" encoding="utf-8"?>',
+                '<document id="%d">' % doc_id]
+        ms = rand.randint(1000, 60000)
+        time_id = 0
+        tokens = 0
+        for s_id in range(1, sentences + 1):
+            lines.append('  <s id="%d">' % s_id)
+            # Most subtitle blocks are a sentence,
+            # but some sentences span 2 blocks
+            time_id += 1
+            lines.append('    <time id="T%dS" value="%s" />' % (
+                    time_id, self.format_time(ms)))
+            word_count = max(1, int(rand.gauss(self.words, 3)))
+            words = rand.choices(
+                    self.vocabulary, cum_weights=self.cum_weights,
+                    k=word_count)
+            split_at = rand.randint(2, word_count) if (
+                    word_count > 4 and rand.random() < 0.2) else 0
+            for w_id, word in enumerate(words, start=1):
+                if w_id == split_at:
+                    ms += rand.randint(800, 4000)
+                    lines.append('    <time id="T%dE" value="%s" />' % (
+                            time_id, self.format_time(ms)))
+                    ms += rand.randint(50, 500)
+                    time_id += 1
+                    lines.append('    <time id="T%dS" value="%s" />' % (
+                            time_id, self.format_time(ms)))
+                lines.append('    <w id="%d.%d">%s</w>' % (
+                        s_id, w_id, escape(word)))
+            tokens += word_count
+            ms += rand.randint(800, 4000)
+            lines.append('    <time id="T%dE" value="%s" />' % (
+                    time_id, self.format_time(ms)))
+            ms += rand.randint(50, 3000)
+            lines.append('  </s>')
+        year = 1950 + doc_id % 70
+        lines += [
+                '  <meta>',
+                '    <conversion>',
+                '      <corrected_words>0</corrected_words>',
+                '      <sentences>%d</sentences>' % sentences,
+                '      <tokens>%d</tokens>' % tokens,
+                '      <encoding>utf-8</encoding>',
+                '      <unknown_words>0</unknown_words>',
+                '    </conversion>',
+                '    <source>',
+                '      <original>Synthetic %d</original>' % doc_id,
+                '      <year>%d</year>' % year,
+                '      <duration>%s</duration>' % self.format_time(ms),
+                '      <genre>Comedy,Drama</genre>',
+                '      <country>Nowhere</country>',
+                '    </source>',
+                '    <subtitle>',
+                '      <language>%s</language>' % self.lang,
+                '      <date>%d-01-01</date>' % (year + 10),
+                '      <duration>%s</duration>' % self.format_time(ms),
+                '      <cds>1/1</cds>',
+                '      <blocks>%d</blocks>' % time_id,
+                '      <confidence>1.0</confidence>',
+                '    </subtitle>',
+                '  </meta>',
+                '</document>',
+                '']
+        return '\n'.join(lines)
+
+    def write(self, count: int, start_id: int = None):
+        """Write count documents from start_id (Default: first_id),
+        returns list of written files"""
+        if start_id is None:
+            start_id = self.first_id
+        written = []
+        for doc_id in range(start_id, start_id + count):
+            path = os.path.join(self.out_dir, self.relative_path(doc_id))
+            CommonFunctions.mkdir_p(os.path.dirname(path))
+            content = self.document(doc_id).encode('utf-8')
+            if self.gzipped:
+                # mtime=0 makes the gz output reproducible
+                with gzip.GzipFile(path, mode='wb', mtime=0) as f:
+                    f.write(content)
+            else:
+                with open(path, mode='wb') as f:
+                    f.write(content)
+            logging.debug("Written %s", path)
+            written.append(path)
+        return written
+
+
+def main():
+    """Run as command line program"""
+    parser = CommonArgParser(__file__)
+    parser.add_argument(
+            '-l', '--lang', type=str, default='en',
+            help='Language code in the path (Default: en)')
+    parser.add_argument(
+            '-n', '--files', type=int, default=100,
+            help='Number of documents (Default: 100)')
+    parser.add_argument(
+            '-s', '--sentences', type=int, default=500,
+            help='Sentences per document (Default: 500)')
+    parser.add_argument(
+            '-w', '--words', type=int, default=8,
+            help='Mean words per sentence (Default: 8)')
+    parser.add_argument(
+            '--spread', type=float, default=0.0,
+            help='Log-normal sigma of document sizes (Default: 0)')
+    parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed (Default: 0)')
+    parser.add_argument(
+            '--first-id', type=int,
+            help='DocumentId of the first document (Default: %d for en,'
+            ' a range by hash of the language code for others, so that'
+            ' DocumentIds are unique across languages)' % FIRST_DOCUMENT_ID)
+    parser.add_argument(
+            '--no-gzip', action='store_true',
+            help='Write plain .xml instead of .xml.gz')
+    parser.add_argument('out_dir', help='Output directory')
+    args = parser.parse_all()
+    generator = CorpusGenerator(
+            args.out_dir, args.lang, args.sentences, args.words,
+            not args.no_gzip, args.spread, args.seed, args.first_id)
+    with Profiler.init_from_parsed_args(args, __file__).run():
+        written = generator.write(args.files)
+    logging.info("Written %d files to %s", len(written), args.out_dir)
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
+    main()
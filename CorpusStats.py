@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""CorpusStats counts words, n-grams and sentence lengths during ingest
+
+So frequency lists do not need a GROUP BY Word over words_<lang>.
+
+Counting is bounded in memory: when the counters hold more than
+max_entries keys, they are spilled to a sorted run file in spill_dir.
+At the end, the runs of all processes are merged like a merge sort,
+summing the counts of equal keys, and written to the summary tables:
+
+  ngram_freq_<lang> (N, Ngram, Count, Documents)
+  sentence_length_<lang> (Length, Sentences)
+
+Words of an n-gram are separated by a space. N-grams longer than
+MAX_NGRAM_CHARS characters or MAX_NGRAM_BYTES UTF-8 bytes are not
+stored: PostgreSQL limits the size of B-tree entries of the primary key
+to about a third of a page.
+"""
+
+import glob
+import heapq
+import itertools
+import logging
+import os
+import sys
+
+import CommonFunctions
+
+from collections import Counter
+from xml.etree.ElementTree import Element as XmlNode
+from DbHandler import DbHandler
+
+try:
+    from typing import Iterator, List, Tuple  # noqa: F401
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+MAX_NGRAM = 3
+# Rows per bulk insert when writing the summary tables
+WRITE_CHUNK_ROWS = 10000
+# Run files are tab separated lines
+KEY_ESCAPE = str.maketrans({'\t': ' ', '\n': ' ', '\r': ' '})
+# Longest Ngram stored, see is_storable()
+MAX_NGRAM_CHARS = 800
+MAX_NGRAM_BYTES = 2000
+
+
+def is_storable(ngram: str):
+    """Whether the n-gram fits into the primary key of ngram_freq_<lang>
+
+    >>> is_storable('a b'), is_storable('\\u4e2d' * 700)
+    (True, False)
+    """
+    if len(ngram) > MAX_NGRAM_CHARS:
+        return False
+    # A character is 4 UTF-8 bytes at most
+    return len(ngram) * 4 <= MAX_NGRAM_BYTES or len(
+            ngram.encode('utf-8')) <= MAX_NGRAM_BYTES
+
+
+class CorpusStats(object):
+    """Counters of the documents ingested by this process
+
+    Args:
+        spill_dir (str): Directory of the sorted run files,
+            shared by the worker processes of a run
+        max_n (int, optional): Defaults to 1. Count n-grams up to max_n
+        max_entries (int, optional): Defaults to 1000000.
+            Spill when the counters hold more keys
+
+    Examples:
+    >>> import tempfile, xml.etree.ElementTree as ETree
+    >>> stats = CorpusStats(tempfile.mkdtemp(), max_n=2)
+    >>> stats.add_document(ETree.fromstring(
+    ...         '<document id="1"><s id="1"><w id="1.1">a</w>'
+    ...         '<w id="1.2">b</w><w id="1.3">a</w></s></document>'))
+    >>> stats.add_document(ETree.fromstring(
+    ...         '<document id="2"><s id="1"><w id="1.1">a</w></s>'
+    ...         '<s id="2"><w id="2.1">c</w></s></document>'))
+    >>> stats.spill()
+    >>> list(stats.merged_ngrams(1))
+    [('a', 3, 2), ('b', 1, 1), ('c', 1, 1)]
+    >>> list(stats.merged_ngrams(2))
+    [('a b', 1, 1), ('b a', 1, 1)]
+    >>> list(stats.merged_lengths())
+    [(1, 2), (3, 1)]
+    """
+
+    def __init__(self, spill_dir, max_n=1, max_entries=1000000):
+        # type: (str, int, int) -> None
+        if not 1 <= max_n <= MAX_NGRAM:
+            raise ValueError("Unsupported n-gram size: %d" % max_n)
+        self.spill_dir = spill_dir
+        self.max_n = max_n
+        self.max_entries = max_entries
+        # Index n - 1
+        self.counts = [Counter() for _ in range(max_n)]
+        self.documents = [Counter() for _ in range(max_n)]
+        self.lengths = Counter()
+        self.runs = 0
+
+    def add_document(self, root: XmlNode):
+        """Count the words of a parsed document"""
+        doc_counts = [Counter() for _ in range(self.max_n)]
+        for s in root.iter('s'):
+            tokens = [
+                    w.text.translate(KEY_ESCAPE)
+                    for w in s.iter('w') if w.text]
+            self.lengths[len(tokens)] += 1
+            doc_counts[0].update(tokens)
+            if self.max_n >= 2:
+                doc_counts[1].update(map(' '.join, zip(tokens, tokens[1:])))
+            if self.max_n >= 3:
+                doc_counts[2].update(map(' '.join, zip(
+                        tokens, tokens[1:], tokens[2:])))
+        for counts, documents, doc_count in zip(
+                self.counts, self.documents, doc_counts):
+            counts.update(doc_count)
+            documents.update(doc_count.keys())
+        if sum(len(c) for c in self.counts) > self.max_entries:
+            self.spill()
+
+    def _run_file(self, name: str):
+        return os.path.join(self.spill_dir, "%s-%d-%d.tsv" % (
+                name, os.getpid(), self.runs))
+
+    def spill(self):
+        """Write the counters to sorted run files and clear them"""
+        if not self.lengths:
+            return
+        for n, (counts, documents) in enumerate(
+                zip(self.counts, self.documents), start=1):
+            with open(self._run_file("ngram%d" % n), 'w',
+                      encoding='utf-8') as f:
+                for key in sorted(counts):
+                    f.write("%s\t%d\t%d\n" % (
+                            key, counts[key], documents[key]))
+            counts.clear()
+            documents.clear()
+        with open(self._run_file('length'), 'w', encoding='utf-8') as f:
+            for length in sorted(self.lengths):
+                f.write("%d\t%d\n" % (length, self.lengths[length]))
+        self.lengths.clear()
+        logging.debug("Spilled counters to run %d", self.runs)
+        self.runs += 1
+
+    @staticmethod
+    def _read_run(filename, key_type=str):
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                yield (key_type(fields[0]),) + tuple(map(int, fields[1:]))
+
+    def _merge(self, name: str, key_type=str):
+        runs = [
+                self._read_run(filename, key_type)
+                for filename in sorted(glob.glob(os.path.join(
+                        self.spill_dir, "%s-*.tsv" % name)))]
+        for key, rows in itertools.groupby(
+                heapq.merge(*runs, key=lambda row: row[0]),
+                key=lambda row: row[0]):
+            yield (key,) + tuple(map(sum, zip(*(row[1:] for row in rows))))
+
+    def merged_ngrams(self, n: int):
+        # type: (int) -> Iterator[Tuple[str, int, int]]
+        """(n-gram, count, documents) of all runs, sorted by n-gram"""
+        return self._merge("ngram%d" % n)
+
+    def merged_lengths(self):
+        # type: () -> Iterator[Tuple[int, int]]
+        """(sentence length, sentences) of all runs"""
+        return self._merge('length', int)
+
+    @staticmethod
+    def table_names(lang: str):
+        return f"ngram_freq_{lang}", f"sentence_length_{lang}"
+
+    def ensure_tables(self, db_handler: DbHandler):
+        ngram_table, length_table = self.table_names(db_handler.args.lang)
+        if not db_handler.is_table_present(ngram_table):
+            logging.info(f"Table {ngram_table} is not present, creating")
+            db_handler.execute(f"""
+                    CREATE TABLE {ngram_table} (
+                        N smallint NOT NULL,
+                        Ngram varchar({MAX_NGRAM_CHARS}) NOT NULL,
+                        Count bigint NOT NULL,
+                        Documents int NOT NULL,
+                        PRIMARY KEY (N, Ngram));""")
+        if not db_handler.is_table_present(length_table):
+            logging.info(f"Table {length_table} is not present, creating")
+            db_handler.execute(f"""
+                    CREATE TABLE {length_table} (
+                        Length int NOT NULL,
+                        Sentences bigint NOT NULL,
+                        PRIMARY KEY (Length));""")
+
+    def write(self, db_handler: DbHandler, min_count=1):
+        """Replace the summary tables with the merged runs
+
+        Args:
+            db_handler (DbHandler): connected DB handler
+            min_count (int, optional): Defaults to 1.
+                Drop the n-grams seen less often, to trim the long tail
+
+        N-grams that are not is_storable() are dropped too.
+        """
+        self.spill()
+        self.ensure_tables(db_handler)
+        ngram_table, length_table = self.table_names(db_handler.args.lang)
+        with db_handler.transaction():
+            db_handler.execute(f"DELETE FROM {ngram_table};")
+            db_handler.execute(f"DELETE FROM {length_table};")
+            for n in range(1, self.max_n + 1):
+                rows = (
+                        (n, key, count, documents)
+                        for key, count, documents in self.merged_ngrams(n)
+                        if count >= min_count and is_storable(key))
+                written = self._bulk_insert(
+                        db_handler, ngram_table,
+                        ['N', 'Ngram', 'Count', 'Documents'], rows)
+                logging.info("Written %d %d-grams", written, n)
+            self._bulk_insert(
+                    db_handler, length_table, ['Length', 'Sentences'],
+                    self.merged_lengths())
+
+    @staticmethod
+    def _bulk_insert(db_handler: DbHandler, table_name, columns, rows):
+        """Insert in chunks, so the merged runs are never all in memory"""
+        written = 0
+        while True:
+            chunk = list(itertools.islice(rows, WRITE_CHUNK_ROWS))
+            if not chunk:
+                return written
+            db_handler.bulk_insert(table_name, columns, chunk)
+            written += len(chunk)
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
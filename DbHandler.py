@@ -1,17 +1,37 @@
 #!/usr/bin/env python
 """DbHandler methods like connecting and inserting
 """
+import io
 import logging
+import os
+import re
 import sys
+import time
 
 import CommonFunctions
 
+from array import array
 from abc import ABC, abstractmethod
 from argparse import Namespace
-from decimal import Decimal
+from contextlib import contextmanager
+from datetime import timedelta
 from xml.etree.ElementTree import Element as XmlNode
 
 
+try:
+    from typing import Any, Callable, Dict, List, Set  # noqa: F401
+    from typing import Tuple  # noqa: F401
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+# Characters of a SQL command shown in DEBUG log
+LOG_SQL_CHARS = 300
+# Seconds of the longest wait between retries of --retries
+MAX_RETRY_DELAY = 60
+# OPUS time looks like: 01:02:03,004
+TIME_PATTERN = re.compile(r'(\d+):(\d+):(\d+)(?:[,.](\d+))?')
+
+
 class UnsupportedDbError(Exception):
     def __init__(self, db_product):
         super(UnsupportedDbError, self).__init__()
@@ -21,41 +41,312 @@ class UnsupportedDbError(Exception):
         return "Unsupported Db: %s" % self.db_product
 
 
+class DuplicateDocumentIdError(ValueError):
+    """A DocumentId that is also a document of another language of the
+    export: they would share, and replace, each other's rows of meta"""
+
+    def __init__(self, document_id, lang, other_lang):
+        # Arguments are kept for pickling, e.g. out of worker processes
+        super(DuplicateDocumentIdError, self).__init__(
+                document_id, lang, other_lang)
+        self.document_id = document_id
+        self.lang = lang
+        self.other_lang = other_lang
+
+    def __str__(self):
+        return "DocumentId %s of %s is also a document of %s" % (
+                self.document_id, self.lang, self.other_lang)
+
+
+class ColumnBuffer(object):
+    """Rows stored column by column
+
+    Integer columns are array('i'), so a buffered word costs 3 machine
+    ints and a list slot instead of a tuple of 4 boxed objects.
+    Iterating yields the rows as tuples.
+
+    Args:
+        types (str): Type of each column, 'i' for int, 's' for anything else
+
+    Examples:
+    >>> buf = ColumnBuffer('iis')
+    >>> buf.append(1, 2, 'a')
+    >>> buf.append(1, 3, 'b')
+    >>> len(buf), list(buf)
+    (2, [(1, 2, 'a'), (1, 3, 'b')])
+    """
+    __slots__ = ['types', 'columns']
+
+    def __init__(self, types: str):
+        self.types = types
+        self.columns = [array('i') if t == 'i' else [] for t in types]
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __iter__(self):
+        return zip(*self.columns)
+
+    def append(self, *values):
+        for column, value in zip(self.columns, values):
+            column.append(value)
+
+    def extend(self, other):
+        # type: (ColumnBuffer) -> None
+        for column, other_column in zip(self.columns, other.columns):
+            column.extend(other_column)
+
+    def truncate(self, size: int):
+        """Remove the rows after the first size rows
+
+        >>> buf = ColumnBuffer('is')
+        >>> for i in range(3):
+        ...     buf.append(i, str(i))
+        >>> buf.truncate(1)
+        >>> list(buf)
+        [(0, '0')]
+        """
+        for column in self.columns:
+            del column[size:]
+
+    def nbytes(self):
+        """Approximate memory of the buffered values"""
+        return sum(
+                len(column) * column.itemsize if isinstance(column, array)
+                else len(column) * 8 + sum(map(sys.getsizeof, column))
+                for column in self.columns)
+
+
+class RowBatch(object):
+    """Buffered rows of documents to be replaced in one transaction"""
+
+    def __init__(self):
+        self.documents = 0
+        # DocumentIds whose old rows are deleted before the load
+        self.delete_ids = set()  # type: Set[int]
+        # DocumentId, SentenceId, WordId, Word
+        self.words = ColumnBuffer('iiis')
+        # DocumentId, TimeId, StartSentenceId, StartWordId, StartMs,
+        # EndSentenceId, EndWordId, EndMs, see DbHandler.time_rows()
+        self.times = ColumnBuffer('iiiiiiii')
+        self.metas = []  # type: List[tuple]
+        self.document_rows = []  # type: List[tuple]
+        # Called inside the transaction, after the rows are loaded
+        self.callbacks = []  # type: List[Callable]
+        # Keys of the current document, duplicates would violate primary key
+        self.word_keys = set()  # type: Set[tuple]
+        self.time_keys = set()  # type: Set[tuple]
+        self.meta_keys = set()  # type: Set[str]
+
+    def extend(self, other):
+        # type: (RowBatch) -> None
+        """Append the documents of other batch"""
+        self.documents += other.documents
+        self.delete_ids.update(other.delete_ids)
+        self.words.extend(other.words)
+        self.times.extend(other.times)
+        self.metas.extend(other.metas)
+        self.document_rows.extend(other.document_rows)
+        self.callbacks.extend(other.callbacks)
+
+    def nbytes(self):
+        """Approximate memory of the rows, for byte bounded buffers"""
+        return (
+                self.words.nbytes() + self.times.nbytes()
+                + sum(map(sys.getsizeof, self.metas))
+                + sum(sys.getsizeof(v) for row in self.metas for v in row)
+                + sum(map(sys.getsizeof, self.document_rows)))
+
+
 class DbHandler(ABC):
+    WORDS_COLUMNS = ['DocumentId', 'SentenceId', 'WordId', 'Word']
+    TIME_COLUMNS = [
+            'DocumentId', 'TimeId', 'StartSentenceId', 'StartWordId',
+            'StartTime', 'EndSentenceId', 'EndWordId', 'EndTime']
+    META_COLUMNS = ['DocumentId', 'Key', 'Value']
+    DOCUMENT_COLUMNS = [
+            'DocumentId', 'Year', 'DurationMs', 'Original', 'Genre',
+            'Country', 'Language', 'Sentences', 'Tokens']
+    # Columns of documents table from <meta> elements: path -> (column, type)
+    DOCUMENT_META = {
+            'source.year': ('Year', int),
+            'source.duration': ('DurationMs', 'time_ms'),
+            'source.original': ('Original', str),
+            'source.genre': ('Genre', str),
+            'source.country': ('Country', str),
+            'subtitle.language': ('Language', str)}
+    # Declared width of the varchar columns of documents table
+    DOCUMENT_WIDTHS = {
+            'Original': 255, 'Genre': 255, 'Country': 255, 'Language': 16}
+    # Indexed columns of documents table, for slicing the corpus
+    DOCUMENT_INDEXES = [
+            'Year', 'DurationMs', 'Genre', 'Language', 'Sentences', 'Tokens']
+
     def __init__(self, args):
         self.args = args
         self.conn = None
+        # DSN of --db-dsn this handler connects to, see get_handler()
+        self.dsn = self.shard_dsn(args)
+        # execute() runs for every row in row-by-row mode
+        self.log_sql = logging.getLogger().isEnabledFor(logging.DEBUG)
+        # Also store time as integer milliseconds
+        self.time_ms = getattr(args, 'time_ms', False)
         self.document_id = -1
         self.s_id = -1
         self.w_real_id = -1
         self.time_id = -1
-        self.start_time = ''
+        self.start_ms = -1
         self.start_s_id = -1
         self.start_w_id = -1
-        self.end_time = ''
+        self.end_ms = -1
         self.end_s_id = -1
         self.end_w_id = -1
+        self.sentence_count = 0
+        # Columns of documents table of the current document
+        self.document_values = {}
+        # Rows of the current document, by table
+        self.row_counts = {'words': 0, 'time': 0, 'meta': 0}
+        # Replace mode: documents are deleted then bulk loaded in batches
+        self.replace = getattr(args, 'replace', False)
+        self.batch_documents = getattr(args, 'batch_documents', 100)
+        self.batch = RowBatch()
+        # Batch sizes when the current document started, see
+        # abandon_document(). None between documents
+        self.document_marks = None  # type: tuple
+        # Row-by-row mode: table and key of each row of the current
+        # document inserted so far, see abandon_document()
+        self.inserted_keys = []  # type: List[Tuple[str, Dict[str, Any]]]
+        # Retries of transient DB errors, see with_retry()
+        self.retries = getattr(args, 'retries', 0)
+        self.retry_delay = getattr(args, 'retry_delay', 1.0)
+        self.in_transaction = False
+        # Handler whose connection this one shares, see lang_handler()
+        self.primary = None  # type: DbHandler
+        # Claim DocumentIds for the language, see check_document_id()
+        self.claim_document_ids = False
 
     @staticmethod
     def get_handler(args):
+        """Handler of args.db_product
+
+        With --db-dsn, the handler connects to the DSN of args.shard:
+        shard i writes to the i % (number of DSNs)-th DSN"""
         if args.db_product == 'postgresql':
             return PostgreSQLHandler(args)
+        elif args.db_product == 'sqlite':
+            return SQLiteHandler(args)
         else:
             raise UnsupportedDbError(args.db_product)
 
     @staticmethod
-    def parse_time(time_str: str):
-        toks = time_str.split(':')
-        hours = int(toks[0])
-        days = hours // 24
-        hours = hours % 24
-        minutes = int(toks[1])
-        seconds = Decimal(toks[2].replace(',', '.'))
-        ret = ""
+    def shard_dsn(args):
+        """DSN of --db-dsn for the --shard of args, or None
+
+        >>> from Sharding import Shard
+        >>> args = Namespace(db_dsn=['a', 'b'], shard=Shard(3, 4))
+        >>> DbHandler.shard_dsn(args)
+        'b'
+        >>> DbHandler.shard_dsn(Namespace(db_dsn=['a', 'b']))
+        'a'
+        """
+        dsns = getattr(args, 'db_dsn', None)
+        if not dsns:
+            return None
+        shard = getattr(args, 'shard', None)
+        return dsns[shard.index % len(dsns) if shard else 0]
+
+    def route_db_name(self, db_name: str):
+        """Use db_name of the DSN in place of --db-name"""
+        self.args = Namespace(**vars(self.args))
+        self.args.db_name = db_name
+
+    @staticmethod
+    def parse_time_ms(time_str: str, match=TIME_PATTERN.fullmatch):
+        """Parse OPUS time string to integer milliseconds, ValueError if
+        it is not one
+
+        Surrounding whitespace is ignored, digits of the fraction beyond
+        milliseconds are truncated.
+
+        >>> DbHandler.parse_time_ms('01:02:03,004')
+        3723004
+        >>> DbHandler.parse_time_ms('00:00:01,5')
+        1500
+        >>> DbHandler.parse_time_ms(' 00:00:02\\n')
+        2000
+        >>> DbHandler.parse_time_ms('00:00:01,0045')
+        1004
+        >>> try:
+        ...     DbHandler.parse_time_ms('1:2:3xyz')
+        ... except ValueError as e:
+        ...     print(e)
+        Invalid time: 1:2:3xyz
+        """
+        m = match(time_str.strip())
+        if not m:
+            raise ValueError("Invalid time: %s" % time_str)
+        hours, minutes, seconds, frac = m.groups()
+        ms = ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000
+        if frac:
+            ms += int(frac[:3].ljust(3, '0'))
+        return ms
+
+    @staticmethod
+    def parse_time_delta(time_str: str):
+        """Parse OPUS time string to timedelta
+
+        >>> DbHandler.parse_time_delta('25:00:00,250')
+        datetime.timedelta(days=1, seconds=3600, microseconds=250000)
+        """
+        return timedelta(milliseconds=DbHandler.parse_time_ms(time_str))
+
+    @staticmethod
+    def format_interval(ms: int):
+        """Format milliseconds as SQL interval string
+
+        >>> DbHandler.format_interval(3723004)
+        '1:2:3.004'
+        >>> DbHandler.format_interval(90000000)
+        '1 1:0:0.000'
+        """
+        seconds, ms = divmod(ms, 1000)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        days, hours = divmod(hours, 24)
         if days > 0:
-            ret = f"{days} "
-        ret += f"{hours}:{minutes}:{seconds}"
-        return ret
+            return f"{days} {hours}:{minutes}:{seconds}.{ms:03d}"
+        return f"{hours}:{minutes}:{seconds}.{ms:03d}"
+
+    def interval(self, ms: int):
+        """Value of interval column to be written"""
+        return DbHandler.format_interval(ms)
+
+    def time_rows(self, times: ColumnBuffer):
+        """Rows of time table from buffered times in milliseconds"""
+        interval = self.interval
+        if self.time_ms:
+            for (doc_id, time_id, start_s_id, start_w_id, start_ms,
+                    end_s_id, end_w_id, end_ms) in times:
+                yield (
+                        doc_id, time_id, start_s_id, start_w_id,
+                        interval(start_ms), end_s_id, end_w_id,
+                        interval(end_ms), start_ms, end_ms)
+        else:
+            for (doc_id, time_id, start_s_id, start_w_id, start_ms,
+                    end_s_id, end_w_id, end_ms) in times:
+                yield (
+                        doc_id, time_id, start_s_id, start_w_id,
+                        interval(start_ms), end_s_id, end_w_id,
+                        interval(end_ms))
+
+    @staticmethod
+    def parse_time(time_str: str):
+        """Parse OPUS time string to SQL interval string
+
+        >>> DbHandler.parse_time('00:00:13,438')
+        '0:0:13.438'
+        """
+        return DbHandler.format_interval(DbHandler.parse_time_ms(time_str))
 
     @abstractmethod
     def admin_connect(self):
@@ -70,12 +361,73 @@ class DbHandler(ABC):
         """
         return self.conn
 
+    def is_transient(self, error: Exception):
+        """Whether the error may go away by reconnecting and retrying"""
+        return False
+
+    def reconnect(self):
+        if self.primary:
+            self.primary.reconnect()
+            self.conn = self.primary.conn
+            return
+        if self.conn:
+            try:
+                self.conn.close()
+            except Exception:
+                # The connection is broken already
+                pass
+        self.connect()
+
+    def with_retry(self, func: Callable, *args):
+        """Call func, reconnect and call it again on transient DB errors
+
+        It retries up to args.retries times, waiting args.retry_delay
+        seconds before the first retry, doubled for each of the next.
+        func must be safe to call again, e.g. a whole transaction.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                if attempt:
+                    self.reconnect()
+                return func(*args)
+            except Exception as e:
+                if attempt == self.retries or not self.is_transient(e):
+                    raise
+                delay = min(self.retry_delay * 2 ** attempt, MAX_RETRY_DELAY)
+                logging.warning(
+                        "DB error: %s, retry %d/%d in %.1f s",
+                        str(e).strip(), attempt + 1, self.retries, delay)
+                time.sleep(delay)
+
     def execute(self, cmd: str, vars=None):
+        if self.in_transaction or not self.retries:
+            return self.execute_once(cmd, vars)
+        # Outside transactions statements are committed one by one,
+        # and the inserts of row-by-row mode skip existing rows
+        return self.with_retry(self.execute_once, cmd, vars)
+
+    def execute_once(self, cmd: str, vars=None):
         cur = self.conn.cursor()
-        logging.debug("Execute command: %s", cmd)
+        if self.log_sql:
+            logging.debug(
+                    "Execute command: %s%s", cmd[:LOG_SQL_CHARS],
+                    "..." if len(cmd) > LOG_SQL_CHARS else "")
         cur.execute(cmd, vars)
         return cur
 
+    def stream(self, cmd: str, vars=None, itersize=2000):
+        """Iterate the rows of a query, fetching itersize rows at a time"""
+        cur = self.execute(cmd, vars)
+        cur.arraysize = itersize
+        try:
+            while True:
+                rows = cur.fetchmany()
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cur.close()
+
     @abstractmethod
     def is_db_present(self, db_name=None):
         if not db_name:
@@ -96,6 +448,16 @@ class DbHandler(ABC):
         self.execute(
             'CREATE DATABASE %s;' % db_name)
 
+    def drop_db(self, db_name: str):
+        """Drop DB
+
+        Args:
+            db_name (str): DB name
+        """
+        logging.info("Dropping DB %s", db_name)
+        self.execute(
+            'DROP DATABASE IF EXISTS %s;' % db_name)
+
     def ensure_table_words(self):
         table_name = f"words_{self.args.lang}"
         if self.is_table_present(table_name):
@@ -107,10 +469,8 @@ class DbHandler(ABC):
                     DocumentId int NOT NULL,
                     SentenceId int NOT NULL,
                     WordId int NOT NULL,
-                    Word varchar(255) NOT NULL);""")
-        self.execute(f"""
-                ALTER TABLE {table_name} ADD PRIMARY KEY
-                (DocumentId, SentenceId, WordId);""")
+                    Word varchar(255) NOT NULL,
+                    PRIMARY KEY (DocumentId, SentenceId, WordId));""")
 
     def ensure_table_meta(self):
         table_name = "meta"
@@ -122,10 +482,21 @@ class DbHandler(ABC):
                 CREATE TABLE {table_name} (
                     DocumentId int NOT NULL,
                     Key varchar(255) NOT NULL,
-                    Value varchar(255) NOT NULL);""")
+                    Value varchar(255) NOT NULL,
+                    PRIMARY KEY (DocumentId, Key));""")
+
+    def ensure_table_document_langs(self):
+        """Language of each DocumentId of multi-language exports"""
+        table_name = "document_langs"
+        if self.is_table_present(table_name):
+            return
+        else:
+            logging.info(f"Table {table_name} is not present, creating")
         self.execute(f"""
-                ALTER TABLE {table_name} ADD PRIMARY KEY
-                (DocumentId, Key);""")
+                CREATE TABLE {table_name} (
+                    DocumentId int NOT NULL,
+                    Lang varchar(16) NOT NULL,
+                    PRIMARY KEY (DocumentId));""")
 
     def ensure_table_time(self):
         table_name = f"time_{self.args.lang}"
@@ -133,6 +504,9 @@ class DbHandler(ABC):
             return
         else:
             logging.info(f"Table {table_name} is not present, creating")
+        ms_columns = """
+                    StartMs int NOT NULL,
+                    EndMs int NOT NULL,""" if self.time_ms else ''
         self.execute(f"""
                 CREATE TABLE {table_name} (
                     DocumentId int NOT NULL,
@@ -142,13 +516,76 @@ class DbHandler(ABC):
                     StartTime  interval NOT NULL,
                     EndSentenceId int NOT NULL,
                     EndWordId int NOT NULL,
-                    EndTime interval NOT NULL
+                    EndTime interval NOT NULL,{ms_columns}
+                    PRIMARY KEY (DocumentId, TimeId, StartSentenceId)
                     );""")
+
+    def ensure_table_documents(self):
+        table_name = f"documents_{self.args.lang}"
+        if self.is_table_present(table_name):
+            return
+        else:
+            logging.info(f"Table {table_name} is not present, creating")
         self.execute(f"""
-                ALTER TABLE {table_name} ADD PRIMARY KEY
-                (DocumentId, TimeId, StartSentenceId);""")
+                CREATE TABLE {table_name} (
+                    DocumentId int NOT NULL,
+                    Year int,
+                    DurationMs int,
+                    Original varchar({self.DOCUMENT_WIDTHS['Original']}),
+                    Genre varchar({self.DOCUMENT_WIDTHS['Genre']}),
+                    Country varchar({self.DOCUMENT_WIDTHS['Country']}),
+                    Language varchar({self.DOCUMENT_WIDTHS['Language']}),
+                    Sentences int NOT NULL,
+                    Tokens int NOT NULL,
+                    PRIMARY KEY (DocumentId));""")
+        for column in self.DOCUMENT_INDEXES:
+            self.execute(f"""
+                    CREATE INDEX {table_name}_{column.lower()}
+                    ON {table_name} ({column});""")
 
-    def prepare(self):
+    def lang_handler(self, lang: str):
+        """Handler of the tables of another language, on the connection
+        of this one. Its tables are created if they are not present"""
+        handler = DbHandler.get_handler(
+                Namespace(**dict(vars(self.args), lang=lang)))
+        handler.primary = self
+        handler.conn = self.conn
+        handler.ensure_tables()
+        handler.ensure_table_document_langs()
+        handler.claim_document_ids = True
+        return handler
+
+    def check_document_id(self):
+        """Raise DuplicateDocumentIdError if the current DocumentId is
+        claimed by another language of a multi-language export
+
+        DocumentIds of OPUS are unique across languages, meta is shared
+        by all of them and keyed by DocumentId. The claim is committed
+        at once, so exports of other languages running at the same time
+        see it before the rows of the document are written."""
+        if not self.claim_document_ids:
+            return
+        params = {'doc_id': self.document_id, 'lang': self.args.lang}
+        self.execute("""
+                INSERT INTO document_langs (DocumentId, Lang)
+                VALUES (%(doc_id)s, %(lang)s) ON CONFLICT DO NOTHING;""",
+                params)
+        lang = self.execute(
+                "SELECT Lang FROM document_langs"
+                " WHERE DocumentId = %(doc_id)s;", params).fetchone()[0]
+        if lang != self.args.lang:
+            raise DuplicateDocumentIdError(
+                    self.document_id, self.args.lang, lang)
+
+    def ensure_tables(self):
+        self.ensure_table_words()
+        self.ensure_table_meta()
+        self.ensure_table_time()
+        self.ensure_table_documents()
+
+    def prepare(self, create_tables=True):
+        """Connect, create the DB if it is not present, and the tables
+        of args.lang if create_tables"""
         try:
             self.connect()
         except:
@@ -162,9 +599,307 @@ class DbHandler(ABC):
             else:
                 self.create_db(self.args.db_name)
                 self.connect()
-        self.ensure_table_words()
-        self.ensure_table_meta()
-        self.ensure_table_time()
+        if create_tables:
+            self.ensure_tables()
+
+    def create_time_index(self):
+        """Index the time windows of time table, run after the load
+
+        B-tree over integer milliseconds, see time_overlap_condition()"""
+        table_name = f"time_{self.args.lang}"
+        logging.info(f"Creating time window index of {table_name}")
+        self.execute(f"""
+                CREATE INDEX IF NOT EXISTS {table_name}_ms ON {table_name}
+                (DocumentId, StartMs, EndMs);""")
+        self.execute(f"ANALYZE {table_name};")
+
+    def time_overlap_condition(self):
+        """SQL condition of time rows overlapping %(start_ms)s to %(end_ms)s
+
+        A window with EndMs before StartMs covers the time between them,
+        like the int4range of PostgreSQL. With a B-tree, StartMs is bounded
+        by the longest window %(max_span_ms)s and the longest inverted
+        window %(max_inverted_ms)s of the document, so it is a range scan.
+        """
+        return (
+                "StartMs BETWEEN %(start_ms)s - %(max_span_ms)s"
+                " AND %(end_ms)s + %(max_inverted_ms)s"
+                " AND MIN(StartMs, EndMs) <= %(end_ms)s"
+                " AND MAX(StartMs, EndMs) >= %(start_ms)s")
+
+    @contextmanager
+    def transaction(self):
+        """Run the statements in the with block in a transaction"""
+        self.execute('BEGIN;')
+        # Statements up to COMMIT are not retried alone, see execute()
+        self.in_transaction = True
+        try:
+            yield self
+            self.execute('COMMIT;')
+        except BaseException:
+            self.execute('ROLLBACK;')
+            raise
+        finally:
+            self.in_transaction = False
+
+    def delete_documents(self, doc_ids):
+        """Delete rows of documents from words, time, meta and documents
+        tables"""
+        if not doc_ids:
+            return
+        id_list = ','.join(str(int(i)) for i in sorted(doc_ids))
+        for table_name in [
+                f"words_{self.args.lang}", f"time_{self.args.lang}", "meta",
+                f"documents_{self.args.lang}"]:
+            self.execute(
+                    f"DELETE FROM {table_name}"
+                    f" WHERE DocumentId IN ({id_list});")
+
+    def delete_document(self, doc_id):
+        """Delete rows of a document from words, time, meta and documents
+        tables"""
+        self.delete_documents([doc_id])
+
+    def discard_document(self, doc_id):
+        """Delete rows of the previous version of a document
+
+        In replace mode, the delete is deferred to the next flush"""
+        if self.replace:
+            self.batch.delete_ids.add(doc_id)
+        else:
+            self.delete_document(doc_id)
+
+    def bulk_insert(self, table_name: str, columns: List[str], rows):
+        """Insert many rows at once"""
+        if not rows:
+            return
+        cur = self.conn.cursor()
+        cur.executemany(
+                "INSERT INTO %s (%s) VALUES (%s);" % (
+                        table_name, ', '.join(columns),
+                        ', '.join(['%s'] * len(columns))),
+                rows)
+        return cur
+
+    def abandon_document(self):
+        """Remove the rows of the current document written so far,
+        e.g. when the rest of its file turns out to be malformed"""
+        if self.document_marks is None:
+            return
+        words, times, metas = self.document_marks
+        self.document_marks = None
+        if not self.replace:
+            # Rows of the document loaded by an earlier run are kept
+            for table_name, key in reversed(self.inserted_keys):
+                self.execute(
+                        f"DELETE FROM {table_name} WHERE " + ' AND '.join(
+                                f"{column} = %({column})s" for column in key),
+                        key)
+            self.inserted_keys = []
+            return
+        self.batch.words.truncate(words)
+        self.batch.times.truncate(times)
+        del self.batch.metas[metas:]
+        self.batch.word_keys = set()
+        self.batch.time_keys = set()
+        self.batch.meta_keys = set()
+
+    def add_rows(self, batch: RowBatch):
+        """Add the rows of one document parsed before, e.g. loaded by
+        DocumentCache, instead of traversing its XML
+
+        end_document() with the row of batch.document_rows ends it."""
+        self.document_id = batch.document_rows[0][0]
+        self.check_document_id()
+        if self.replace:
+            self.batch.words.extend(batch.words)
+            self.batch.times.extend(batch.times)
+            self.batch.metas.extend(batch.metas)
+        else:
+            self.document_marks = (0, 0, 0)
+            self.inserted_keys = []
+            for row in batch.words:
+                self.add_word(*row)
+            for row in batch.times:
+                self.add_time(*row)
+            for row in batch.metas:
+                self.add_meta(*row)
+        # The batch has no duplicate keys, it was collected in replace mode
+        self.row_counts = {
+                'words': len(batch.words), 'time': len(batch.times),
+                'meta': len(batch.metas)}
+
+    def end_document(self, callback=None, row=None):
+        """The current document is completely traversed
+
+        Args:
+            callback (Callable, optional): Defaults to None.
+                Called after the rows of the document are written.
+                In replace mode, it is called inside the flush transaction.
+            row (tuple, optional): Defaults to None.
+                Row of documents table, instead of the traversed values
+        """
+        if row is None:
+            row = self.document_row()
+        self.document_marks = None
+        self.inserted_keys = []
+        if not self.replace:
+            self.insert_table_documents(f"documents_{self.args.lang}", row)
+            if callback:
+                callback()
+            return
+        self.batch.document_rows.append(row)
+        self.batch.documents += 1
+        self.batch.delete_ids.add(self.document_id)
+        if callback:
+            self.batch.callbacks.append(callback)
+        self.batch.word_keys = set()
+        self.batch.time_keys = set()
+        self.batch.meta_keys = set()
+        if self.batch.documents >= self.batch_documents:
+            self.flush()
+
+    def flush(self):
+        """Replace the buffered documents in one transaction
+
+        Old rows of all documents in the batch are deleted with one
+        statement per table, then the new rows are bulk loaded."""
+        batch = self.batch
+        if not batch.documents and not batch.delete_ids:
+            return
+        logging.info(
+                "Replacing %d documents: %d words, %d times, %d metas",
+                batch.documents, len(batch.words), len(batch.times),
+                len(batch.metas))
+        # The batch is kept until it is written, so the whole
+        # transaction can be retried
+        self.with_retry(self.write_batch, batch)
+        self.batch = RowBatch()
+
+    def write_batch(self, batch: RowBatch):
+        with self.transaction():
+            self.delete_documents(batch.delete_ids)
+            self.bulk_insert(
+                    f"words_{self.args.lang}", self.WORDS_COLUMNS, batch.words)
+            if batch.times:
+                self.bulk_insert(
+                        f"time_{self.args.lang}",
+                        self.TIME_COLUMNS + (
+                                ['StartMs', 'EndMs'] if self.time_ms else []),
+                        self.time_rows(batch.times))
+            self.bulk_insert("meta", self.META_COLUMNS, batch.metas)
+            self.bulk_insert(
+                    f"documents_{self.args.lang}", self.DOCUMENT_COLUMNS,
+                    batch.document_rows)
+            for callback in batch.callbacks:
+                callback()
+
+    def document_row(self):
+        """Row of documents table of the current document
+
+        Values of <meta> which cannot be parsed are stored as NULL, strings
+        are cut to the width of their column.
+
+        >>> handler = RowCollector(Namespace(lang='en'))
+        >>> handler.document_id = 1
+        >>> handler.sentence_count = 2
+        >>> handler.row_counts['words'] = 9
+        >>> handler.document_values = {
+        ...         'Year': ' 1999 ', 'DurationMs': '01:30:00',
+        ...         'Genre': 'Drama', 'Language': 'Portuguese (Brazil)'}
+        >>> handler.document_row()
+        (1, 1999, 5400000, None, 'Drama', None, 'Portuguese (Braz', 2, 9)
+        """
+        values = {}
+        for column, value_type in self.DOCUMENT_META.values():
+            value = self.document_values.get(column)
+            if value is None:
+                continue
+            try:
+                if value_type == 'time_ms':
+                    values[column] = DbHandler.parse_time_ms(value)
+                elif value_type == int:
+                    values[column] = int(value)
+                else:
+                    values[column] = value.strip()[
+                            :self.DOCUMENT_WIDTHS[column]]
+            except ValueError:
+                logging.debug(
+                        "Invalid %s of document %d: %s",
+                        column, self.document_id, value)
+        values['DocumentId'] = self.document_id
+        values['Sentences'] = self.sentence_count
+        values['Tokens'] = self.row_counts['words']
+        return tuple(values.get(column) for column in self.DOCUMENT_COLUMNS)
+
+    def add_word(self, doc_id, s_id, w_real_id, word: str):
+        """Add a word, in replace mode a word of the same SentenceId and
+        WordId as an earlier one of the document is skipped
+
+        >>> handler = RowCollector(Namespace(lang='en'))
+        >>> for word in ['Hi', 'Ho']:
+        ...     handler.add_word(7, 1, 1, word)
+        >>> list(handler.batch.words), handler.row_counts['words']
+        ([(7, 1, 1, 'Hi')], 1)
+        """
+        if self.replace:
+            key = (s_id, w_real_id)
+            if key in self.batch.word_keys:
+                logging.warning(
+                        "Skipping duplicate word %d.%d of document %d",
+                        s_id, w_real_id, doc_id)
+                return
+            self.batch.word_keys.add(key)
+            self.batch.words.append(doc_id, s_id, w_real_id, word)
+        else:
+            table_name = f"words_{self.args.lang}"
+            self.record_insert(
+                    self.insert_table_words(
+                            table_name, doc_id, s_id, w_real_id, word),
+                    table_name, DocumentId=doc_id, SentenceId=s_id,
+                    WordId=w_real_id)
+        self.row_counts['words'] += 1
+
+    def add_time(
+                self, doc_id, time_id, start_s_id, start_w_id, start_ms,
+                end_s_id, end_w_id, end_ms):
+        if self.replace:
+            key = (time_id, start_s_id)
+            if key in self.batch.time_keys:
+                return
+            self.batch.time_keys.add(key)
+            self.batch.times.append(
+                    doc_id, time_id, start_s_id, start_w_id, start_ms,
+                    end_s_id, end_w_id, end_ms)
+        else:
+            table_name = f"time_{self.args.lang}"
+            self.record_insert(
+                    self.insert_table_time(
+                            table_name, doc_id, time_id,
+                            start_s_id, start_w_id, self.interval(start_ms),
+                            end_s_id, end_w_id, self.interval(end_ms),
+                            start_ms, end_ms),
+                    table_name, DocumentId=doc_id, TimeId=time_id,
+                    StartSentenceId=start_s_id)
+        self.row_counts['time'] += 1
+
+    def add_meta(self, doc_id, key: str, value: str):
+        if self.replace:
+            if key in self.batch.meta_keys:
+                return
+            self.batch.meta_keys.add(key)
+            self.batch.metas.append((doc_id, key, value))
+        else:
+            self.record_insert(
+                    self.insert_table_meta("meta", doc_id, key, value),
+                    "meta", DocumentId=doc_id, Key=key)
+        self.row_counts['meta'] += 1
+
+    def record_insert(self, cur, table_name: str, **key):
+        """Remember a row inserted by row-by-row mode, not one that was
+        already there, see abandon_document()"""
+        if cur is not None and cur.rowcount > 0:
+            self.inserted_keys.append((table_name, key))
 
     def insert_table_words(
                 self, table_name: str, doc_id, s_id, w_real_id, word: str):
@@ -190,16 +925,33 @@ class DbHandler(ABC):
             """, {
                     'doc_id': doc_id, 'key': key, 'value': value})
 
+    def insert_table_documents(self, table_name: str, row: tuple):
+        params = dict(zip(self.DOCUMENT_COLUMNS, row))
+        return self.execute(f"""
+            INSERT INTO {table_name}
+            SELECT %(DocumentId)s, %(Year)s, %(DurationMs)s, %(Original)s,
+             %(Genre)s, %(Country)s, %(Language)s, %(Sentences)s, %(Tokens)s
+             FROM (SELECT 0 AS i) AS mutex LEFT JOIN {table_name}
+             ON DocumentId = %(DocumentId)s
+            WHERE i=0 AND DocumentId IS NULL;
+            """, params)
+
     def insert_table_time(
                 self, table_name: str, doc_id, time_id,
                 start_s_id, start_w_id, start_time,
-                end_s_id, end_w_id, end_time):
-        start_time = start_time
+                end_s_id, end_w_id, end_time, start_ms=None, end_ms=None):
+        if self.time_ms:
+            columns = '(%s)' % ', '.join(
+                    self.TIME_COLUMNS + ['StartMs', 'EndMs'])
+            ms_values = ', %(start_ms)s, %(end_ms)s'
+        else:
+            columns = ''
+            ms_values = ''
         return self.execute(f"""
-            INSERT INTO {table_name}
+            INSERT INTO {table_name} {columns}
             SELECT %(doc_id)s, %(time_id)s,
              %(start_s_id)s, %(start_w_id)s, %(start_time)s,
-             %(end_s_id)s, %(end_w_id)s, %(end_time)s
+             %(end_s_id)s, %(end_w_id)s, %(end_time)s{ms_values}
              FROM (SELECT 0 AS i) AS mutex LEFT JOIN {table_name}
              ON DocumentId = %(doc_id)s AND TimeId = %(time_id)s
               AND StartSentenceId = %(start_s_id)s
@@ -209,63 +961,218 @@ class DbHandler(ABC):
                     'start_time': start_time,
                     'start_s_id': start_s_id, 'start_w_id': start_w_id,
                     'end_time': end_time,
-                    'end_s_id': end_s_id, 'end_w_id': end_w_id})
+                    'end_s_id': end_s_id, 'end_w_id': end_w_id,
+                    'start_ms': start_ms, 'end_ms': end_ms})
 
     def write_node(self, node: XmlNode, parent_path: str, args: Namespace):
         if node.tag == 'document':
+            self.document_marks = (
+                    len(self.batch.words), len(self.batch.times),
+                    len(self.batch.metas))
+            self.inserted_keys = []
             self.document_id = int(node.attrib['id'])
+            self.check_document_id()
+            self.row_counts = {'words': 0, 'time': 0, 'meta': 0}
+            self.sentence_count = 0
+            self.document_values = {}
         elif node.tag == 'time':
             if node.attrib['id'][-1] == 'S':
                 self.time_id = int(node.attrib['id'][1:-1])
-                self.start_time = DbHandler.parse_time(node.attrib['value'])
+                self.start_ms = DbHandler.parse_time_ms(node.attrib['value'])
             else:
-                table_name = f"time_{self.args.lang}"
-                self.end_time = DbHandler.parse_time(node.attrib['value'])
-                self.insert_table_time(
-                    table_name,
+                self.end_ms = DbHandler.parse_time_ms(node.attrib['value'])
+                self.add_time(
                     self.document_id,
                     self.time_id,
                     self.start_s_id,
                     self.start_w_id,
-                    self.start_time,
+                    self.start_ms,
                     self.s_id,
                     self.w_real_id,
-                    self.end_time)
+                    self.end_ms)
                 self.start_s_id = -1
         elif node.tag == 's':
             self.s_id = int(node.attrib['id'])
+            self.sentence_count += 1
         elif node.tag == 'w':
             # w id looks like: 1.20
             #   the first part (before .) is s id (1)
             #   the second part (after .) is w real id (20)
-            table_name = f"words_{self.args.lang}"
             w_id_token = node.attrib['id'].split('.')
             self.s_id = int(w_id_token[0])
             self.w_real_id = int(w_id_token[1])
-            self.insert_table_words(
-                    table_name, self.document_id,
-                    self.s_id, self.w_real_id, node.text)
+            self.add_word(
+                    self.document_id, self.s_id, self.w_real_id, node.text)
             if self.start_s_id < 0:
                 self.start_s_id = self.s_id
                 self.start_w_id = self.w_real_id
         elif parent_path.startswith('meta.'):
-            table_name = "meta"
+            # Leaves of <meta>, e.g. year of path meta.source
             if node.text:
-                self.insert_table_meta(
-                        table_name, self.document_id, node.tag, node.text)
+                self.add_meta(self.document_id, node.tag, node.text)
+                column = self.DOCUMENT_META.get(
+                        f"{parent_path[5:]}.{node.tag}")
+                if column:
+                    self.document_values.setdefault(column[0], node.text)
+
+
+class RowCollector(DbHandler):
+    """Collect rows of documents without a DB connection
+
+    It parses documents in worker processes, while the rows are
+    written elsewhere, e.g. by AsyncPipeline.
+
+    Args:
+        args (Namespace): Parsed arguments
+        native_interval (bool, optional): Defaults to False.
+            Collect intervals as timedelta instead of string
+    """
+
+    def __init__(self, args, native_interval=False):
+        super(RowCollector, self).__init__(args)
+        self.replace = True
+        # Never flush, the owner takes the batch
+        self.batch_documents = sys.maxsize
+        self.native_interval = native_interval
+
+    def interval(self, ms: int):
+        if self.native_interval:
+            return timedelta(milliseconds=ms)
+        return super(RowCollector, self).interval(ms)
+
+    def take_batch(self):
+        """Return the collected rows and start a new batch"""
+        batch = self.batch
+        self.batch = RowBatch()
+        return batch
+
+    def admin_connect(self):
+        return None
+
+    def connect(self):
+        return None
+
+    def is_db_present(self, db_name=None):
+        return False
+
+    def is_table_present(self, table_name):
+        return False
 
 
 class PostgreSQLHandler(DbHandler):
-    psycopg2 = __import__('psycopg2')
+    # Escape for COPY text format
+    COPY_ESCAPE = str.maketrans({
+            '\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+    # Time window of time table, LEAST/GREATEST keep int4range valid
+    TIME_RANGE = (
+            "int4range(LEAST(StartMs, EndMs), GREATEST(StartMs, EndMs), '[]')")
 
     def __init__(self, args):
         super(PostgreSQLHandler, self).__init__(args)
+        self.cursor_count = 0
+        # COPY words and time tables in binary format
+        self.copy_binary = getattr(args, 'copy_binary', False)
+        if self.dsn:
+            self.route_db_name(self.psycopg2.extensions.parse_dsn(
+                    self.dsn).get('dbname', args.db_name))
+
+    @property
+    def psycopg2(self):
+        """psycopg2 is only imported when connecting, not for --help"""
+        import psycopg2
+        return psycopg2
+
+    def stream(self, cmd: str, vars=None, itersize=2000):
+        """Iterate the rows of a query with a server-side named cursor
+
+        Only itersize rows are in memory at a time. Named cursors live
+        in a transaction, so the outermost stream opens a read
+        transaction and ends it when exhausted or closed."""
+        outermost = self.conn.autocommit
+        if outermost:
+            self.conn.autocommit = False
+        self.cursor_count += 1
+        cur = self.conn.cursor(name="stream_%d" % self.cursor_count)
+        cur.itersize = itersize
+        try:
+            cur.execute(cmd, vars)
+            yield from cur
+        finally:
+            cur.close()
+            if outermost:
+                self.conn.rollback()
+                self.conn.autocommit = True
+
+    def binary_fields(self, table_name: str):
+        """Fields of binary COPY of table, None for text COPY
+
+        See PgBinaryCopy.BinaryCopyReader for the field types"""
+        if not self.copy_binary:
+            return None
+        if table_name.startswith('words_'):
+            return 'iiis'
+        if table_name.startswith('time_'):
+            return 'iiiIiiiI' + ('ii' if self.time_ms else '')
+        return None
+
+    def time_rows(self, times: ColumnBuffer):
+        """Binary COPY packs the milliseconds as interval itself"""
+        if not self.copy_binary:
+            return super(PostgreSQLHandler, self).time_rows(times)
+        if self.time_ms:
+            return (row + (row[4], row[7]) for row in times)
+        return iter(times)
+
+    def bulk_insert(self, table_name: str, columns: List[str], rows):
+        """Insert many rows with COPY"""
+        if not rows:
+            return
+        fields = self.binary_fields(table_name)
+        if fields:
+            from PgBinaryCopy import BinaryCopyReader
+            reader = BinaryCopyReader(rows, fields)
+            cur = self.conn.cursor()
+            cur.copy_expert(
+                    "COPY %s (%s) FROM STDIN WITH (FORMAT binary);" % (
+                            table_name, ', '.join(columns)),
+                    reader, size=len(reader.buffer))
+            return cur
+        buf = io.StringIO()
+        for row in rows:
+            buf.write('\t'.join(
+                    '\\N' if v is None else str(v).translate(self.COPY_ESCAPE)
+                    for v in row))
+            buf.write('\n')
+        buf.seek(0)
+        cur = self.conn.cursor()
+        cur.copy_expert(
+                "COPY %s (%s) FROM STDIN;" % (table_name, ', '.join(columns)),
+                buf)
+        return cur
+
+    def create_time_index(self):
+        """GiST index over the time windows as integer ranges"""
+        table_name = f"time_{self.args.lang}"
+        logging.info(f"Creating time window index of {table_name}")
+        # DocumentId in a GiST index needs btree_gist
+        self.execute("CREATE EXTENSION IF NOT EXISTS btree_gist;")
+        self.execute(f"""
+                CREATE INDEX IF NOT EXISTS {table_name}_window
+                ON {table_name} USING gist (DocumentId, {self.TIME_RANGE});
+                """)
+        self.execute(f"ANALYZE {table_name};")
+
+    def time_overlap_condition(self):
+        return (
+                f"{self.TIME_RANGE}"
+                " && int4range(%(start_ms)s, %(end_ms)s, '[]')")
 
     def admin_connect(self):
         credential = {'dbname': 'postgres'}
         if self.args.db_admin_password:
             credential['password'] = self.args.db_admin_password
-        self.conn = self.psycopg2.connect(**credential)
+        # Keyword arguments override the ones of DSN
+        self.conn = self.psycopg2.connect(dsn=self.dsn, **credential)
         self.conn.autocommit = True
         return super(PostgreSQLHandler, self).connect()
 
@@ -273,14 +1180,19 @@ class PostgreSQLHandler(DbHandler):
         credential = {'dbname': self.args.db_name}
 
         if self.args.db_user:
-            credential[''] = self.args.db_password
+            credential['user'] = self.args.db_user
         if self.args.db_password:
             credential['password'] = self.args.db_password
-        self.conn = self.psycopg2.connect(**credential)
-        self.psycopg2
+        self.conn = self.psycopg2.connect(dsn=self.dsn, **credential)
         self.conn.autocommit = True
         return super(PostgreSQLHandler, self).connect()
 
+    def is_transient(self, error: Exception):
+        # Lost connections, server restarts and failovers
+        return isinstance(error, (
+                self.psycopg2.OperationalError,
+                self.psycopg2.InterfaceError))
+
     def is_db_present(self, db_name=None):
         if not db_name:
             db_name = self.args.db_name
@@ -300,5 +1212,89 @@ class PostgreSQLHandler(DbHandler):
         return cur.fetchone()[0]
 
 
+class SQLiteHandler(DbHandler):
+    """SQLite handler for local testing and benchmarks
+
+    The db_name is used as the database file name,
+    '.sqlite3' is appended if it has no extension.
+    A DSN of --db-dsn is the database file name too.
+    """
+    PARAM_PATTERN = re.compile(r'%\((\w+)\)s')
+
+    def __init__(self, args):
+        super(SQLiteHandler, self).__init__(args)
+        if self.dsn:
+            # The DSN is the DB file
+            self.route_db_name(self.dsn)
+
+    @property
+    def sqlite3(self):
+        import sqlite3
+        return sqlite3
+
+    def db_file(self, db_name=None):
+        if not db_name:
+            db_name = self.args.db_name
+        if db_name == ':memory:' or os.path.splitext(db_name)[1]:
+            return db_name
+        return db_name + '.sqlite3'
+
+    def admin_connect(self):
+        # SQLite has no server, the admin connection is the DB connection
+        return self.connect()
+
+    def connect(self):
+        self.conn = self.sqlite3.connect(
+                self.db_file(), isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        return super(SQLiteHandler, self).connect()
+
+    def is_transient(self, error: Exception):
+        # Another process holds the lock longer than the busy timeout
+        return isinstance(error, self.sqlite3.OperationalError) and (
+                'locked' in str(error) or 'busy' in str(error))
+
+    def execute(self, cmd: str, vars=None):
+        # sqlite3 uses :name instead of %(name)s
+        return super(SQLiteHandler, self).execute(
+                self.PARAM_PATTERN.sub(r':\1', cmd),
+                vars if vars is not None else ())
+
+    def create_db(self, db_name: str):
+        # Connecting creates the DB file
+        logging.info("Creating DB %s", self.db_file(db_name))
+
+    def drop_db(self, db_name: str):
+        logging.info("Dropping DB %s", self.db_file(db_name))
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self.db_file(db_name) + suffix):
+                os.remove(self.db_file(db_name) + suffix)
+
+    def bulk_insert(self, table_name: str, columns: List[str], rows):
+        if not rows:
+            return
+        cur = self.conn.cursor()
+        cur.executemany(
+                "INSERT INTO %s (%s) VALUES (%s);" % (
+                        table_name, ', '.join(columns),
+                        ', '.join(['?'] * len(columns))),
+                rows)
+        return cur
+
+    def is_db_present(self, db_name=None):
+        return os.path.exists(self.db_file(db_name))
+
+    def is_table_present(self, table_name):
+        cur = self.execute(
+                "SELECT EXISTS (SELECT 1 FROM sqlite_master"
+                " WHERE type = 'table' AND name = %(table_name)s);",
+                {'table_name': table_name})
+        return bool(cur.fetchone()[0])
+
+
 if __name__ == '__main__':
     CommonFunctions.run_doctest_and_quit_if_enabled()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""DbReader streams the exported corpus back from the DB
+
+Documents, sentences and token windows are read through one streaming
+cursor (a server-side named cursor on PostgreSQL), so iterating the
+whole corpus takes constant memory. Single documents can be served from
+an LRU cache, for data loaders that revisit hot documents.
+
+    python DbReader.py -b sqlite -N opensubtitle en > sentences.txt
+    python DbReader.py -b sqlite -N opensubtitle --window 64 en
+"""
+
+import functools
+import itertools
+import os
+import sys
+import CommonFunctions
+
+from collections import namedtuple
+from CommonArgParser import CommonArgParser
+from DbHandler import DbHandler
+
+try:
+    from typing import Iterator, List  # noqa: F401 # pylint: disable=W0611
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+Sentence = namedtuple('Sentence', ['document_id', 'sentence_id', 'words'])
+Document = namedtuple('Document', ['document_id', 'sentences'])
+TokenWindow = namedtuple('TokenWindow', ['document_id', 'tokens'])
+
+
+class DbReader(object):
+    """Read words_<lang> as documents, sentences or token windows
+
+    Args:
+        db_handler (DbHandler): connected DB handler
+        itersize (int, optional): Defaults to 2000.
+            Rows fetched from the DB at a time
+        cache_documents (int, optional): Defaults to 0.
+            Documents kept in the LRU cache of document(), 0 disables it
+
+    Examples:
+    >>> from argparse import Namespace
+    >>> from DbHandler import SQLiteHandler
+    >>> db = SQLiteHandler(Namespace(lang='en', db_name=':memory:'))
+    >>> _ = db.connect()
+    >>> db.ensure_table_words()
+    >>> _ = db.bulk_insert('words_en', DbHandler.WORDS_COLUMNS, [
+    ...         (1, 1, 1, 'Hello'), (1, 1, 2, '!'), (1, 2, 1, 'Bye'),
+    ...         (2, 1, 1, 'Hi')])
+    >>> reader = DbReader(db, itersize=2, cache_documents=8)
+    >>> [' '.join(s.words) for s in reader.sentences()]
+    ['Hello !', 'Bye', 'Hi']
+    >>> reader.document(1)
+    Document(document_id=1, sentences=[['Hello', '!'], ['Bye']])
+    >>> list(reader.token_windows(2, start_id=1, end_id=1))
+    [TokenWindow(document_id=1, tokens=['Hello', '!']), \
+TokenWindow(document_id=1, tokens=['Bye'])]
+    >>> list(reader.token_windows(4, 2, start_id=2))
+    [TokenWindow(document_id=2, tokens=['Hi'])]
+    """
+
+    def __init__(self, db_handler: DbHandler, itersize=2000,
+                 cache_documents=0):
+        self.db_handler = db_handler
+        self.lang = db_handler.args.lang
+        self.itersize = itersize
+        if cache_documents:
+            self.document = functools.lru_cache(cache_documents)(
+                    self.load_document)
+        else:
+            self.document = self.load_document
+
+    def words(self, start_id=None, end_id=None):
+        """Stream (DocumentId, SentenceId, Word) in document order
+
+        Args:
+            start_id (int, optional): Defaults to None. First DocumentId
+            end_id (int, optional): Defaults to None. Last DocumentId
+        """
+        conditions = []
+        if start_id is not None:
+            conditions.append("DocumentId >= %(start_id)s")
+        if end_id is not None:
+            conditions.append("DocumentId <= %(end_id)s")
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return self.db_handler.stream(
+                f"""SELECT DocumentId, SentenceId, Word
+                 FROM words_{self.lang}{where}
+                 ORDER BY DocumentId, SentenceId, WordId;""",
+                {'start_id': start_id, 'end_id': end_id}, self.itersize)
+
+    def sentences(self, start_id=None, end_id=None):
+        # type: (int, int) -> Iterator[Sentence]
+        """Stream the sentences of the documents in the id range"""
+        for (doc_id, s_id), rows in itertools.groupby(
+                self.words(start_id, end_id), key=lambda row: row[:2]):
+            yield Sentence(doc_id, s_id, [row[2] for row in rows])
+
+    def documents(self, start_id=None, end_id=None):
+        # type: (int, int) -> Iterator[Document]
+        """Stream the documents in the id range, one document in memory"""
+        for doc_id, sentences in itertools.groupby(
+                self.sentences(start_id, end_id),
+                key=lambda sentence: sentence.document_id):
+            yield Document(doc_id, [s.words for s in sentences])
+
+    def load_document(self, doc_id: int):
+        # type: (int) -> Document
+        """Read a document, or None if it is not present"""
+        for document in self.documents(doc_id, doc_id):
+            return document
+        return None
+
+    def token_windows(self, size: int, stride=None, start_id=None,
+                      end_id=None):
+        # type: (int, int, int, int) -> Iterator[TokenWindow]
+        """Stream windows of size tokens, windows do not cross documents
+
+        Args:
+            size (int): Tokens per window
+            stride (int, optional): Defaults to size.
+                Tokens between the starts of 2 windows, at most size
+        """
+        stride = stride or size
+        if not 0 < stride <= size:
+            raise ValueError("Invalid stride %d of size %d" % (stride, size))
+        for doc_id, rows in itertools.groupby(
+                self.words(start_id, end_id), key=lambda row: row[0]):
+            tokens = []  # type: List[str]
+            windows = 0
+            for row in rows:
+                tokens.append(row[2])
+                if len(tokens) == size:
+                    yield TokenWindow(doc_id, tokens)
+                    windows += 1
+                    tokens = tokens[stride:]
+            # The remaining tokens, unless a window already covered them
+            if tokens and (not windows or len(tokens) > size - stride):
+                yield TokenWindow(doc_id, tokens)
+
+
+def main():
+    """Run as command line program"""
+    parser = CommonArgParser(__file__)
+    parser.add_argument(
+            '-b', '--db-product', type=str, default='postgresql',
+            help='The DB to read: postgresql, sqlite')
+    parser.add_argument(
+            '-N', '--db-name', type=str, default='opensubtitle',
+            help='The DB name')
+    parser.add_argument(
+            '-p', '--db-password', type=str,
+            help='The DB password')
+    parser.add_argument(
+            '-u', '--db-user', type=str,
+            help='The DB username')
+    parser.add_argument(
+            '--itersize', type=int, default=2000,
+            help='Rows fetched at a time (Default: 2000)')
+    parser.add_argument(
+            '--window', type=int,
+            help='Print windows of this many tokens instead of sentences')
+    parser.add_argument(
+            '--stride', type=int,
+            help='Tokens between the starts of 2 windows (Default: window)')
+    parser.add_argument('lang', help='The language to read')
+    args = parser.parse_all()
+    db_handler = DbHandler.get_handler(args)
+    db_handler.connect()
+    reader = DbReader(db_handler, args.itersize)
+    if args.window:
+        for window in reader.token_windows(args.window, args.stride):
+            print(' '.join(window.tokens))
+    else:
+        for sentence in reader.sentences():
+            print(' '.join(sentence.words))
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""DocumentCache keeps parsed documents as compact columnar binary files
+
+Parsing the XML is the costliest step of an export. The cache
+sub-command of XmlExporter parses each source file once into a file of
+the cache directory, at the same relative path with CACHE_SUFFIX, that
+db --from-cache reads instead of the XML.
+
+A cache file is little-endian with fixed offsets, so it can be memory
+mapped by any reader:
+
+    header      HEADER: magic, version, null mask of the document row,
+                DocumentId, size and mtime of the source file, row counts,
+                Year, DurationMs, Sentences, Tokens and heap bytes
+    int32       SentenceId, WordId of words, one column after the other
+    int32       TimeId, StartSentenceId, StartWordId, StartMs,
+                EndSentenceId, EndWordId, EndMs of time windows
+    uint32      offsets of the strings in the heap, one more than strings
+    heap        UTF-8 strings, each followed by NUL: words, meta keys,
+                meta values, then Original, Genre, Country, Language
+
+XML text cannot contain NUL, so the whole heap is also decoded at once
+and split on it.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import sys
+
+import CommonFunctions
+
+from argparse import Namespace
+from array import array
+from DbHandler import RowBatch
+
+try:
+    from typing import Iterator, List, Tuple  # noqa: F401
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+MAGIC = b'OSDC'
+VERSION = 1
+CACHE_SUFFIX = '.doc'
+HEADER = struct.Struct('<4sHHiqqIIIiiiiI')
+# Int columns of words and times after DocumentId, see RowBatch
+WORD_INT_COLUMNS = 2
+TIME_INT_COLUMNS = 7
+# Positions of ints and strings in the documents table row
+DOCUMENT_INTS = [1, 2, 7, 8]
+DOCUMENT_STRINGS = [3, 4, 5, 6]
+
+
+def pack_document(batch: RowBatch, source_size=0, source_mtime_ns=0):
+    """Cache file content of the rows of one document
+
+    Examples:
+    >>> batch = RowBatch()
+    >>> batch.words.append(7, 1, 1, 'Hi')
+    >>> batch.words.append(7, 1, 2, 'th\\xe9re')
+    >>> batch.times.append(7, 1, 1, 1, 0, 1, 2, 900)
+    >>> batch.metas.append((7, 'year', '2001'))
+    >>> batch.document_rows.append(
+    ...         (7, 2001, None, None, 'Drama', None, 'en', 1, 2))
+    >>> data = pack_document(batch)
+    >>> len(data)
+    171
+    >>> copy = unpack_document(data)
+    >>> list(copy.words), list(copy.times), copy.metas
+    ([(7, 1, 1, 'Hi'), (7, 1, 2, 'th\\xe9re')], \
+[(7, 1, 1, 1, 0, 1, 2, 900)], [(7, 'year', '2001')])
+    >>> copy.document_rows, copy.documents, copy.delete_ids
+    ([(7, 2001, None, None, 'Drama', None, 'en', 1, 2)], 1, {7})
+    """
+    document_row = batch.document_rows[0]
+    null_mask = 0
+    for idx, value in enumerate(document_row[1:]):
+        if value is None:
+            null_mask |= 1 << idx
+    strings = list(batch.words.columns[3])
+    strings += [key for _, key, _ in batch.metas]
+    strings += [value for _, _, value in batch.metas]
+    strings += [document_row[idx] or '' for idx in DOCUMENT_STRINGS]
+    heap = '\0'.join(strings).encode('utf-8') + b'\0'
+    offsets = array('I', [0])
+    pos = 0
+    for string in strings:
+        pos += len(string.encode('utf-8')) + 1
+        offsets.append(pos)
+    ints = array('i')
+    for column in batch.words.columns[1:3] + batch.times.columns[1:]:
+        ints.extend(column)
+    if sys.byteorder != 'little':
+        ints.byteswap()
+        offsets.byteswap()
+    header = HEADER.pack(
+            MAGIC, VERSION, null_mask, document_row[0], source_size,
+            source_mtime_ns, len(batch.words), len(batch.times),
+            len(batch.metas),
+            *[document_row[idx] or 0 for idx in DOCUMENT_INTS], len(heap))
+    return b''.join([header, ints.tobytes(), offsets.tobytes(), heap])
+
+
+def read_header(buffer):
+    """Header fields of a cache file, None if it is not one"""
+    if len(buffer) < HEADER.size:
+        return None
+    header = HEADER.unpack_from(buffer)
+    if header[0] != MAGIC or header[1] != VERSION:
+        return None
+    return header
+
+
+def unpack_document(buffer):
+    """RowBatch of one document from the cache file content, like
+    RowCollector.take_batch() returns after parsing its XML"""
+    (_, _, null_mask, doc_id, _, _, words, times, metas,
+     year, duration_ms, sentences, tokens, heap_bytes) = read_header(buffer)
+    view = memoryview(buffer)
+    pos = HEADER.size
+    batch = RowBatch()
+    for columns, rows, count in [
+            (batch.words.columns, words, WORD_INT_COLUMNS),
+            (batch.times.columns, times, TIME_INT_COLUMNS)]:
+        columns[0].extend(array('i', [doc_id]) * rows)
+        for column in columns[1:count + 1]:
+            column.frombytes(view[pos:pos + rows * 4])
+            if sys.byteorder != 'little':
+                column.byteswap()
+            pos += rows * 4
+    # The offsets are for readers that pick single strings
+    pos += (words + 2 * metas + len(DOCUMENT_STRINGS) + 1) * 4
+    strings = str(view[pos:pos + heap_bytes], 'utf-8').split('\0')
+    view.release()
+    batch.words.columns[3] = strings[:words]
+    keys = strings[words:words + metas]
+    values = strings[words + metas:words + 2 * metas]
+    batch.metas = [(doc_id, key, value) for key, value in zip(keys, values)]
+    document_row = [doc_id, year, duration_ms] + strings[
+            words + 2 * metas:words + 2 * metas + len(DOCUMENT_STRINGS)] + [
+            sentences, tokens]
+    for idx in range(len(document_row) - 1):
+        if null_mask & (1 << idx):
+            document_row[idx + 1] = None
+    batch.document_rows.append(tuple(document_row))
+    batch.documents = 1
+    batch.delete_ids.add(doc_id)
+    return batch
+
+
+class DocumentCache(object):
+    """Cache files of the source files under src_dir
+
+    Args:
+        cache_dir (str): Directory of the cache files
+        src_dir (str): Source directory, paths relative to it are kept
+    """
+
+    def __init__(self, cache_dir: str, src_dir: str):
+        self.cache_dir = cache_dir
+        self.src_dir = src_dir
+
+    def path(self, in_file: str):
+        """Cache file of a source file
+
+        >>> DocumentCache('/cache', '/data').path(
+        ...         '/data/xml/en/1999/123/4000000.xml.gz')
+        '/cache/xml/en/1999/123/4000000.doc'
+        """
+        rel_path = os.path.relpath(in_file, self.src_dir)
+        for suffix in ['.gz', '.xml']:
+            if rel_path.endswith(suffix):
+                rel_path = rel_path[:-len(suffix)]
+        return os.path.join(self.cache_dir, rel_path + CACHE_SUFFIX)
+
+    @staticmethod
+    def is_fresh(header, stat: os.stat_result):
+        return header is not None and header[4:6] == (
+                stat.st_size, stat.st_mtime_ns)
+
+    def is_cached(self, in_file: str):
+        """Whether the cache file of in_file is of its current version"""
+        try:
+            with open(self.path(in_file), 'rb') as f:
+                header = read_header(f.read(HEADER.size))
+        except FileNotFoundError:
+            return False
+        return self.is_fresh(header, os.stat(in_file))
+
+    def write(self, in_file: str, batch: RowBatch):
+        stat = os.stat(in_file)
+        path = self.path(in_file)
+        CommonFunctions.mkdir_p(os.path.dirname(path))
+        # Readers never see a partly written file
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(pack_document(batch, stat.st_size, stat.st_mtime_ns))
+        os.replace(tmp_path, path)
+
+    def load(self, in_file: str):
+        # type: (str) -> RowBatch
+        """Rows of the document of in_file, None if the cache file is
+        missing or older than in_file"""
+        try:
+            f = open(self.path(in_file), 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if not self.is_fresh(read_header(mapped), os.stat(in_file)):
+                    logging.info("Cache of %s is stale", in_file)
+                    return None
+                return unpack_document(mapped)
+
+
+def cache_file(in_file: str, args: Namespace):
+    """Parse a source file the way XmlExporter does into its cache file
+
+    Returns:
+        Tuple[str, str]: in_file and its status: cached, fresh
+            (the cache file is up to date) or the error of a malformed file
+    """
+    # Imported here to avoid circular import
+    from XmlExporter import MALFORMED_FILE_ERRORS, parse_document
+    cache = DocumentCache(args.cache_dir, args.src_dir)
+    if not args.rebuild and cache.is_cached(in_file):
+        return in_file, 'fresh'
+    try:
+        batch = parse_document(in_file, args)
+    except MALFORMED_FILE_ERRORS as e:
+        return in_file, "%s: %s" % (
+                type(e).__name__, ' '.join(str(e).split()))
+    cache.write(in_file, batch)
+    return in_file, 'cached'
+
+
+def cache_sources(args: Namespace, files: List[str]):
+    # type: (Namespace, List[str]) -> Iterator[Tuple[str, str]]
+    """Cache the files with args.jobs processes, yields their status"""
+    return CommonFunctions.imap_jobs(cache_file, files, args, args.jobs)
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
@@ -6,6 +6,7 @@ import CommonFunctions
 
 from CommonArgParser import CommonArgParser
 from CommonFunctions import TgzHelper, next_file
+from Profiler import Profiler
 
 
 def untgz(tgz_filename, out_dir):
@@ -30,8 +31,11 @@ def main():
             help="""The directory the files to be extracted.
             (Default: Current directoty""")
     args = parser.parse_all()
-    for f in next_file(args.src_dir, ['*.tgz', '*.tar.gz']):
-        untgz(f, args.out_dir)
+    profiler = Profiler.init_from_parsed_args(args, __file__)
+    with profiler.run():
+        for f in next_file(args.src_dir, ['*.tgz', '*.tar.gz']):
+            with profiler.file(f):
+                untgz(f, args.out_dir)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""FileManifest stats all input files once, for size-aware scheduling
+
+The manifest can be cached to disk, so a restart does not need to walk
+the source tree again.
+
+Cache format is a text file: a header line, then size<TAB>path per line.
+"""
+
+import heapq
+import logging
+import os
+import sys
+
+import CommonFunctions
+
+try:
+    from typing import Any, Callable  # noqa: F401 # pylint: disable=W0611
+    from typing import List, Tuple  # noqa: F401 # pylint: disable=W0611
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+
+class FileManifest(object):
+    """Size of each input files
+
+    Args:
+        entries (List[Tuple[int, str]]): (size, path) of the files
+        header (str, optional): Defaults to ''. Identifies what was scanned
+
+    Examples:
+    >>> m = FileManifest([(10, 'a'), (30, 'b'), (20, 'c'), (5, 'd')])
+    >>> m.largest_first()
+    ['b', 'c', 'a', 'd']
+    >>> m.shard(0, 2, 'bytes').largest_first()
+    ['b', 'd']
+    >>> m.shard(1, 2, 'bytes').largest_first()
+    ['c', 'a']
+    >>> m.shard(1, 2, 'count').largest_first()
+    ['c', 'd']
+    """
+    SHARD_BY = ['count', 'bytes']
+
+    def __init__(self, entries, header=''):
+        # type: (List[Tuple[int, str]], str) -> None
+        self.entries = sorted(entries, key=lambda e: (-e[0], e[1]))
+        self.header = header
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def total_bytes(self):
+        return sum(e[0] for e in self.entries)
+
+    @staticmethod
+    def make_header(src_dir, filename_patterns=None, dir_filter=None):
+        header = "# %s %s" % (
+                os.path.abspath(src_dir),
+                ' '.join(filename_patterns) if filename_patterns else '*')
+        if dir_filter:
+            header += " %r" % dir_filter
+        return header
+
+    @classmethod
+    def scan(cls, src_dir, filename_patterns=None, dir_filter=None, jobs=1):
+        # type: (str, List[str], Any, int) -> FileManifest
+        """Walk src_dir and stat every matching file"""
+        entries = list(CommonFunctions.scan_files(
+                src_dir, filename_patterns, dir_filter, jobs, with_size=True))
+        logging.info("Scanned %d files in %s", len(entries), src_dir)
+        return cls(
+                entries,
+                cls.make_header(src_dir, filename_patterns, dir_filter))
+
+    @classmethod
+    def load(cls, cache_file):
+        # type: (str) -> FileManifest
+        entries = []
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            header = f.readline().rstrip('\n')
+            for line in f:
+                size, path = line.rstrip('\n').split('\t', 1)
+                entries.append((int(size), path))
+        logging.info("Loaded %d files from %s", len(entries), cache_file)
+        return cls(entries, header)
+
+    def save(self, cache_file):
+        # type: (str) -> None
+        """Write to cache_file atomically"""
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(self.header + '\n')
+            for size, path in self.entries:
+                f.write("%d\t%s\n" % (size, path))
+        os.replace(tmp_file, cache_file)
+        logging.info("Saved %d files to %s", len(self.entries), cache_file)
+
+    @classmethod
+    def obtain(
+            cls, src_dir, filename_patterns=None, cache_file=None,
+            rescan=False, dir_filter=None, jobs=1):
+        # type: (str, List[str], str, bool, Any, int) -> FileManifest
+        """Load from cache_file if it is of the same src_dir and patterns,
+        otherwise scan and save to cache_file"""
+        header = cls.make_header(src_dir, filename_patterns, dir_filter)
+        if cache_file and not rescan and os.path.exists(cache_file):
+            manifest = cls.load(cache_file)
+            if manifest.header == header:
+                return manifest
+            logging.warning(
+                    "Manifest %s is not for %s, rescanning",
+                    cache_file, header)
+        manifest = cls.scan(src_dir, filename_patterns, dir_filter, jobs)
+        if cache_file:
+            manifest.save(cache_file)
+        return manifest
+
+    def largest_first(self):
+        # type: () -> List[str]
+        """Paths in largest-first order (LPT scheduling)
+
+        Feeding this order to a pool of workers keeps the huge files
+        from being the last ones while other workers are idle."""
+        return [e[1] for e in self.entries]
+
+    def select(self, predicate):
+        # type: (Callable[[str], bool]) -> FileManifest
+        """The files whose path satisfies predicate"""
+        return FileManifest(
+                [e for e in self.entries if predicate(e[1])], self.header)
+
+    def bins(self, total, by='bytes'):
+        # type: (int, str) -> List[FileManifest]
+        """Split into total bins
+
+        by='count': deal files largest-first in round robin,
+            so each bin has the same number of files
+        by='bytes': put the next largest file into the bin with
+            least bytes (greedy LPT), so each bin has similar bytes
+        """
+        bins = [[] for _ in range(total)]  # type: List[List[Tuple[int, str]]]
+        if by == 'count':
+            for idx, e in enumerate(self.entries):
+                bins[idx % total].append(e)
+        elif by == 'bytes':
+            heap = [(0, idx) for idx in range(total)]
+            for e in self.entries:
+                nbytes, idx = heap[0]
+                bins[idx].append(e)
+                heapq.heapreplace(heap, (nbytes + e[0], idx))
+        else:
+            raise ValueError("Unsupported shard by: %s" % by)
+        return [FileManifest(b, self.header) for b in bins]
+
+    def shard(self, index, total, by='bytes'):
+        # type: (int, int, str) -> FileManifest
+        """The index-th (0 based) of total shards"""
+        return self.bins(total, by)[index]
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""IngestCache remembers ingested source files, so re-runs are incremental
+
+For each source file, the table ingest_files stores size, mtime,
+a hash of the raw (still compressed) file, its DocumentId and row counts.
+
+A file is skipped without being decompressed or parsed when:
+  * size and mtime are unchanged, or
+  * the hash is unchanged (e.g. the file was touched or copied again)
+
+Otherwise the rows of its previous DocumentId are deleted before ingest.
+"""
+
+import hashlib
+import logging
+import os
+
+import CommonFunctions
+
+from DbHandler import DbHandler
+
+HASH_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+
+class IngestRecord(object):
+    """Ingest state of a source file"""
+    __slots__ = ['path', 'size', 'mtime', 'hash', 'old_document_id']
+
+    def __init__(self, path, size, mtime):
+        # type: (str, int, int) -> None
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.hash = None  # type: str
+        self.old_document_id = None  # type: int
+
+
+class IngestCache(object):
+    """Ingest cache stored in the target DB
+
+    Args:
+        db_handler (DbHandler): connected DB handler
+        src_dir (str): Paths are stored relative to src_dir
+    """
+    TABLE_NAME = 'ingest_files'
+
+    def __init__(self, db_handler: DbHandler, src_dir: str):
+        self.db_handler = db_handler
+        self.src_dir = src_dir
+        self.lang = db_handler.args.lang
+
+    def ensure_table(self):
+        if self.db_handler.is_table_present(self.TABLE_NAME):
+            return
+        logging.info(f"Table {self.TABLE_NAME} is not present, creating")
+        self.db_handler.execute(f"""
+                CREATE TABLE {self.TABLE_NAME} (
+                    Lang varchar(16) NOT NULL,
+                    Path varchar(1024) NOT NULL,
+                    Size bigint NOT NULL,
+                    MTime bigint NOT NULL,
+                    Hash char(32) NOT NULL,
+                    DocumentId int NOT NULL,
+                    Words int NOT NULL,
+                    Times int NOT NULL,
+                    Metas int NOT NULL,
+                    PRIMARY KEY (Lang, Path));""")
+
+    @staticmethod
+    def file_hash(in_file: str):
+        """blake2b hash of the raw file content"""
+        h = hashlib.blake2b(digest_size=16)
+        with open(in_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def check(self, in_file: str):
+        """Check whether in_file needs to be ingested
+
+        Returns:
+            IngestRecord: None if the file is unchanged
+        """
+        st = os.stat(in_file)
+        record = IngestRecord(
+                os.path.relpath(in_file, self.src_dir),
+                st.st_size, st.st_mtime_ns)
+        row = self.db_handler.execute(
+                f"""SELECT Size, MTime, Hash, DocumentId
+                 FROM {self.TABLE_NAME}
+                 WHERE Lang = %(lang)s AND Path = %(path)s;""",
+                {'lang': self.lang, 'path': record.path}).fetchone()
+        if row and row[0] == record.size and row[1] == record.mtime:
+            return None
+        record.hash = self.file_hash(in_file)
+        if row:
+            if row[2] == record.hash:
+                # Only mtime changed
+                self.touch(record)
+                return None
+            record.old_document_id = row[3]
+        return record
+
+    def touch(self, record: IngestRecord):
+        """Refresh size and mtime of an unchanged file"""
+        self.db_handler.execute(
+                f"""UPDATE {self.TABLE_NAME}
+                 SET Size = %(size)s, MTime = %(mtime)s
+                 WHERE Lang = %(lang)s AND Path = %(path)s;""",
+                {'size': record.size, 'mtime': record.mtime,
+                 'lang': self.lang, 'path': record.path})
+
+    def update(self, record: IngestRecord, document_id, row_counts):
+        """Insert or update the ingest state of the ingested file"""
+        self.db_handler.execute(
+                f"""INSERT INTO {self.TABLE_NAME}
+                 VALUES (%(lang)s, %(path)s, %(size)s, %(mtime)s, %(hash)s,
+                  %(doc_id)s, %(words)s, %(times)s, %(metas)s)
+                 ON CONFLICT (Lang, Path) DO UPDATE SET
+                  Size = EXCLUDED.Size, MTime = EXCLUDED.MTime,
+                  Hash = EXCLUDED.Hash, DocumentId = EXCLUDED.DocumentId,
+                  Words = EXCLUDED.Words, Times = EXCLUDED.Times,
+                  Metas = EXCLUDED.Metas;""",
+                {'lang': self.lang, 'path': record.path,
+                 'size': record.size, 'mtime': record.mtime,
+                 'hash': record.hash, 'doc_id': document_id,
+                 'words': row_counts['words'], 'times': row_counts['time'],
+                 'metas': row_counts['meta']})
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
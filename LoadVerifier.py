@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""LoadVerifier checks a finished export against its source files
+
+The source files are parsed again by worker processes into per-document
+digests: row counts and checksums of words_<lang>, time_<lang> and meta.
+The checksums are sums that the DB computes with aggregate queries,
+which are run for a batch of documents at a time, so only the
+aggregates cross the network.
+
+Documents are reported when they are missing from the DB, when a table
+differs from the source, or when the start or end word of a time window
+is not in words_<lang>. Malformed source files are reported too, they
+do not stop the verification.
+"""
+
+import logging
+import os
+import sys
+
+import CommonFunctions
+
+from argparse import Namespace
+from collections import namedtuple
+from DbHandler import DbHandler, RowBatch
+
+try:
+    from typing import Dict, Iterable, Iterator, List  # noqa: F401
+    from typing import TextIO, Tuple  # noqa: F401
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+# error is set for a malformed source file, which has no rows
+DocumentDigest = namedtuple('DocumentDigest', [
+        'document_id', 'words', 'times', 'metas', 'source', 'error'],
+        defaults=[None])
+
+# Aggregates of each table, the digest of source rows computes the same
+WORDS_AGGREGATES = (
+        "COUNT(*), SUM(SentenceId), SUM(WordId), SUM(LENGTH(Word)),"
+        " SUM(WordId * LENGTH(Word))")
+TIME_AGGREGATES = (
+        "COUNT(*), SUM(TimeId), SUM(StartSentenceId), SUM(StartWordId),"
+        " SUM(EndSentenceId), SUM(EndWordId)")
+TIME_MS_AGGREGATES = ", SUM(StartMs), SUM(EndMs)"
+META_AGGREGATES = "COUNT(*), SUM(LENGTH(Value))"
+
+def digest_batch(batch: RowBatch, source: str, time_ms=False):
+    """Digest of the rows of one document
+
+    Examples:
+    >>> batch = RowBatch()
+    >>> batch.words.append(7, 1, 1, 'Hi')
+    >>> batch.words.append(7, 1, 2, 'there')
+    >>> batch.times.append(7, 1, 1, 1, 0, 1, 2, 900)
+    >>> batch.metas.append((7, 'year', '2001'))
+    >>> batch.document_rows.append((7,))
+    >>> digest_batch(batch, '7.xml', time_ms=True)
+    DocumentDigest(document_id=7, words=(2, 2, 3, 7, 12), \
+times=(1, 1, 1, 1, 1, 2, 0, 900), metas=(1, 4), source='7.xml', error=None)
+    """
+    words = [0] * 5
+    for _, s_id, w_id, word in batch.words:
+        length = len(word) if word else 0
+        words[0] += 1
+        words[1] += s_id
+        words[2] += w_id
+        words[3] += length
+        words[4] += w_id * length
+    times = [0] * (8 if time_ms else 6)
+    for row in batch.times:
+        times[0] += 1
+        # TimeId, StartSentenceId, StartWordId, then the ends
+        for idx, value in enumerate(row[1:4] + row[5:7], start=1):
+            times[idx] += value
+        if time_ms:
+            times[6] += row[4]
+            times[7] += row[7]
+    metas = [len(batch.metas), sum(len(row[2]) for row in batch.metas)]
+    return DocumentDigest(
+            batch.document_rows[0][0], tuple(words), tuple(times),
+            tuple(metas), source)
+
+
+def digest_file(in_file: str, args: Namespace):
+    # type: (str, Namespace) -> DocumentDigest
+    """Parse a source file the way XmlExporter does and digest its rows
+
+    A malformed file gets a digest with the error instead of rows"""
+    # Imported here to avoid circular import
+    from XmlExporter import MALFORMED_FILE_ERRORS, parse_document
+    try:
+        batch = parse_document(in_file, args)
+    except MALFORMED_FILE_ERRORS as e:
+        return DocumentDigest(
+                None, None, None, None, in_file, "%s: %s" % (
+                        type(e).__name__, ' '.join(str(e).split())))
+    return digest_batch(batch, in_file, getattr(args, 'time_ms', False))
+
+
+class LoadVerifier(object):
+    """Compare document digests with aggregates of the DB
+
+    Args:
+        db_handler (DbHandler): connected DB handler
+        report (TextIO): Tab separated lines of
+            DocumentId, status, detail and source file are written here
+        batch_documents (int, optional): Defaults to 500.
+            Documents per aggregate query
+    """
+    STATUSES = ['ok', 'missing', 'differs', 'dangling', 'malformed']
+
+    def __init__(self, db_handler: DbHandler, report, batch_documents=500):
+        # type: (DbHandler, TextIO, int) -> None
+        self.db_handler = db_handler
+        self.lang = db_handler.args.lang
+        self.time_ms = db_handler.time_ms
+        self.report = report
+        self.batch_documents = batch_documents
+        self.counts = dict.fromkeys(self.STATUSES, 0)
+
+    def aggregates(self, table_name: str, aggregates: str, ids: List[int]):
+        # type: (str, str, List[int]) -> Dict[int, tuple]
+        """Aggregates of each document in ids, NULL sums are 0"""
+        cur = self.db_handler.execute(
+                f"""SELECT DocumentId, {aggregates} FROM {table_name}
+                 WHERE DocumentId IN ({', '.join(map(str, ids))})
+                 GROUP BY DocumentId;""")
+        return {
+                row[0]: tuple(v or 0 for v in row[1:])
+                for row in cur.fetchall()}
+
+    def dangling(self, ids: List[int]):
+        # type: (List[int]) -> Dict[int, int]
+        """Time windows whose start or end word is not in words table"""
+        cur = self.db_handler.execute(
+                f"""SELECT t.DocumentId, COUNT(*) FROM time_{self.lang} t
+                 LEFT JOIN words_{self.lang} s
+                  ON s.DocumentId = t.DocumentId
+                  AND s.SentenceId = t.StartSentenceId
+                  AND s.WordId = t.StartWordId
+                 LEFT JOIN words_{self.lang} e
+                  ON e.DocumentId = t.DocumentId
+                  AND e.SentenceId = t.EndSentenceId
+                  AND e.WordId = t.EndWordId
+                 WHERE t.DocumentId IN ({', '.join(map(str, ids))})
+                  AND (s.DocumentId IS NULL OR e.DocumentId IS NULL)
+                 GROUP BY t.DocumentId;""")
+        return dict(cur.fetchall())
+
+    def verify_batch(self, digests: List[DocumentDigest]):
+        ids = [digest.document_id for digest in digests]
+        time_aggregates = TIME_AGGREGATES + (
+                TIME_MS_AGGREGATES if self.time_ms else '')
+        tables = [
+                ('words', self.aggregates(
+                        f"words_{self.lang}", WORDS_AGGREGATES, ids)),
+                ('times', self.aggregates(
+                        f"time_{self.lang}", time_aggregates, ids)),
+                ('metas', self.aggregates("meta", META_AGGREGATES, ids))]
+        documents = self.aggregates(
+                f"documents_{self.lang}", "COUNT(*)", ids)
+        dangling = self.dangling(ids)
+        for digest in digests:
+            doc_id = digest.document_id
+            if doc_id not in documents and not any(
+                    doc_id in rows for _, rows in tables):
+                self.add(digest, 'missing', '')
+                continue
+            differs = []
+            for name, rows in tables:
+                expected = getattr(digest, name)
+                # A document without rows has no group
+                actual = rows.get(doc_id, (0,) * len(expected))
+                if actual != expected:
+                    differs.append("%s %s != %s" % (name, actual, expected))
+            if doc_id in dangling:
+                detail = "%d time windows" % dangling[doc_id]
+                if differs:
+                    differs.append("dangling " + detail)
+                else:
+                    self.add(digest, 'dangling', detail)
+                    continue
+            if differs:
+                self.add(digest, 'differs', '; '.join(differs))
+            else:
+                self.counts['ok'] += 1
+
+    def add(self, digest: DocumentDigest, status: str, detail: str):
+        self.counts[status] += 1
+        # The DocumentId of a malformed file is unknown
+        self.report.write("%s\t%s\t%s\t%s\n" % (
+                '' if digest.document_id is None else digest.document_id,
+                status, detail, digest.source))
+
+    def verify(self, digests: Iterable[DocumentDigest]):
+        """Verify the digests in batches
+
+        Returns:
+            bool: True if all documents are ok
+        """
+        batch = []  # type: List[DocumentDigest]
+        for digest in digests:
+            if digest.error:
+                self.add(digest, 'malformed', digest.error)
+                continue
+            batch.append(digest)
+            if len(batch) >= self.batch_documents:
+                self.verify_batch(batch)
+                batch = []
+        if batch:
+            self.verify_batch(batch)
+        logging.info(
+                "Verified %d documents: %s", sum(self.counts.values()),
+                ', '.join(
+                        "%d %s" % (count, status)
+                        for status, count in self.counts.items()))
+        return self.counts['ok'] == sum(self.counts.values())
+
+
+def digest_files(args: Namespace, files: List[str]):
+    # type: (Namespace, List[str]) -> Iterator[DocumentDigest]
+    """Digests of the files, parsed by args.jobs processes"""
+    return CommonFunctions.imap_jobs(digest_file, files, args, args.jobs)
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
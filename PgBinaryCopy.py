@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""PgBinaryCopy streams rows in PostgreSQL binary COPY format
+
+With the text format, PostgreSQL parses every id and interval from text,
+and the client formats them. In binary format, ids are packed as int4,
+intervals as the native (microseconds, days, months) triple and text as
+length-prefixed UTF-8.
+
+Rows are packed with precompiled struct.Struct into one preallocated
+buffer, which cursor.copy_expert() reads a chunk at a time.
+See https://www.postgresql.org/docs/current/sql-copy.html
+"""
+
+import os
+import struct
+import sys
+
+import CommonFunctions
+
+try:
+    from typing import Any, Callable, Iterable  # noqa: F401
+    from typing import List, Tuple  # noqa: F401
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+# Signature, flags and header extension length
+HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+# Field count -1 ends the data
+TRAILER = struct.pack('!h', -1)
+INT4 = struct.Struct('!i')
+# Formats of the fixed width fields, with their length prefix:
+#   'i' int4
+#   'I' interval from integer milliseconds
+FIXED_FIELDS = {'i': 'ii', 'I': 'iqii'}
+TEXT_FIELD = 's'
+
+
+class BinaryCopyReader(object):
+    """File-like binary COPY data of rows, for cursor.copy_expert()
+
+    Args:
+        rows (Iterable[tuple]): Rows to copy
+        fields (str): Type of each field: 'i' int4,
+            'I' interval from integer milliseconds, 's' text
+        buffer_size (int, optional): Defaults to 1 << 20.
+            Bytes of the preallocated buffer, returned by read() at most
+
+    Examples:
+    >>> reader = BinaryCopyReader([(1, 1500, 'h\\xe9'), (2, 0, None)], 'iIs')
+    >>> data = reader.read()
+    >>> data[:len(HEADER)] == HEADER
+    True
+    >>> struct.unpack('!hiiiqiii3s', data[19:56])
+    (3, 4, 1, 16, 1500000, 0, 0, 3, b'h\\xc3\\xa9')
+    >>> struct.unpack('!hiiiqiiih', data[56:])
+    (3, 4, 2, 16, 0, 0, 0, -1, -1)
+    >>> reader.read()
+    b''
+    """
+
+    def __init__(self, rows, fields: str, buffer_size=1 << 20):
+        # type: (Iterable[tuple], str, int) -> None
+        self.rows = iter(rows)
+        self.buffer = bytearray(max(buffer_size, len(HEADER)))
+        self.view = memoryview(self.buffer)
+        # Row that did not fit into the last chunk
+        self.pending = None  # type: tuple
+        self.started = False
+        self.finished = False
+        # Segments of consecutive fixed width fields packed by one Struct,
+        # and text fields: (Struct, values of row) or (None, row index).
+        # The first segment also packs the int16 field count.
+        self.segments = []  # type: List[Tuple[Any, Any]]
+        fixed = []  # type: List[Tuple[str, int]]
+        for idx, field in enumerate(fields + TEXT_FIELD):
+            if field in FIXED_FIELDS:
+                fixed.append((field, idx))
+                continue
+            if field != TEXT_FIELD:
+                raise ValueError("Unsupported field type: %s" % field)
+            if fixed or not self.segments:
+                count = None if self.segments else len(fields)
+                self.segments.append((
+                        struct.Struct('!' + ('h' if count else '') + ''.join(
+                                FIXED_FIELDS[f] for f, _ in fixed)),
+                        self.fixed_values(fixed, count)))
+                fixed = []
+            if idx < len(fields):
+                self.segments.append((None, idx))
+
+    @staticmethod
+    def fixed_values(fields, count=None):
+        # type: (List[Tuple[str, int]], int) -> Callable
+        """Function of a row to the values of the fixed width fields"""
+        def values(row):
+            result = [count] if count is not None else []
+            for field, idx in fields:
+                if field == 'i':
+                    result += (4, row[idx])
+                else:
+                    result += (16, row[idx] * 1000, 0, 0)
+            return result
+        return values
+
+    def pack_row(self, row: tuple, pos: int, end: int):
+        """Pack row at pos, returns the position after it,
+        or -1 if the row does not fit before end"""
+        buffer = self.buffer
+        for packer, values in self.segments:
+            if packer:
+                if pos + packer.size > end:
+                    return -1
+                packer.pack_into(buffer, pos, *values(row))
+                pos += packer.size
+                continue
+            text = row[values]
+            if text is None:
+                # NULL
+                data, length = b'', -1
+            else:
+                data = text.encode('utf-8')
+                length = len(data)
+            if pos + INT4.size + len(data) > end:
+                return -1
+            INT4.pack_into(buffer, pos, length)
+            pos += INT4.size
+            buffer[pos:pos + len(data)] = data
+            pos += len(data)
+        return pos
+
+    def read(self, size=-1):
+        """Next chunk of at most size bytes, empty after the trailer"""
+        if self.finished:
+            return b''
+        end = len(self.buffer) if size < 0 else min(size, len(self.buffer))
+        pos = 0
+        if not self.started:
+            self.buffer[:len(HEADER)] = HEADER
+            pos = len(HEADER)
+            self.started = True
+        while True:
+            row = self.pending
+            if row is None:
+                row = next(self.rows, None)
+            if row is None:
+                if pos + len(TRAILER) > end:
+                    break
+                self.buffer[pos:pos + len(TRAILER)] = TRAILER
+                pos += len(TRAILER)
+                self.finished = True
+                break
+            new_pos = self.pack_row(row, pos, end)
+            if new_pos < 0:
+                self.pending = row
+                if pos == 0:
+                    # A row larger than the buffer
+                    self.grow()
+                    end = len(self.buffer)
+                    continue
+                break
+            self.pending = None
+            pos = new_pos
+        return bytes(self.view[:pos])
+
+    def grow(self):
+        self.view.release()
+        self.buffer.extend(bytes(len(self.buffer)))
+        self.view = memoryview(self.buffer)
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
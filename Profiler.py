@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""Profiler wraps a run, or the N slowest files, with cProfile and tracemalloc
+
+Reports are written into the profile directory:
+  * <prog>-<timestamp>-run.pstats / .txt
+        whole-run cProfile stats and their human readable summary
+  * <prog>-<timestamp>-slow-<rank>.pstats / .txt
+        cProfile stats of the N slowest files
+  * <prog>-<timestamp>-mem-run.txt, <prog>-<timestamp>-mem-<rank>.txt
+        tracemalloc top allocations of the run or the N most allocating files
+
+cProfile and tracemalloc are only imported when enabled.
+To limit the overhead, tracemalloc stores only 1 frame per allocation, and
+per-file profiling can be sampled with --profile-every.
+"""
+
+import heapq
+import io
+import logging
+import os
+import sys
+import time
+
+from argparse import Namespace
+from contextlib import contextmanager
+
+try:
+    from typing import List, Any  # noqa: F401 # pylint: disable=unused-import
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+
+class Profiler(object):
+    """Profile the whole run or the N slowest files
+
+    Args:
+        profile (int, optional): Defaults to None. None disables cProfile;
+            0 profiles the whole run; N > 0 keeps the N slowest files.
+        trace_memory (int, optional): Defaults to None. None disables
+            tracemalloc; 0 traces the whole run; N > 0 keeps the N files
+            with the highest allocation peak.
+        out_dir (str, optional): Defaults to '.'. Report directory.
+        every (int, optional): Defaults to 1. Only profile every Nth file
+            in per-file mode.
+        prog (str, optional): Defaults to 'run'. Prefix of report files.
+
+    Examples:
+    >>> p = Profiler()
+    >>> p.enabled
+    False
+    >>> with p.run():
+    ...     with p.file('a.xml'):
+    ...         pass
+    """
+    TOP_LIMIT = 30
+    TRACE_FRAMES = 1
+
+    def __init__(
+            self, profile=None, trace_memory=None, out_dir='.', every=1,
+            prog='run'):
+        # type: (int, int, str, int, str) -> None
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.out_dir = out_dir
+        self.every = max(1, every)
+        self.prefix = "%s-%s" % (
+                os.path.splitext(os.path.basename(prog))[0],
+                time.strftime('%Y%m%d-%H%M%S'))
+        self.file_count = 0
+        # heap of (elapsed, seq, filename, cProfile.Profile)
+        self.slowest = []  # type: List[Any]
+        # heap of (peak, seq, filename, tracemalloc.Snapshot)
+        self.hungriest = []  # type: List[Any]
+
+    @classmethod
+    def init_from_parsed_args(cls, args: Namespace, prog='run'):
+        """Init from command line arguments"""
+        return cls(
+                getattr(args, 'profile', None),
+                getattr(args, 'trace_memory', None),
+                getattr(args, 'profile_dir', '.'),
+                getattr(args, 'profile_every', 1),
+                prog)
+
+    @property
+    def enabled(self):
+        return self.profile is not None or self.trace_memory is not None
+
+    def _report_path(self, suffix):
+        os.makedirs(self.out_dir, exist_ok=True)
+        return os.path.join(self.out_dir, f"{self.prefix}-{suffix}")
+
+    def _write_pstats(self, prof, suffix, title):
+        import pstats
+        pstats_path = self._report_path(f"{suffix}.pstats")
+        prof.dump_stats(pstats_path)
+        buf = io.StringIO()
+        buf.write(title + os.linesep)
+        stats = pstats.Stats(prof, stream=buf)
+        stats.sort_stats('cumulative').print_stats(self.TOP_LIMIT)
+        with open(self._report_path(f"{suffix}.txt"), 'w') as out:
+            out.write(buf.getvalue())
+        logging.info("Profile written to %s", pstats_path)
+
+    def _write_snapshot(self, snapshot, suffix, title):
+        import tracemalloc
+        snapshot = snapshot.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__)))
+        report_path = self._report_path(f"mem-{suffix}.txt")
+        with open(report_path, 'w') as out:
+            out.write(title + os.linesep)
+            for stat in snapshot.statistics('lineno')[:self.TOP_LIMIT]:
+                out.write(str(stat) + os.linesep)
+        logging.info("Memory report written to %s", report_path)
+
+    @contextmanager
+    def run(self):
+        """Wrap the whole run
+
+        When per-file mode is used, the reports of slowest files are
+        written when the run finishes.
+        """
+        if not self.enabled:
+            yield self
+            return
+        prof = None
+        if self.trace_memory is not None:
+            import tracemalloc
+            tracemalloc.start(self.TRACE_FRAMES)
+        if self.profile == 0:
+            import cProfile
+            prof = cProfile.Profile()
+            prof.enable()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            if prof:
+                prof.disable()
+                self._write_pstats(
+                        prof, 'run', "Run elapsed: %.3fs" % elapsed)
+            if self.trace_memory is not None:
+                import tracemalloc
+                if self.trace_memory == 0:
+                    current, peak = tracemalloc.get_traced_memory()
+                    self._write_snapshot(
+                            tracemalloc.take_snapshot(), 'run',
+                            "Run peak: %d bytes, current: %d bytes" % (
+                                    peak, current))
+                tracemalloc.stop()
+            self.write_file_reports()
+
+    @contextmanager
+    def file(self, filename: str):
+        """Wrap the processing of a single file
+
+        Only takes effect when either profile or trace_memory is N > 0
+        """
+        per_file_profile = self.profile is not None and self.profile > 0
+        per_file_memory = (
+                self.trace_memory is not None and self.trace_memory > 0)
+        if not per_file_profile and not per_file_memory:
+            yield
+            return
+        self.file_count += 1
+        if (self.file_count - 1) % self.every != 0:
+            yield
+            return
+        prof = None
+        if per_file_memory:
+            import tracemalloc
+            tracemalloc.reset_peak()
+            tracemalloc.clear_traces()
+        if per_file_profile:
+            import cProfile
+            prof = cProfile.Profile()
+            prof.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if prof:
+                prof.disable()
+                self._keep(
+                        self.slowest, self.profile,
+                        (elapsed, self.file_count, filename, prof))
+            if per_file_memory:
+                import tracemalloc
+                peak = tracemalloc.get_traced_memory()[1]
+                if (len(self.hungriest) < self.trace_memory
+                        or peak > self.hungriest[0][0]):
+                    # Only snapshot files that will make the list
+                    self._keep(
+                            self.hungriest, self.trace_memory,
+                            (peak, self.file_count, filename,
+                             tracemalloc.take_snapshot()))
+
+    @staticmethod
+    def _keep(heap, limit, item):
+        if len(heap) < limit:
+            heapq.heappush(heap, item)
+        else:
+            heapq.heappushpop(heap, item)
+
+    def write_file_reports(self):
+        """Write reports of the slowest and most allocating files"""
+        for rank, item in enumerate(
+                sorted(self.slowest, reverse=True), start=1):
+            elapsed, _, filename, prof = item
+            self._write_pstats(
+                    prof, f"slow-{rank}",
+                    "File: %s elapsed: %.3fs" % (filename, elapsed))
+        for rank, item in enumerate(
+                sorted(self.hungriest, key=lambda i: i[0], reverse=True),
+                start=1):
+            peak, _, filename, snapshot = item
+            self._write_snapshot(
+                    snapshot, str(rank),
+                    "File: %s peak: %d bytes" % (filename, peak))
+        self.slowest = []
+        self.hungriest = []
+
+
+if __name__ == '__main__':
+    import CommonFunctions
+    CommonFunctions.run_doctest_and_quit_if_enabled()
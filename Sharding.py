@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+"""Sharding splits an ingest across hosts that share nothing
+
+Each host runs XmlExporter with the same source tree and its own
+--shard i/N, and only exports the files of its shard. The shard of a file
+is the CRC32 of its key modulo N, where the key is the DocumentId of an
+OPUS file name (e.g. 4000000.xml.gz), or the path relative to src_dir.
+So every host computes the same split without coordination.
+
+With --db-dsn given once per DB, shard i writes to the i % (number of
+DSNs)-th DSN. verify_shards() checks afterwards that every DB holds the
+documents of its shards, and no document is in more than one DB.
+"""
+
+import logging
+import os
+import re
+import sys
+import zlib
+
+import CommonFunctions
+
+from argparse import ArgumentTypeError, Namespace
+from collections import Counter, namedtuple
+from DbHandler import DbHandler
+
+try:
+    from typing import Iterable, Iterator  # noqa: F401
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+Shard = namedtuple('Shard', ['index', 'count'])
+
+# OPUS file names are <DocumentId>.xml or <DocumentId>.xml.gz
+DOCUMENT_FILE_PATTERN = re.compile(r'(\d+)\.xml(?:\.gz)?$')
+# Tables whose rows are counted by verify_shards()
+VERIFY_TABLES = ['documents_{lang}', 'words_{lang}', 'time_{lang}', 'meta']
+
+
+def parse_shard(spec: str):
+    """Parse --shard i/N, i is 0 based
+
+    >>> parse_shard('2/8')
+    Shard(index=2, count=8)
+    >>> parse_shard('8/8')
+    Traceback (most recent call last):
+        ...
+    argparse.ArgumentTypeError: Invalid shard 8/8, expect i/N with 0 <= i < N
+    """
+    index, _, count = spec.partition('/')
+    try:
+        shard = Shard(int(index), int(count))
+    except ValueError:
+        shard = None
+    if not shard or not 0 <= shard.index < shard.count:
+        raise ArgumentTypeError(
+                "Invalid shard %s, expect i/N with 0 <= i < N" % spec)
+    return shard
+
+
+def shard_key(path: str, src_dir='.'):
+    """DocumentId of an OPUS file name, otherwise the relative path
+
+    >>> shard_key('/data/xml/en/1999/123/4000000.xml.gz', '/data')
+    '4000000'
+    >>> shard_key('/data/extra/a.xml', '/data')
+    'extra/a.xml'
+    """
+    m = DOCUMENT_FILE_PATTERN.fullmatch(os.path.basename(path))
+    if m:
+        return m.group(1)
+    return os.path.relpath(path, src_dir).replace(os.sep, '/')
+
+
+def shard_of(key: str, count: int):
+    """Shard of the key, the same on every host and Python run
+
+    >>> shard_of('4000000', 4), shard_of('4000001', 4)
+    (2, 0)
+    """
+    return zlib.crc32(key.encode('utf-8')) % count
+
+
+def select_shard(paths, shard: Shard, src_dir='.'):
+    # type: (Iterable[str], Shard, str) -> Iterator[str]
+    """The paths of the shard
+
+    >>> paths = ['xml/en/%d.xml.gz' % i for i in range(4000000, 4000006)]
+    >>> list(select_shard(paths, Shard(1, 2), 'xml'))
+    ['xml/en/4000004.xml.gz', 'xml/en/4000005.xml.gz']
+    >>> len(list(select_shard(paths, Shard(0, 2), 'xml')))
+    4
+    """
+    for path in paths:
+        if shard_of(shard_key(path, src_dir), shard.count) == shard.index:
+            yield path
+
+
+def count_rows(db_handler: DbHandler):
+    """Row count of each table in VERIFY_TABLES, None if it is missing"""
+    counts = {}
+    for table in VERIFY_TABLES:
+        table_name = table.format(lang=db_handler.args.lang)
+        if not db_handler.is_table_present(table_name):
+            counts[table_name] = None
+            continue
+        counts[table_name] = db_handler.execute(
+                f"SELECT COUNT(*) FROM {table_name};").fetchone()[0]
+    return counts
+
+
+def verify_shards(args: Namespace, paths: Iterable[str], shard_count=None):
+    """Check the documents and row counts of each DB of --db-dsn
+
+    The documents of each DB are compared to the files of its shards,
+    and DocumentIds in more than one DB are reported.
+
+    Args:
+        args (Namespace): Parsed arguments with db_dsn and lang
+        paths (Iterable[str]): All source files of all shards
+        shard_count (int, optional): Defaults to None.
+            N of --shard i/N, by default one shard per DSN
+
+    Returns:
+        bool: True if all DBs are consistent
+    """
+    dsn_count = len(args.db_dsn)
+    shard_count = shard_count or dsn_count
+    expected = Counter(
+            shard_of(shard_key(path, args.src_dir), shard_count) % dsn_count
+            for path in paths)
+    totals = Counter()  # type: Counter
+    owners = {}
+    duplicates = 0
+    ok = True
+    for dsn_index in range(dsn_count):
+        db_handler = DbHandler.get_handler(Namespace(**dict(
+                vars(args), shard=Shard(dsn_index, shard_count))))
+        db_handler.connect()
+        counts = count_rows(db_handler)
+        documents_table = f"documents_{args.lang}"
+        if counts[documents_table] is not None:
+            for (doc_id,) in db_handler.stream(
+                    f"SELECT DocumentId FROM {documents_table};"):
+                if doc_id in owners:
+                    duplicates += 1
+                    logging.error(
+                            "Document %d is in DB %d and %d",
+                            doc_id, owners[doc_id], dsn_index)
+                else:
+                    owners[doc_id] = dsn_index
+        documents = counts[documents_table] or 0
+        if documents != expected[dsn_index]:
+            ok = False
+            logging.error(
+                    "DB %d has %d documents, expected %d",
+                    dsn_index, documents, expected[dsn_index])
+        print("%d\t%s\t%s" % (dsn_index, db_handler.dsn, '\t'.join(
+                "%s=%s" % (table_name, count)
+                for table_name, count in counts.items())))
+        for table_name, count in counts.items():
+            totals[table_name] += count or 0
+        db_handler.conn.close()
+    print("total\t\t%s" % '\t'.join(
+            "%s=%d" % (table_name, count)
+            for table_name, count in totals.items()))
+    return ok and not duplicates
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+"""SourceScanner is a dry run of XmlExporter db: parse, but do not load
+
+Source files are decompressed, parsed and traversed into rows like the
+export does, by --jobs worker processes, but nothing is written.
+It reports the rows of each table per language, the PostgreSQL size of
+the tables and their indexes, the malformed files and the parse
+throughput per core, to validate an OPUS drop and size the DB before
+loading it.
+
+The size is estimated from the CREATE TABLE and CREATE INDEX statements
+of DbHandler.ensure_table_*(): each row is sized as a heap tuple with
+PostgreSQL alignment rules, and each index entry as a B-tree leaf tuple.
+See https://www.postgresql.org/docs/current/storage-page-layout.html
+"""
+
+import functools
+import logging
+import os
+import re
+import sys
+import time
+
+import CommonFunctions
+
+from argparse import Namespace
+from collections import namedtuple
+from CommonFunctions import opus_lang
+from DbHandler import RowBatch, RowCollector
+
+try:
+    from typing import Dict, Iterator, List, TextIO, Tuple  # noqa: F401
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+# Rows, table bytes and index bytes of each table
+FileScan = namedtuple('FileScan', [
+        'source', 'lang', 'source_bytes', 'seconds', 'tables', 'error'])
+TableSchema = namedtuple('TableSchema', ['types', 'indexes'])
+
+PAGE_BYTES = 8192
+PAGE_HEADER_BYTES = 24
+ITEM_POINTER_BYTES = 4
+# HeapTupleHeader is 23 bytes, followed by the null bitmap if any
+HEAP_HEADER_BYTES = 23
+INDEX_HEADER_BYTES = 8
+# Leaf pages of B-tree are filled to 90 % when built by CREATE INDEX
+BTREE_FILL = 0.9
+# Column type: (alignment, bytes), other types are variable length
+FIXED_TYPES = {'int': (4, 4), 'interval': (8, 16)}
+
+COLUMN_PATTERN = re.compile(r'^\s*(\w+)\s+(int|interval|varchar)\b', re.M)
+TABLE_PATTERN = re.compile(r'CREATE TABLE (\S+) \(')
+KEY_PATTERN = re.compile(r'PRIMARY KEY \(([^)]*)\)')
+INDEX_PATTERN = re.compile(r'CREATE INDEX \S+\s+ON (\S+)\s*\(([^)]*)\)')
+
+
+def align(size: int, alignment=8):
+    return (size + alignment - 1) & -alignment
+
+
+def tuple_bytes(types: List[str], row: tuple, header: int):
+    """Bytes of a tuple, aligned, with its item pointer
+
+    >>> tuple_bytes(['int', 'int', 'int', 'varchar'], (1, 2, 3, 'Hi'), 24)
+    44
+    >>> tuple_bytes(['int', 'interval'], (1, '0:0:1.000'), 24)
+    52
+    """
+    size = header
+    for column_type, value in zip(types, row):
+        if value is None:
+            continue
+        fixed = FIXED_TYPES.get(column_type)
+        if fixed:
+            size = align(size, fixed[0]) + fixed[1]
+            continue
+        length = len(value.encode('utf-8'))
+        if length < 127:
+            # Short varlena: 1 byte header, not aligned
+            size += 1 + length
+        else:
+            size = align(size, 4) + 4 + length
+    return ITEM_POINTER_BYTES + align(size)
+
+
+class SchemaRecorder(RowCollector):
+    """Record the statements of ensure_table_*() instead of running them"""
+
+    def __init__(self, args):
+        super(SchemaRecorder, self).__init__(args)
+        self.statements = []  # type: List[str]
+
+    def execute(self, cmd: str, vars=None):
+        self.statements.append(cmd)
+
+
+class SizeEstimator(object):
+    """PostgreSQL bytes of rows of the tables of XmlExporter db
+
+    Tables are named like words_{lang}, meta.
+
+    Args:
+        time_ms (bool, optional): Defaults to False.
+            With StartMs and EndMs columns of --time-ms
+
+    Examples:
+    >>> estimator = SizeEstimator()
+    >>> estimator.tables['meta']
+    TableSchema(types=['int', 'varchar', 'varchar'], indexes=[[0, 1]])
+    >>> estimator.estimate('meta', [(1, 'year', '1999')])
+    (1, 44, 31)
+    """
+
+    def __init__(self, time_ms=False):
+        recorder = SchemaRecorder(Namespace(lang='{lang}', time_ms=time_ms))
+        # Formats the times of batches like the handler of the export
+        self.formatter = recorder
+        # ensure_table_*() logs every table as created
+        logging.disable(logging.INFO)
+        try:
+            recorder.ensure_tables()
+        finally:
+            logging.disable(logging.NOTSET)
+        self.tables = {}  # type: Dict[str, TableSchema]
+        columns = {}  # type: Dict[str, List[str]]
+        for statement in recorder.statements:
+            m = TABLE_PATTERN.search(statement)
+            if m:
+                table = m.group(1)
+                names = COLUMN_PATTERN.findall(statement)
+                columns[table] = [name.lower() for name, _ in names]
+                self.tables[table] = TableSchema(
+                        [column_type for _, column_type in names], [])
+                key = KEY_PATTERN.search(statement)
+                if key:
+                    self.add_index(columns, table, key.group(1))
+                continue
+            m = INDEX_PATTERN.search(statement)
+            if m:
+                self.add_index(columns, m.group(1), m.group(2))
+
+    def add_index(self, columns, table: str, index_columns: str):
+        self.tables[table].indexes.append([
+                columns[table].index(column.strip().lower())
+                for column in index_columns.split(',')])
+
+    def estimate(self, table: str, rows):
+        """Row count, table bytes and index bytes of rows of table
+
+        Bytes include the page headers and the free space of B-tree
+        pages. Partly filled last pages are not counted, as the rows of
+        a document share pages with the next ones."""
+        schema = self.tables[table]
+        indexes = [
+                ([schema.types[i] for i in positions], positions)
+                for positions in schema.indexes]
+        count = heap = index = 0
+        for row in rows:
+            count += 1
+            header = HEAP_HEADER_BYTES
+            if None in row:
+                header += (len(row) + 7) // 8
+            heap += tuple_bytes(schema.types, row, align(header))
+            for types, positions in indexes:
+                index += tuple_bytes(
+                        types, [row[i] for i in positions],
+                        INDEX_HEADER_BYTES)
+        usable = PAGE_BYTES - PAGE_HEADER_BYTES
+        return (
+                count, heap * PAGE_BYTES // usable,
+                int(index / BTREE_FILL) * PAGE_BYTES // usable)
+
+    def estimate_batch(self, batch: RowBatch):
+        # type: (RowBatch) -> Dict[str, Tuple[int, int, int]]
+        """Estimates of each table of the rows of a document"""
+        return {
+                'words_{lang}': self.estimate('words_{lang}', batch.words),
+                'time_{lang}': self.estimate(
+                        'time_{lang}', self.formatter.time_rows(batch.times)),
+                'meta': self.estimate('meta', batch.metas),
+                'documents_{lang}': self.estimate(
+                        'documents_{lang}', batch.document_rows)}
+
+
+def scan_file(in_file: str, args: Namespace, estimator: SizeEstimator):
+    """Parse a source file the way XmlExporter does, and size its rows"""
+    # Imported here to avoid circular import
+    from XmlExporter import MALFORMED_FILE_ERRORS, is_multi_lang
+    from XmlExporter import parse_document
+    # Like db, a single-language scan counts every file as args.lang
+    lang = opus_lang(in_file) if is_multi_lang(args) else args.lang
+    if lang is None:
+        # A multi-language export skips it too
+        return FileScan(in_file, None, 0, 0.0, {}, None)
+    start = time.perf_counter()
+    try:
+        source_bytes = os.path.getsize(in_file)
+        batch = parse_document(in_file, args)
+    except MALFORMED_FILE_ERRORS as e:
+        return FileScan(
+                in_file, lang, 0, time.perf_counter() - start, {},
+                "%s: %s" % (type(e).__name__, ' '.join(str(e).split())))
+    seconds = time.perf_counter() - start
+    return FileScan(
+            in_file, lang, source_bytes, seconds,
+            estimator.estimate_batch(batch), None)
+
+
+def scan_sources(args: Namespace, files: List[str]):
+    # type: (Namespace, List[str]) -> Iterator[FileScan]
+    """Scans of the files, parsed by args.jobs processes"""
+    return CommonFunctions.imap_jobs(
+            functools.partial(
+                    scan_file, estimator=SizeEstimator(
+                            getattr(args, 'time_ms', False))),
+            files, args, args.jobs)
+
+
+class ScanReport(object):
+    """Totals of FileScan per language and table
+
+    Args:
+        malformed_report (TextIO): Tab separated lines of malformed
+            source files and their errors are written here
+    """
+
+    def __init__(self, malformed_report):
+        # type: (TextIO) -> None
+        self.malformed_report = malformed_report
+        # (lang, table): [rows, table bytes, index bytes]
+        self.totals = {}  # type: Dict[Tuple[str, str], List[int]]
+        self.files = 0
+        self.malformed = 0
+        # Files that are not in xml/<lang>/ of a multi-language export
+        self.skipped = 0
+        self.source_bytes = 0
+        self.seconds = 0.0
+
+    def add(self, scan: FileScan):
+        self.files += 1
+        self.seconds += scan.seconds
+        if scan.lang is None:
+            self.skipped += 1
+            return
+        if scan.error:
+            self.malformed += 1
+            self.malformed_report.write(
+                    "%s\t%s\n" % (scan.source, scan.error))
+            return
+        self.source_bytes += scan.source_bytes
+        for table, values in scan.tables.items():
+            total = self.totals.setdefault((scan.lang, table), [0, 0, 0])
+            for idx, value in enumerate(values):
+                total[idx] += value
+
+    def scan(self, scans, jobs=1, out=sys.stdout):
+        """Add the scans, then print the totals and throughput
+
+        Returns:
+            bool: True if no file is malformed
+        """
+        start = time.perf_counter()
+        for scan in scans:
+            self.add(scan)
+            if self.files % 1000 == 0:
+                logging.info("Scanned %d files", self.files)
+        wall_seconds = time.perf_counter() - start
+        mib = float(1 << 20)
+        out.write("lang\ttable\trows\ttable_mib\tindex_mib\n")
+        totals = [0, 0, 0]
+        words = 0
+        for (lang, table), (rows, heap, index) in sorted(
+                self.totals.items()):
+            out.write("%s\t%s\t%d\t%.1f\t%.1f\n" % (
+                    lang, table.format(lang=lang), rows, heap / mib,
+                    index / mib))
+            totals = [totals[0] + rows, totals[1] + heap, totals[2] + index]
+            if table == 'words_{lang}':
+                words += rows
+        out.write("total\t\t%d\t%.1f\t%.1f\n" % (
+                totals[0], totals[1] / mib, totals[2] / mib))
+        out.write(
+                "files=%d malformed=%d skipped=%d source_mib=%.1f jobs=%d"
+                " wall_seconds=%.2f parse_seconds=%.2f\n" % (
+                        self.files, self.malformed, self.skipped,
+                        self.source_bytes / mib, jobs, wall_seconds,
+                        self.seconds))
+        # Parse time is summed over the worker processes
+        seconds = self.seconds or float('nan')
+        out.write(
+                "per core: %.1f files/s, %.2f source MiB/s, %.0f words/s\n"
+                % (self.files / seconds, self.source_bytes / mib / seconds,
+                   words / seconds))
+        return not self.malformed
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+"""TimeAligner aligns the subtitles of 2 languages by time overlap
+
+For each pair of documents, e.g. the en and zh_cn subtitles of a movie,
+the time windows of time_<lang_a> and time_<lang_b> are aligned with a
+sort-merge sweep: O(n log n + k) for n windows and k alignments.
+Alignments are written in batches to align_<lang_a>_<lang_b>,
+pairs are aligned in parallel by --jobs worker processes.
+
+Document pairs are read from a tab separated file of DocumentIds,
+or from the linkGrp elements of an OPUS alignment file (e.g. en-zh_cn.xml.gz).
+It requires the StartMs and EndMs columns of XmlExporter db --time-ms.
+
+    python TimeAligner.py -b sqlite -j 4 en zh_cn en-zh_cn.xml.gz
+"""
+
+import gzip
+import heapq
+import logging
+import os
+import sys
+import xml.etree.ElementTree as ETree
+import CommonFunctions
+
+from argparse import Namespace
+from CommonArgParser import CommonArgParser
+from CommonArgParser import ExitStatus
+from DbHandler import DbHandler
+
+try:
+    from typing import Iterator, List, Tuple  # noqa: F401
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+ALIGN_COLUMNS = [
+        'DocumentIdA', 'TimeIdA', 'StartSentenceIdA',
+        'DocumentIdB', 'TimeIdB', 'StartSentenceIdB', 'OverlapMs']
+
+# Per worker process state of --jobs
+worker_aligner = None  # type: TimeAligner
+
+
+def align_spans(spans_a, spans_b, min_overlap_ms=1):
+    """Pairs of overlapping spans with a sweep over the start times
+
+    Spans are (start_ms, end_ms, key). Spans of a language may overlap
+    each other, the active spans of each language are kept in a heap
+    ordered by end time.
+
+    Returns:
+        Iterator[Tuple[Any, Any, int]]: (key_a, key_b, overlap_ms)
+
+    Examples:
+    >>> a = [(0, 1000, 'a1'), (1000, 3000, 'a2'), (5000, 6000, 'a3')]
+    >>> b = [(500, 2000, 'b1'), (2500, 2600, 'b2'), (2550, 5500, 'b3')]
+    >>> list(align_spans(a, b))
+    [('a1', 'b1', 500), ('a2', 'b1', 1000), ('a2', 'b2', 100), \
+('a2', 'b3', 450), ('a3', 'b3', 500)]
+    >>> list(align_spans(a, b, min_overlap_ms=500))
+    [('a1', 'b1', 500), ('a2', 'b1', 1000), ('a3', 'b3', 500)]
+    """
+    events = heapq.merge(
+            ((start, end, 0, key) for start, end, key in sorted(spans_a)),
+            ((start, end, 1, key) for start, end, key in sorted(spans_b)))
+    # Heaps of (end_ms, start_ms, key) of the spans started so far
+    active = ([], [])  # type: Tuple[List[tuple], List[tuple]]
+    for start, end, side, key in events:
+        others = active[1 - side]
+        # Spans ended before this one starts will not overlap any more
+        while others and others[0][0] <= start:
+            heapq.heappop(others)
+        for other_end, _, other_key in sorted(others, key=lambda o: o[1]):
+            # Other spans started earlier, so the overlap starts here
+            overlap = min(end, other_end) - start
+            if overlap >= min_overlap_ms:
+                if side:
+                    yield other_key, key, overlap
+                else:
+                    yield key, other_key, overlap
+        heapq.heappush(active[side], (end, start, key))
+
+
+def read_pairs(pairs_file: str):
+    # type: (str) -> Iterator[Tuple[int, int]]
+    """Document pairs of a tab separated file or an OPUS alignment file
+
+    The DocumentId of an OPUS document path like
+    en/1999/12345/4000000.xml.gz is 4000000.
+    """
+    if pairs_file.endswith(('.xml', '.xml.gz')):
+        opener = gzip.open if pairs_file.endswith('.gz') else open
+        with opener(pairs_file, 'rb') as f:
+            for _, node in ETree.iterparse(f):
+                if node.tag != 'linkGrp':
+                    continue
+                yield tuple(
+                        int(os.path.basename(node.attrib[doc]).split('.')[0])
+                        for doc in ('fromDoc', 'toDoc'))
+                # The links of the group are not needed
+                node.clear()
+        return
+    with open(pairs_file, 'r') as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                doc_a, doc_b = line.split()[:2]
+                yield int(doc_a), int(doc_b)
+
+
+class TimeAligner(object):
+    """Align the time windows of document pairs
+
+    Args:
+        db_handler (DbHandler): connected DB handler
+        lang_a (str): Language of the first DocumentId of the pairs
+        lang_b (str): Language of the second DocumentId of the pairs
+        min_overlap_ms (int, optional): Defaults to 1.
+            Minimal overlap of aligned time windows
+    """
+
+    def __init__(self, db_handler: DbHandler, lang_a: str, lang_b: str,
+                 min_overlap_ms=1):
+        self.db_handler = db_handler
+        self.lang_a = lang_a
+        self.lang_b = lang_b
+        self.min_overlap_ms = min_overlap_ms
+        self.table_name = f"align_{lang_a}_{lang_b}"
+
+    def ensure_table(self):
+        if self.db_handler.is_table_present(self.table_name):
+            return
+        logging.info(f"Table {self.table_name} is not present, creating")
+        self.db_handler.execute(f"""
+                CREATE TABLE {self.table_name} (
+                    DocumentIdA int NOT NULL,
+                    TimeIdA int NOT NULL,
+                    StartSentenceIdA int NOT NULL,
+                    DocumentIdB int NOT NULL,
+                    TimeIdB int NOT NULL,
+                    StartSentenceIdB int NOT NULL,
+                    OverlapMs int NOT NULL,
+                    PRIMARY KEY (DocumentIdA, TimeIdA, StartSentenceIdA,
+                     DocumentIdB, TimeIdB, StartSentenceIdB));""")
+
+    def spans(self, lang: str, doc_id: int):
+        """(StartMs, EndMs, (TimeId, StartSentenceId)) of a document"""
+        cur = self.db_handler.execute(
+                f"""SELECT StartMs, EndMs, TimeId, StartSentenceId
+                 FROM time_{lang} WHERE DocumentId = %(doc_id)s
+                 ORDER BY StartMs;""",
+                {'doc_id': doc_id})
+        return [(row[0], row[1], (row[2], row[3])) for row in cur]
+
+    def align(self, doc_a: int, doc_b: int):
+        # type: (int, int) -> List[tuple]
+        """Alignment rows of a document pair"""
+        return [
+                (doc_a,) + key_a + (doc_b,) + key_b + (overlap,)
+                for key_a, key_b, overlap in align_spans(
+                        self.spans(self.lang_a, doc_a),
+                        self.spans(self.lang_b, doc_b),
+                        self.min_overlap_ms)]
+
+    def align_batch(self, pairs: List[Tuple[int, int]]):
+        """Replace the alignments of the pairs in one transaction
+
+        Returns:
+            int: Number of alignment rows
+        """
+        rows = []
+        for doc_a, doc_b in pairs:
+            rows.extend(self.align(doc_a, doc_b))
+        condition = ' OR '.join(
+                "(DocumentIdA = %d AND DocumentIdB = %d)" % (
+                        int(doc_a), int(doc_b))
+                for doc_a, doc_b in pairs)
+        with self.db_handler.transaction():
+            self.db_handler.execute(
+                    f"DELETE FROM {self.table_name} WHERE {condition};")
+            self.db_handler.bulk_insert(self.table_name, ALIGN_COLUMNS, rows)
+        return len(rows)
+
+
+def _init_worker(args: Namespace):
+    """Each worker has its own DB connection"""
+    global worker_aligner
+    db_handler = DbHandler.get_handler(args)
+    db_handler.connect()
+    worker_aligner = TimeAligner(
+            db_handler, args.lang_a, args.lang_b, args.min_overlap)
+
+
+def _align_batch_worker(pairs: List[Tuple[int, int]]):
+    return len(pairs), worker_aligner.align_batch(pairs)
+
+
+def batches(pairs, size: int):
+    """Split the pairs into lists of size pairs
+
+    >>> list(batches(iter(range(5)), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    batch = []
+    for pair in pairs:
+        batch.append(pair)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def main():
+    """Run as command line program"""
+    parser = CommonArgParser(__file__)
+    parser.add_argument(
+            '-b', '--db-product', type=str, default='postgresql',
+            help='The DB: postgresql, sqlite')
+    parser.add_argument(
+            '-N', '--db-name', type=str, default='opensubtitle',
+            help='The DB name')
+    parser.add_argument(
+            '-p', '--db-password', type=str,
+            help='The DB password')
+    parser.add_argument(
+            '-u', '--db-user', type=str,
+            help='The DB username')
+    parser.add_argument(
+            '-j', '--jobs', type=int, default=1,
+            help='Number of worker processes (Default: 1)')
+    parser.add_argument(
+            '--batch-pairs', type=int, default=100,
+            help='Document pairs per transaction (Default: 100)')
+    parser.add_argument(
+            '--min-overlap', type=int, default=1,
+            help='Minimal overlap in ms of aligned windows (Default: 1)')
+    parser.add_argument('lang_a', help='Language of the first documents')
+    parser.add_argument('lang_b', help='Language of the second documents')
+    parser.add_argument(
+            'pairs',
+            help="""Tab separated DocumentId pairs,
+            or an OPUS alignment file (.xml or .xml.gz)""")
+    args = parser.parse_all()
+    if not os.path.exists(args.pairs):
+        logging.critical("Pairs file %s is not found", args.pairs)
+        sys.exit(ExitStatus.FATAL_INVALID_ARGUMENTS.value)
+    setattr(args, 'lang', args.lang_a)
+    db_handler = DbHandler.get_handler(args)
+    db_handler.connect()
+    aligner = TimeAligner(
+            db_handler, args.lang_a, args.lang_b, args.min_overlap)
+    aligner.ensure_table()
+    pair_batches = batches(read_pairs(args.pairs), args.batch_pairs)
+    pairs = rows = 0
+    if args.jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(
+                args.jobs, initializer=_init_worker, initargs=(args,))
+        try:
+            for batch_pairs, batch_rows in pool.imap_unordered(
+                    _align_batch_worker, pair_batches):
+                pairs += batch_pairs
+                rows += batch_rows
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        for batch in pair_batches:
+            pairs += len(batch)
+            rows += aligner.align_batch(batch)
+    logging.info(
+            "Aligned %d document pairs into %d rows of %s",
+            pairs, rows, aligner.table_name)
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""TimeQuery answers what was said at a time or during a time window
+
+It uses the integer millisecond columns StartMs and EndMs of
+time_<lang> (XmlExporter db --time-ms), indexed by
+XmlExporter db --time-index or the index sub-command:
+
+    python TimeQuery.py index -b sqlite -N opensubtitle en
+    python TimeQuery.py at -b sqlite -N opensubtitle en 4000000 00:42:10
+    python TimeQuery.py overlap -N opensubtitle en 4000000 00:42:10 00:43
+"""
+
+import logging
+import os
+import sys
+import CommonFunctions
+
+from collections import namedtuple
+from CommonArgParser import CommonArgParser
+from CommonArgParser import ExitStatus
+from DbHandler import DbHandler
+
+try:
+    from typing import Dict, List, Tuple  # noqa: F401 # pylint: disable=W0611
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+TimeWindow = namedtuple('TimeWindow', [
+        'document_id', 'time_id', 'start_sentence_id', 'start_word_id',
+        'start_ms', 'end_sentence_id', 'end_word_id', 'end_ms'])
+
+
+class TimeQuery(object):
+    """Time point and time overlap queries against time_<lang>
+
+    A window whose EndMs is before its StartMs covers the time between
+    them, on every DB.
+
+    Args:
+        db_handler (DbHandler): connected DB handler
+
+    Examples:
+    >>> from argparse import Namespace
+    >>> from DbHandler import SQLiteHandler
+    >>> db = SQLiteHandler(
+    ...         Namespace(lang='en', db_name=':memory:', time_ms=True))
+    >>> _ = db.connect()
+    >>> db.ensure_table_time()
+    >>> _ = db.bulk_insert(
+    ...         'time_en', DbHandler.TIME_COLUMNS + ['StartMs', 'EndMs'], [
+    ...                 (1, 1, 1, 1, '', 1, 2, '', 1000, 2000),
+    ...                 (1, 2, 2, 1, '', 2, 1, '', 5000, 3000)])
+    >>> query = TimeQuery(db)
+    >>> [w.time_id for w in query.at(1, 1500)], query.at(1, 2500)
+    ([1], [])
+    >>> [w.time_id for w in query.at(1, 4000)]
+    [2]
+    >>> [w.time_id for w in query.overlapping(1, 4900, 1900)]
+    [1, 2]
+    """
+
+    def __init__(self, db_handler: DbHandler):
+        self.db_handler = db_handler
+        self.lang = db_handler.args.lang
+        # Longest time window and longest inverted time window of each
+        # queried document
+        self.max_spans = {}  # type: Dict[int, Tuple[int, int]]
+
+    def max_span_ms(self, doc_id: int):
+        """Longest time window and longest inverted time window of the
+        document, bound B-tree scans"""
+        if doc_id not in self.max_spans:
+            row = self.db_handler.execute(
+                    f"""SELECT MAX(EndMs - StartMs), MAX(StartMs - EndMs)
+                     FROM time_{self.lang}
+                     WHERE DocumentId = %(doc_id)s;""",
+                    {'doc_id': doc_id}).fetchone()
+            self.max_spans[doc_id] = (
+                    max(row[0] or 0, 0), max(row[1] or 0, 0))
+        return self.max_spans[doc_id]
+
+    def overlapping(self, doc_id: int, start_ms: int, end_ms: int):
+        # type: (int, int, int) -> List[TimeWindow]
+        """Time windows of the document overlapping start_ms to end_ms,
+        in either order"""
+        start_ms, end_ms = min(start_ms, end_ms), max(start_ms, end_ms)
+        max_span_ms, max_inverted_ms = self.max_span_ms(doc_id)
+        cur = self.db_handler.execute(
+                f"""SELECT {', '.join(DbHandler.TIME_COLUMNS[:4])}, StartMs,
+                 EndSentenceId, EndWordId, EndMs
+                 FROM time_{self.lang}
+                 WHERE DocumentId = %(doc_id)s
+                  AND {self.db_handler.time_overlap_condition()}
+                 ORDER BY StartMs, TimeId;""",
+                {'doc_id': doc_id, 'start_ms': start_ms, 'end_ms': end_ms,
+                 'max_span_ms': max_span_ms,
+                 'max_inverted_ms': max_inverted_ms})
+        return [TimeWindow(*row) for row in cur.fetchall()]
+
+    def at(self, doc_id: int, ms: int):
+        # type: (int, int) -> List[TimeWindow]
+        """Time windows of the document shown at ms"""
+        return self.overlapping(doc_id, ms, ms)
+
+    def text(self, window: TimeWindow):
+        """Words from the start to the end word of the time window"""
+        cur = self.db_handler.execute(
+                f"""SELECT Word FROM words_{self.lang}
+                 WHERE DocumentId = %(doc_id)s
+                  AND (SentenceId > %(start_s_id)s OR (
+                   SentenceId = %(start_s_id)s
+                   AND WordId >= %(start_w_id)s))
+                  AND (SentenceId < %(end_s_id)s OR (
+                   SentenceId = %(end_s_id)s AND WordId <= %(end_w_id)s))
+                 ORDER BY SentenceId, WordId;""",
+                {'doc_id': window.document_id,
+                 'start_s_id': window.start_sentence_id,
+                 'start_w_id': window.start_word_id,
+                 'end_s_id': window.end_sentence_id,
+                 'end_w_id': window.end_word_id})
+        return ' '.join(row[0] for row in cur.fetchall())
+
+
+def parse_time_arg(time_str: str):
+    """Milliseconds of an OPUS time like 00:42:10,5 or a number of ms
+
+    >>> parse_time_arg('00:42:10,5'), parse_time_arg('1500')
+    (2530500, 1500)
+    """
+    if time_str.isdigit():
+        return int(time_str)
+    return DbHandler.parse_time_ms(time_str)
+
+
+def print_windows(time_query: TimeQuery, windows: List[TimeWindow]):
+    for window in windows:
+        print("%d\t%s\t%s\t%s" % (
+                window.time_id,
+                DbHandler.format_interval(window.start_ms),
+                DbHandler.format_interval(window.end_ms),
+                time_query.text(window)))
+
+
+def main():
+    """Run as command line program"""
+    parser = CommonArgParser(__file__)
+    db_options = [
+            ('-b --db-product', {
+                    'type': str, 'default': 'postgresql',
+                    'help': 'The DB to query: postgresql, sqlite'}),
+            ('-N --db-name', {
+                    'type': str, 'default': 'opensubtitle',
+                    'help': 'The DB name'}),
+            ('-p --db-password', {
+                    'type': str,
+                    'help': 'The DB password'}),
+            ('-u --db-user', {
+                    'type': str,
+                    'help': 'The DB username'}),
+            ('lang', {'help': 'The language of time table'})]
+    parser.add_sub_command(
+            'index', db_options,
+            help='Build the time window index after load')
+    parser.add_sub_command(
+            'at', db_options + [
+                    ('document_id', {'type': int, 'help': 'DocumentId'}),
+                    ('time', {'help': 'Time like 00:42:10 or ms'})],
+            help='Print what is shown at the time')
+    parser.add_sub_command(
+            'overlap', db_options + [
+                    ('document_id', {'type': int, 'help': 'DocumentId'}),
+                    ('start', {'help': 'Start time like 00:42:10 or ms'}),
+                    ('end', {'help': 'End time like 00:43:00 or ms'})],
+            help='Print what is shown during the time window')
+    args = parser.parse_all()
+    if not hasattr(args, 'sub_command'):
+        parser.parse_args(['-h'])
+        sys.exit(ExitStatus.FATAL_INVALID_ARGUMENTS.value)
+    db_handler = DbHandler.get_handler(args)
+    db_handler.connect()
+    if args.sub_command == 'index':
+        db_handler.create_time_index()
+        return
+    time_query = TimeQuery(db_handler)
+    try:
+        if args.sub_command == 'at':
+            windows = time_query.at(
+                    args.document_id, parse_time_arg(args.time))
+        else:
+            windows = time_query.overlapping(
+                    args.document_id, parse_time_arg(args.start),
+                    parse_time_arg(args.end))
+    except ValueError as e:
+        logging.critical(e)
+        sys.exit(ExitStatus.FATAL_INVALID_ARGUMENTS.value)
+    print_windows(time_query, windows)
+    if not windows:
+        sys.exit(ExitStatus.RETURN_FALSE.value)
+
+
+if __name__ == '__main__':
+    CommonFunctions.run_doctest_and_quit_if_enabled()
+    main()
@@ -2,18 +2,51 @@
 """XmlExporter extract xml or gziped xml to other file format
 """
 
+import functools
 import gzip
+import itertools
 import logging
+import mmap
+import os
+import shutil
+import signal
 import sys
+import tempfile
+import threading
 import xml.etree.ElementTree as ETree
+import zlib
 import CommonFunctions
 
 from argparse import Namespace
+from contextlib import ExitStack
 from xml.etree.ElementTree import Element as XmlNode
 from CommonArgParser import CommonArgParser
 from CommonArgParser import ExitStatus
-from CommonFunctions import next_file
-from DbHandler import DbHandler
+from CommonFunctions import OpusDirFilter, next_file, opus_lang
+from DbHandler import DbHandler, RowCollector
+from Profiler import Profiler
+
+try:
+    from typing import Any, List  # noqa: F401 # pylint: disable=unused-import
+    from typing import Dict  # noqa: F401
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+XML_PATTERNS = ['*.xml.gz', '*.xml']
+# Bytes of a memory-mapped .xml file fed to the parser at a time
+MMAP_CHUNK_BYTES = 1 << 22
+# lang of a multi-language export of all languages under src_dir/xml/
+ALL_LANGS = 'all'
+# Tab separated file, relative path and error, in --quarantine-dir
+QUARANTINE_REPORT = 'quarantine.tsv'
+
+# Per worker process states of --jobs
+worker_args = None  # type: Namespace
+worker_profiler = None  # type: Profiler
+# Makes each worker take exactly one task of _flush_worker()
+worker_barrier = None  # type: Any
+# Set by GracefulStop, shared with the workers of --jobs
+stop_event = None  # type: Any
 
 
 class UnsupportedDbError(Exception):
@@ -27,7 +60,9 @@ class UnsupportedDbError(Exception):
 
 class NoTextInWElementError(Exception):
     def __init__(self, filename, document_id, w_id):
-        super(NoTextInWElementError, self).__init__()
+        # Arguments are kept for pickling, e.g. out of worker processes
+        super(NoTextInWElementError, self).__init__(
+                filename, document_id, w_id)
         self.filename = filename
         self.document_id = document_id
         self.w_id = w_id
@@ -37,13 +72,175 @@ class NoTextInWElementError(Exception):
             self.w_id, self.document_id, self.filename)
 
 
+# Errors of corrupted or malformed source files, see export_or_quarantine()
+MALFORMED_FILE_ERRORS = (
+        ETree.ParseError, EOFError, OSError, zlib.error, ValueError,
+        KeyError, IndexError, NoTextInWElementError)
+
+
+class GracefulStop(object):
+    """Stop exporting after the current files on SIGINT or SIGTERM
+
+    Rows of the exported files are flushed as usual, so with --incremental
+    the next run continues with the rest. A second signal interrupts
+    at once.
+
+    Args:
+        event (optional): Defaults to a threading.Event.
+            Pass a multiprocessing.Event to share it with workers
+    """
+
+    def __init__(self, event=None):
+        self.event = event if event is not None else threading.Event()
+
+    def install(self):
+        global stop_event
+        stop_event = self.event
+        for signum in [signal.SIGINT, signal.SIGTERM]:
+            signal.signal(signum, self.handle)
+
+    def handle(self, signum, frame):
+        if self.event.is_set():
+            raise KeyboardInterrupt()
+        logging.warning(
+                "Received %s, stopping after the current files",
+                signal.Signals(signum).name)
+        self.event.set()
+
+
+def is_stop_requested():
+    return stop_event is not None and stop_event.is_set()
+
+
+def is_multi_lang(args: Namespace):
+    """Whether lang is 'all' or a comma separated list of languages"""
+    return args.lang == ALL_LANGS or ',' in args.lang
+
+
+def lang_list(args: Namespace):
+    """Languages of lang, None for all languages
+
+    >>> lang_list(Namespace(lang='en,zh_cn')), lang_list(Namespace(lang='all'))
+    (['en', 'zh_cn'], None)
+    """
+    if args.lang == ALL_LANGS:
+        return None
+    return args.lang.split(',')
+
+
+class LangRouter(object):
+    """Arguments of the language of each file of a multi-language export
+
+    src_dir is the OPUS root, the language of a file is its xml/<lang>/
+    directory. Each language gets its own DbHandler, and IngestCache with
+    --incremental, on its first file. All of them share the connection
+    of args.db_handler, so one pass over the tree loads every language.
+    """
+
+    def __init__(self, args: Namespace):
+        self.args = args
+        self.langs = lang_list(args)
+        self.lang_args = {}  # type: Dict[str, Namespace]
+
+    def __call__(self, in_file: str):
+        """Arguments of the language of in_file, None to skip the file"""
+        lang = opus_lang(in_file)
+        if lang is None or (self.langs and lang not in self.langs):
+            logging.warning("Skipping %s, not in xml/<lang>/", in_file)
+            return None
+        return self.args_of_lang(lang)
+
+    def args_of_lang(self, lang: str):
+        lang_args = self.lang_args.get(lang)
+        if lang_args is None:
+            logging.info("Exporting language %s", lang)
+            db_handler = self.args.db_handler.lang_handler(lang)
+            lang_args = Namespace(**dict(
+                    vars(self.args), lang=lang, db_handler=db_handler,
+                    lang_router=None))
+            if self.args.incremental:
+                from IngestCache import IngestCache
+                lang_args.ingest_cache = IngestCache(
+                        db_handler, self.args.src_dir)
+            self.lang_args[lang] = lang_args
+        # A retry of another language may have reconnected
+        lang_args.db_handler.conn = self.args.db_handler.conn
+        return lang_args
+
+    def add_langs(self, paths):
+        """Create the tables of the languages of paths, before the
+        workers of --jobs would race to create them"""
+        langs = set(map(opus_lang, paths))
+        for lang in sorted(langs - {None}):
+            if not self.langs or lang in self.langs:
+                self.args_of_lang(lang)
+
+    def handlers(self):
+        for lang in sorted(self.lang_args):
+            db_handler = self.lang_args[lang].db_handler
+            db_handler.conn = self.args.db_handler.conn
+            yield db_handler
+
+    def flush(self):
+        for db_handler in self.handlers():
+            db_handler.flush()
+
+
+def advise_sequential(fd: int):
+    """Tell the kernel that the file is read once from start to end,
+    so it reads ahead more and drops the pages read"""
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+
 def xml_file_opener(in_file: str):
+    """Binary file of a .xml or .xml.gz file
+
+    The parser decodes the bytes as the XML declaration says, so they are
+    not decoded to str and encoded again."""
+    if in_file.endswith('.gz'):
+        f = gzip.open(in_file, mode='rb')
+    else:
+        f = open(in_file, mode='rb')
+    advise_sequential(f.fileno())
+    return f
+
+
+def parse_xml_file(in_file: str):
+    """Parse a .xml or .xml.gz file, returns the root element
+
+    A .xml file is memory-mapped and fed to the parser MMAP_CHUNK_BYTES at
+    a time, straight from the page cache without copying it into bytes.
+
+    >>> with tempfile.NamedTemporaryFile(suffix='.xml') as f:
+    ...     _ = f.write(b'<document id="1"><s id="1">Hi</s></document>')
+    ...     f.flush()
+    ...     root = parse_xml_file(f.name)
+    >>> root.attrib['id'], root[0].text
+    ('1', 'Hi')
+    """
     if in_file.endswith('.gz'):
-        return gzip.open(in_file, mode='r')
-    return open(in_file, mode='r')
+        with xml_file_opener(in_file) as f:
+            return ETree.parse(f).getroot()
+    with open(in_file, mode='rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            # An empty file cannot be mapped, let the parser report it
+            return ETree.parse(f).getroot()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            parser = ETree.XMLParser()
+            # ETree.parse() only reads bytes, XMLParser.feed() takes
+            # any buffer
+            with memoryview(mapped) as view:
+                for pos in range(0, size, MMAP_CHUNK_BYTES):
+                    parser.feed(view[pos:pos + MMAP_CHUNK_BYTES])
+            return parser.close()
 
 
-def pre_order_traversal(node: XmlNode, parent_path: str, args: Namespace):
+def pre_order_traversal(node: XmlNode, parent_path: str, args: Namespace,
+                        log_nodes=False):
     """traverse XML using pre-order
 
     Args:
@@ -51,71 +248,760 @@ def pre_order_traversal(node: XmlNode, parent_path: str, args: Namespace):
         parent_path (str): XML path to this node without the document node.
                 Note that tag document will be omitted
         args (Namespace): [description]
+        log_nodes (bool, optional): Defaults to False.
+                Log each node at DEBUG level. Checked once per file by
+                the caller, as this runs for every node
     """
-    level = parent_path.count('.')
-    logging.debug(
-            "%s%s %s %s" % (
-                    " " * level, node.tag, node.attrib,
-                    "" if not node.text else "| " + node.text))
+    if log_nodes:
+        logging.debug(
+                "%s%s %s %s", " " * parent_path.count('.'), node.tag,
+                node.attrib, "" if not node.text else "| " + node.text)
     if hasattr(args, 'db_handler'):
         args.db_handler.write_node(node, parent_path, args)
     if node.tag == 'document':
         # Omit the tag <document>
-        this_path = ''
+        child_path = ''
+    elif parent_path:
+        child_path = f"{parent_path}.{node.tag}"
     else:
-        this_path = node.tag
+        child_path = node.tag
     for child in node:
-        pre_order_traversal(child, f"{parent_path}.{this_path}", args)
+        pre_order_traversal(child, child_path, args, log_nodes)
 
 
 def export_xml_file(in_file: str, args: Namespace):
-    logging.info(f"Reading {in_file}")
-    with xml_file_opener(in_file) as f:
-        tree = ETree.parse(f)
-        root = tree.getroot()
-        pre_order_traversal(root, '', args)
+    db_handler = getattr(args, 'db_handler', None)
+    ingest_cache = getattr(args, 'ingest_cache', None)
+    corpus_stats = getattr(args, 'corpus_stats', None)
+    document_cache = getattr(args, 'document_cache', None)
+    if ingest_cache:
+        record = ingest_cache.check(in_file)
+        if not record:
+            logging.info(f"Skipping unchanged {in_file}")
+            return
+        if record.old_document_id is not None:
+            logging.info(
+                    "Replacing document %d of changed %s",
+                    record.old_document_id, in_file)
+            db_handler.discard_document(record.old_document_id)
+    batch = document_cache.load(in_file) if document_cache else None
+    if batch:
+        logging.info(f"Reading cache of {in_file}")
+        db_handler.add_rows(batch)
+    else:
+        logging.info(f"Reading {in_file}")
+        root = parse_xml_file(in_file)
+        check_words(root, in_file)
+        pre_order_traversal(
+                root, '', args,
+                logging.getLogger().isEnabledFor(logging.DEBUG))
+        if corpus_stats:
+            corpus_stats.add_document(root)
+    if db_handler:
+        callback = None
+        if ingest_cache:
+            callback = functools.partial(
+                    ingest_cache.update, record, db_handler.document_id,
+                    dict(db_handler.row_counts))
+        db_handler.end_document(
+                callback, batch.document_rows[0] if batch else None)
+
+
+def check_words(root: XmlNode, in_file: str):
+    """Raise NoTextInWElementError if a <w> has no text
+
+    Checked before any row of the document is written.
+
+    >>> root = ETree.fromstring(
+    ...         '<document id="7"><s id="1"><w id="1.1">Hi</w>'
+    ...         '<w id="1.2"/></s></document>')
+    >>> try:
+    ...     check_words(root, '7.xml')
+    ... except NoTextInWElementError as e:
+    ...     print(e)
+    No text in element w 1.2 at document: 7 (7.xml)
+    """
+    for node in root.iter('w'):
+        if not node.text:
+            raise NoTextInWElementError(
+                    in_file, root.attrib.get('id'), node.attrib.get('id'))
+
+
+def parse_document(in_file: str, args: Namespace):
+    """Rows of the document of a file, without a DB connection
+
+    They are loaded from --from-cache if it is fresh, otherwise the file
+    is parsed and checked the way export_xml_file() does, e.g. in worker
+    processes.
+
+    Returns:
+        RowBatch: rows of the document
+    """
+    document_cache = getattr(args, 'document_cache', None)
+    batch = document_cache.load(in_file) if document_cache else None
+    if batch:
+        return batch
+    collector = RowCollector(args)
+    root = parse_xml_file(in_file)
+    check_words(root, in_file)
+    pre_order_traversal(
+            root, '', Namespace(db_handler=collector),
+            logging.getLogger().isEnabledFor(logging.DEBUG))
+    collector.end_document()
+    return collector.take_batch()
+
+
+def quarantine_file(in_file: str, error: Exception, args: Namespace):
+    """Copy a malformed file into --quarantine-dir and report the error
+
+    The copy keeps the path relative to src_dir, the source tree is not
+    modified."""
+    rel_path = os.path.relpath(in_file, args.src_dir)
+    target = os.path.join(args.quarantine_dir, rel_path)
+    try:
+        CommonFunctions.mkdir_p(os.path.dirname(target))
+        shutil.copy2(in_file, target)
+    except OSError as e:
+        logging.error("Cannot copy %s to quarantine: %s", in_file, e)
+    detail = ' '.join(str(error).split())
+    # Workers of --jobs append to the same report, one write per line
+    with open(os.path.join(
+            args.quarantine_dir, QUARANTINE_REPORT), 'a') as f:
+        f.write("%s\t%s\t%s\n" % (rel_path, type(error).__name__, detail))
+
+
+def export_or_quarantine(in_file: str, args: Namespace):
+    """export_xml_file(), but with --quarantine-dir malformed files are
+    quarantined and skipped, instead of stopping the export
+
+    Returns:
+        bool: False if the file is quarantined
+    """
+    if getattr(args, 'lang_router', None):
+        args = args.lang_router(in_file)
+        if args is None:
+            return True
+    if not getattr(args, 'quarantine_dir', None):
+        export_xml_file(in_file, args)
+        return True
+    try:
+        export_xml_file(in_file, args)
+    except MALFORMED_FILE_ERRORS as e:
+        logging.error("Quarantining malformed %s: %s", in_file, e)
+        if hasattr(args, 'db_handler'):
+            args.db_handler.abandon_document()
+        quarantine_file(in_file, e, args)
+        return False
+    return True
+
+
+def dir_filter(args: Namespace):
+    """Directory filter from --prune-lang and --years, and the languages
+    of a multi-language export"""
+    if is_multi_lang(args):
+        return OpusDirFilter(lang_list(args), args.years)
+    return OpusDirFilter(
+            [args.lang] if args.prune_lang else None, args.years)
+
+
+def in_shard(args: Namespace):
+    """Predicate of the files of --shard"""
+    from Sharding import shard_key, shard_of
+    return lambda path: shard_of(
+            shard_key(path, args.src_dir),
+            args.shard.count) == args.shard.index
+
+
+def obtain_manifest(args: Namespace):
+    """FileManifest of the files of this --shard"""
+    from FileManifest import FileManifest
+    manifest = FileManifest.obtain(
+            args.src_dir, XML_PATTERNS, args.manifest, args.rescan,
+            dir_filter(args), args.discovery_jobs)
+    if args.shard:
+        # The cached manifest is of all shards
+        manifest = manifest.select(in_shard(args))
+    return manifest
+
+
+def init_corpus_stats(args: Namespace):
+    """CorpusStats of --stats, or None"""
+    if not getattr(args, 'stats', None):
+        return None
+    from CorpusStats import CorpusStats
+    return CorpusStats(args.stats_dir, args.stats, args.stats_memory)
+
+
+def _init_worker(args: Namespace, event=None, barrier=None):
+    """Initialize a worker process of --jobs
+
+    Each worker has its own DB connection and profiler"""
+    from multiprocessing.util import Finalize
+    global worker_args, worker_profiler, worker_barrier, stop_event
+    worker_args = args
+    stop_event = event
+    worker_barrier = barrier
+    # Ctrl-C reaches the whole process group, the main process tells
+    # the workers to stop after their current file with the shared event.
+    # The handler of GracefulStop inherited by fork is reset, so that
+    # pool.terminate() still ends the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if args.sub_command == 'db':
+        db_handler = DbHandler.get_handler(args)
+        db_handler.connect()
+        setattr(worker_args, 'db_handler', db_handler)
+        if is_multi_lang(args):
+            router = LangRouter(worker_args)
+            setattr(worker_args, 'lang_router', router)
+        if args.incremental and not is_multi_lang(args):
+            from IngestCache import IngestCache
+            setattr(
+                    worker_args, 'ingest_cache',
+                    IngestCache(db_handler, args.src_dir))
+        corpus_stats = init_corpus_stats(args)
+        if corpus_stats:
+            setattr(worker_args, 'corpus_stats', corpus_stats)
+    worker_profiler = Profiler.init_from_parsed_args(
+            args, "XmlExporter-%d" % os.getpid())
+    stack = ExitStack()
+    stack.enter_context(worker_profiler.run())
+    # Write profiles when the worker exits
+    Finalize(stack, stack.close, exitpriority=10)
+
+
+def _export_files_worker(in_files: List[str]):
+    done = 0
+    for in_file in in_files:
+        if is_stop_requested():
+            break
+        with worker_profiler.file(in_file):
+            export_or_quarantine(in_file, worker_args)
+        done += 1
+    return done
+
+
+def _flush_worker(_):
+    """Write the rows still buffered by the worker, and spill the last
+    counts of --stats for the main process to merge
+
+    Errors reach the main process like those of the exported files,
+    unlike those of a multiprocessing.util.Finalize at exit."""
+    # All workers hold a task of the pool.map() of export_parallel()
+    # before any of them flushes
+    worker_barrier.wait()
+    if getattr(worker_args, 'lang_router', None):
+        worker_args.lang_router.flush()
+    elif getattr(worker_args, 'db_handler', None):
+        worker_args.db_handler.flush()
+    if getattr(worker_args, 'corpus_stats', None):
+        worker_args.corpus_stats.spill()
+
+
+def export_parallel(args: Namespace):
+    """Export files with a pool of args.jobs processes
+
+    Files are stat once into a manifest, then either fed to the pool
+    largest-first, or split into one shard per worker by count or bytes.
+
+    A malformed file without --quarantine-dir stops the export at once:
+
+    >>> import subprocess, tempfile  # nosec
+    >>> work_dir = tempfile.mkdtemp()
+    >>> xml_dir = os.path.join(work_dir, 'xml', 'en', '1999', '1')
+    >>> CommonFunctions.mkdir_p(xml_dir)
+    >>> for doc_id in range(1, 17):
+    ...     with open(os.path.join(xml_dir, '%d.xml' % doc_id), 'w') as f:
+    ...         _ = f.write('<document id="%d"><s id="1"><w id="1.1">'
+    ...                     'Hi</w></s></document>' % doc_id)
+    >>> with open(os.path.join(xml_dir, '1.xml'), 'w') as f:
+    ...     _ = f.write('<document id="1"><s id="1"><w')
+    >>> subprocess.run([  # nosec
+    ...         sys.executable, __file__, 'db', '-b', 'sqlite',
+    ...         '-N', os.path.join(work_dir, 'db.sqlite3'), '-j', '2',
+    ...         '-v', 'NONE', 'en', work_dir],
+    ...         env=dict(os.environ, PY_DOCTEST='0'),
+    ...         stderr=subprocess.DEVNULL, timeout=60).returncode
+    1
+    >>> shutil.rmtree(work_dir)
+    """
+    import multiprocessing
+    manifest = obtain_manifest(args)
+    if args.shard_by:
+        tasks = [
+                m.largest_first() for m in manifest.bins(
+                        args.jobs, args.shard_by)]
+    else:
+        tasks = [[f] for f in manifest.largest_first()]
+    logging.info(
+            "Exporting %d files (%d bytes) with %d jobs",
+            len(manifest), manifest.total_bytes, args.jobs)
+    if getattr(args, 'lang_router', None):
+        args.lang_router.add_langs(manifest.largest_first())
+    # Connections cannot be passed to workers
+    pool_args = Namespace(**{
+            k: v for k, v in vars(args).items()
+            if k not in [
+                    'db_handler', 'ingest_cache', 'corpus_stats',
+                    'lang_router']})
+    pool = multiprocessing.Pool(
+            args.jobs, initializer=_init_worker,
+            initargs=(pool_args, stop_event, multiprocessing.Barrier(
+                    args.jobs)))
+    try:
+        done = 0
+        for count in pool.imap_unordered(
+                _export_files_worker, tasks, chunksize=1):
+            done += count
+            logging.debug("%d/%d files done", done, len(manifest))
+        pool.map(_flush_worker, range(args.jobs), chunksize=1)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    if is_stop_requested():
+        logging.warning(
+                "Stopped after %d of %d files", done, len(manifest))
+
+
+def source_files(args: Namespace):
+    """Source files of this --shard, from the manifest or walking src_dir"""
+    if args.manifest:
+        return obtain_manifest(args).largest_first()
+    files = next_file(
+            args.src_dir, XML_PATTERNS, dir_filter(args),
+            args.discovery_jobs)
+    if args.shard:
+        from Sharding import select_shard
+        files = select_shard(files, args.shard, args.src_dir)
+    return files
+
+
+def export_files(args: Namespace, profiler: Profiler):
+    """Export files in this process"""
+    files = source_files(args)
+    if getattr(args, 'pipeline', False):
+        import AsyncPipeline
+        AsyncPipeline.run(
+                args, itertools.takewhile(
+                        lambda _: not is_stop_requested(), files))
+        return
+    done = 0
+    for f in files:
+        if is_stop_requested():
+            logging.warning("Stopped after %d files", done)
+            break
+        with profiler.file(f):
+            export_or_quarantine(f, args)
+        done += 1
+    for db_handler in db_handlers(args):
+        db_handler.flush()
+
+
+def db_handlers(args: Namespace):
+    """DB handler of each language exported in this process"""
+    if getattr(args, 'lang_router', None):
+        return list(args.lang_router.handlers())
+    if hasattr(args, 'db_handler'):
+        return [args.db_handler]
+    return []
+
+
+def verify_files(args: Namespace):
+    """Verify the export of the source files, see LoadVerifier
+
+    Returns:
+        bool: True if all documents are ok
+    """
+    from LoadVerifier import LoadVerifier, digest_files
+    db_handler = DbHandler.get_handler(args)
+    db_handler.connect()
+    # Connections cannot be passed to workers
+    worker_args = Namespace(**{
+            k: v for k, v in vars(args).items() if k != 'db_handler'})
+    report = open(args.report, 'w') if args.report else sys.stdout
+    try:
+        verifier = LoadVerifier(db_handler, report, args.verify_batch)
+        return verifier.verify(digest_files(
+                worker_args, source_files(args)))
+    finally:
+        if args.report:
+            report.close()
+
+
+def scan_source_files(args: Namespace):
+    """Parse the source files without loading them, see SourceScanner
+
+    Returns:
+        bool: True if no file is malformed
+    """
+    from SourceScanner import ScanReport, scan_sources
+    report = open(args.report, 'w') if args.report else sys.stderr
+    try:
+        return ScanReport(report).scan(
+                scan_sources(args, source_files(args)), args.jobs)
+    finally:
+        if args.report:
+            report.close()
+
+
+def cache_source_files(args: Namespace):
+    """Parse the source files into the cache files of --cache-dir,
+    see DocumentCache
+
+    Returns:
+        bool: True if no file is malformed
+    """
+    from DocumentCache import cache_sources
+    counts = {'cached': 0, 'fresh': 0, 'malformed': 0}
+    for in_file, status in cache_sources(args, source_files(args)):
+        if status not in counts:
+            logging.error("Not caching malformed %s: %s", in_file, status)
+            status = 'malformed'
+        counts[status] += 1
+        done = sum(counts.values())
+        if done % 1000 == 0:
+            logging.info("Cached %d files", done)
+    logging.info(
+            "Cached %d files, %d were up to date, %d malformed",
+            counts['cached'], counts['fresh'], counts['malformed'])
+    return not counts['malformed']
+
+
+def write_corpus_stats(args: Namespace):
+    """Merge the counts of all processes into the summary tables"""
+    try:
+        args.corpus_stats.write(args.db_handler, args.stats_min_count)
+    finally:
+        if getattr(args, 'remove_stats_dir', False):
+            shutil.rmtree(args.stats_dir)
 
 
 def main():
     """Run as command line program"""
+    # Needed to declare the options, other modules are imported by the
+    # sub-commands and options that use them
+    from CorpusStats import MAX_NGRAM
+    from FileManifest import FileManifest
+    from Sharding import parse_shard
     parser = CommonArgParser(__file__)
-    parser.add_common_argument('lang', help='The language to be inserted')
+    parser.add_common_argument(
+            'lang',
+            help="""The language to be inserted. With 'all' or a comma
+            separated list, src_dir is the OPUS root and every language
+            under xml/ (or the listed ones) is exported in one pass""")
     parser.add_common_argument('src_dir', help='Source directory')
+    parser.add_common_argument(
+            '-j', '--jobs', type=int, default=1,
+            help='Number of worker processes (Default: 1)')
+    parser.add_common_argument(
+            '--manifest', type=str,
+            help="""Cache the file list and sizes to this file,
+            so a restart does not walk src_dir again""")
+    parser.add_common_argument(
+            '--rescan', action='store_true',
+            help='Walk src_dir again even if the manifest exists')
+    parser.add_common_argument(
+            '--prune-lang', action='store_true',
+            help="""Only walk xml/<lang>/ of the language,
+            when src_dir is the OPUS root""")
+    parser.add_common_argument(
+            '--years', type=str,
+            help="""Only walk xml/<lang>/<year>/ of the years,
+            e.g. 1990-1999,2005""")
+    parser.add_common_argument(
+            '--discovery-jobs', type=int, default=1,
+            help="""Number of threads to scan directories,
+            helps on network file systems (Default: 1)""")
+    parser.add_common_argument(
+            '--shard-by', type=str, choices=FileManifest.SHARD_BY,
+            help="""With --jobs, give each worker a fixed shard of equal
+            file count or bytes, instead of feeding files largest-first""")
+    parser.add_common_argument(
+            '--shard', type=parse_shard, metavar='i/N',
+            help="""Only export the files of shard i (0 based) of N,
+            by hash of DocumentId, for ingesting on several hosts""")
+    db_connection_options = [
+            ('-A --db-admin-password', {
+                    'type': str,
+                    'help': 'The DB admin password'}),
+            ('-b --db-product', {
+                    'type': str, 'default': 'postgresql',
+                    'help': 'The DB to store: postgresql, sqlite'}),
+            ('-N --db-name', {
+                    'type': str, 'default': 'opensubtitle',
+                    'help': 'The DB name'}),
+            ('--db-dsn', {
+                    'type': str, 'action': 'append',
+                    'help': 'DB of a shard, repeat for each DB: shard i of'
+                    ' --shard writes to the (i %% number of DSNs)-th one.'
+                    ' PostgreSQL URI like postgresql://host:5432/name,'
+                    ' or SQLite file name'}),
+            ('-p --db-password', {
+                    'type': str,
+                    'help': 'The DB password'}),
+            ('-u --db-user', {
+                    'type': str,
+                    'help': 'The DB username'})]
     parser.add_sub_command(
             'db',
-            [
-                    ('-A --db-admin-password', {
+            db_connection_options + [
+                    ('--time-ms', {
+                            'action': 'store_true',
+                            'help': 'Also store time as integer milliseconds'
+                            ' columns StartMs and EndMs'}),
+                    ('--time-index', {
+                            'action': 'store_true',
+                            'help': 'Index time windows after load, for'
+                            ' TimeQuery.py (requires --time-ms)'}),
+                    ('-I --incremental', {
+                            'action': 'store_true',
+                            'help': 'Skip source files that are unchanged'
+                            ' since last run, replace documents of changed'
+                            ' ones'}),
+                    ('-R --replace', {
+                            'action': 'store_true',
+                            'help': 'Replace the rows of documents:'
+                            ' delete then bulk load them in batches'}),
+                    ('--copy-binary', {
+                            'action': 'store_true',
+                            'help': 'COPY words and time tables in'
+                            ' PostgreSQL binary format in replace mode'}),
+                    ('--batch-documents', {
+                            'type': int, 'default': 100,
+                            'help': 'Documents per transaction in replace'
+                            ' mode (Default: 100)'}),
+                    ('--retries', {
+                            'type': int, 'default': 3,
+                            'help': 'Reconnect and retry a statement or'
+                            ' a batch this many times on connection'
+                            ' errors (Default: 3)'}),
+                    ('--retry-delay', {
+                            'type': float, 'default': 1.0,
+                            'help': 'Seconds before the first retry,'
+                            ' doubled for each next one (Default: 1.0)'}),
+                    ('--from-cache', {
+                            'type': str, 'metavar': 'CACHE_DIR',
+                            'help': 'Read the rows of source files from'
+                            ' the cache files of the cache sub-command'
+                            ' in this directory; files without an up to'
+                            ' date cache file are parsed'}),
+                    ('--quarantine-dir', {
                             'type': str,
-                            'help': 'The DB admin password'}),
-                    ('-b --db-product', {
-                            'type': str, 'default': 'postgresql',
-                            'help': 'The DB to store'}),
-                    ('-N --db-name', {
-                            'type': str, 'default': 'opensubtitle',
-                            'help': 'The DB name'}),
-                    ('-p --db-password', {
+                            'help': 'Copy malformed source files here and'
+                            ' list them in %s, instead of stopping the'
+                            ' export' % QUARANTINE_REPORT}),
+                    ('--pipeline', {
+                            'action': 'store_true',
+                            'help': 'Use asyncio pipeline that parses while'
+                            ' writing to PostgreSQL with asyncpg'}),
+                    ('--writers', {
+                            'type': int, 'default': 4,
+                            'help': 'DB writers of --pipeline (Default: 4)'}),
+                    ('--queue-size', {
+                            'type': int, 'default': 64,
+                            'help': 'Parsed documents waiting for writers'
+                            ' in --pipeline (Default: 64)'}),
+                    ('--queue-mb', {
+                            'type': int, 'default': 256,
+                            'help': 'MiB of parsed rows waiting for writers'
+                            ' in --pipeline, the parser blocks above it'
+                            ' (Default: 256)'}),
+                    ('--queue-low-mb', {
+                            'type': int,
+                            'help': 'Blocked parser resumes when the waiting'
+                            ' rows drain to this many MiB'
+                            ' (Default: half of --queue-mb)'}),
+                    ('--queue-spill-dir', {
                             'type': str,
-                            'help': 'The DB password'}),
-                    ('-u --db-user', {
+                            'help': 'Spill parsed rows beyond --queue-mb to'
+                            ' this directory instead of blocking the'
+                            ' parser, up to --queue-size documents'}),
+                    ('--stats', {
+                            'type': int, 'choices': range(1, MAX_NGRAM + 1),
+                            'help': 'Also count n-grams up to this size,'
+                            ' document frequency and sentence lengths into'
+                            ' tables ngram_freq_<lang> and'
+                            ' sentence_length_<lang>'}),
+                    ('--stats-memory', {
+                            'type': int, 'default': 1000000,
+                            'help': 'N-grams counted in memory before'
+                            ' spilling to disk (Default: 1000000)'}),
+                    ('--stats-min-count', {
+                            'type': int, 'default': 1,
+                            'help': 'Do not store n-grams seen less often'
+                            ' (Default: 1)'}),
+                    ('--stats-dir', {
                             'type': str,
-                            'help': 'The DB username'}),
+                            'help': 'Directory of spilled counts, each run'
+                            ' spills into a subdirectory removed at the end'
+                            ' (Default: the temporary directory)'}),
                     ],
             help='Export to DB')
+    parser.add_sub_command(
+            'shard-verify',
+            db_connection_options + [
+                    ('--shard-count', {
+                            'type': int,
+                            'help': 'N of --shard i/N'
+                            ' (Default: number of --db-dsn)'})],
+            help='Check the documents and row counts of the DBs of'
+            ' --db-dsn against the files of their shards')
+    parser.add_sub_command(
+            'verify',
+            db_connection_options + [
+                    ('--time-ms', {
+                            'action': 'store_true',
+                            'help': 'Also verify StartMs and EndMs'}),
+                    ('--verify-batch', {
+                            'type': int, 'default': 500,
+                            'help': 'Documents per aggregate query'
+                            ' (Default: 500)'}),
+                    ('--report', {
+                            'type': str,
+                            'help': 'Write documents that are missing,'
+                            ' differ or have dangling time windows to'
+                            ' this file (Default: standard output)'})],
+            help='Parse the source files again and compare per-document'
+            ' counts and checksums with the DB')
+    parser.add_sub_command(
+            'scan',
+            [
+                    ('--time-ms', {
+                            'action': 'store_true',
+                            'help': 'Size the StartMs and EndMs columns'
+                            ' of db --time-ms too'}),
+                    ('--report', {
+                            'type': str,
+                            'help': 'Write malformed files to this file'
+                            ' (Default: standard error)'})],
+            help='Dry run: parse the source files without a DB, report'
+            ' rows per table and language, estimated PostgreSQL size,'
+            ' malformed files and parse throughput')
+    parser.add_sub_command(
+            'cache',
+            [
+                    ('--cache-dir', {
+                            'type': str, 'required': True,
+                            'help': 'Write a compact binary file of the'
+                            ' rows of each source file here, at its path'
+                            ' relative to src_dir, for db --from-cache'}),
+                    ('--rebuild', {
+                            'action': 'store_true',
+                            'help': 'Parse again the source files whose'
+                            ' cache file is up to date'})],
+            help='Parse the source files once into cache files, which'
+            ' db --from-cache reads instead of the XML')
 
     args = parser.parse_all()
     if hasattr(args, 'sub_command'):
+        if is_multi_lang(args) and args.sub_command not in [
+                'db', 'scan', 'cache']:
+            logging.critical(
+                    '%s exports one language at a time', args.sub_command)
+            sys.exit(ExitStatus.FATAL_INVALID_OPTIONS.value)
         if args.sub_command == 'db':
+            if is_multi_lang(args) and (args.pipeline or args.stats):
+                logging.critical(
+                        '--pipeline and --stats need a single language')
+                sys.exit(ExitStatus.FATAL_INVALID_OPTIONS.value)
+            if args.pipeline and (
+                    args.db_product != 'postgresql' or args.incremental):
+                logging.critical(
+                        '--pipeline only supports postgresql'
+                        ' without --incremental')
+                sys.exit(ExitStatus.FATAL_INVALID_OPTIONS.value)
+            if args.copy_binary and (
+                    args.db_product != 'postgresql' or not args.replace):
+                logging.critical(
+                        '--copy-binary requires postgresql and --replace')
+                sys.exit(ExitStatus.FATAL_INVALID_OPTIONS.value)
+            if args.from_cache and args.stats:
+                # N-grams are counted from the XML tree
+                logging.critical('--from-cache cannot be used with --stats')
+                sys.exit(ExitStatus.FATAL_INVALID_OPTIONS.value)
+            if args.time_index and not args.time_ms:
+                logging.critical('--time-index requires --time-ms')
+                sys.exit(ExitStatus.FATAL_INVALID_OPTIONS.value)
+            if args.stats and (args.pipeline or args.incremental):
+                # Counts would miss the skipped or pipelined documents
+                logging.critical(
+                        '--stats cannot be used with --pipeline'
+                        ' or --incremental')
+                sys.exit(ExitStatus.FATAL_INVALID_OPTIONS.value)
             db_handler = DbHandler.get_handler(args)
-            db_handler.prepare()
+            # Tables of each language are created on its first file
+            db_handler.prepare(create_tables=not is_multi_lang(args))
             setattr(args, 'db_handler', db_handler)
+            if args.from_cache:
+                from DocumentCache import DocumentCache
+                setattr(args, 'document_cache', DocumentCache(
+                        args.from_cache, args.src_dir))
+            if args.incremental:
+                from IngestCache import IngestCache
+                ingest_cache = IngestCache(db_handler, args.src_dir)
+                ingest_cache.ensure_table()
+                setattr(args, 'ingest_cache', ingest_cache)
+            if is_multi_lang(args):
+                setattr(args, 'lang_router', LangRouter(args))
+            if args.stats:
+                if args.stats_dir:
+                    CommonFunctions.mkdir_p(args.stats_dir)
+                # Counts spilled by an earlier run into --stats-dir are
+                # not merged into those of this run
+                args.stats_dir = tempfile.mkdtemp(
+                        prefix='opensubtitle-stats-', dir=args.stats_dir)
+                setattr(args, 'remove_stats_dir', True)
+                setattr(args, 'corpus_stats', init_corpus_stats(args))
+        elif args.sub_command == 'shard-verify':
+            if not args.db_dsn:
+                logging.critical('shard-verify requires --db-dsn')
+                sys.exit(ExitStatus.FATAL_INVALID_OPTIONS.value)
+            files = next_file(
+                    args.src_dir, XML_PATTERNS, dir_filter(args),
+                    args.discovery_jobs)
+            from Sharding import verify_shards
+            if not verify_shards(args, files, args.shard_count):
+                sys.exit(ExitStatus.RETURN_FALSE.value)
+            return
+        elif args.sub_command == 'verify':
+            if not verify_files(args):
+                sys.exit(ExitStatus.RETURN_FALSE.value)
+            return
+        elif args.sub_command == 'scan':
+            if not scan_source_files(args):
+                sys.exit(ExitStatus.RETURN_FALSE.value)
+            return
+        elif args.sub_command == 'cache':
+            if not cache_source_files(args):
+                sys.exit(ExitStatus.RETURN_FALSE.value)
+            return
         else:
             logging.critical('Not implement yet')
             sys.exit(ExitStatus.FATAL_INVALID_OPTIONS)
     else:
         parser.parse_args(['-h'])
         sys.exit(ExitStatus.FATAL_INVALID_ARGUMENTS)
-    for f in next_file(args.src_dir, ['*.xml.gz', '*.xml']):
-        export_xml_file(f, args)
+    profiler = Profiler.init_from_parsed_args(args, __file__)
+    with profiler.run():
+        if args.jobs > 1 and not getattr(args, 'pipeline', False):
+            import multiprocessing
+            GracefulStop(multiprocessing.Event()).install()
+            export_parallel(args)
+        else:
+            GracefulStop().install()
+            export_files(args, profiler)
+        if getattr(args, 'corpus_stats', None):
+            write_corpus_stats(args)
+        if is_stop_requested():
+            if getattr(args, 'time_index', False):
+                logging.warning('Skipping --time-index of stopped export')
+            sys.exit(ExitStatus.RETURN_FALSE.value)
+        if getattr(args, 'time_index', False):
+            for db_handler in db_handlers(args):
+                db_handler.create_time_index()
 
 
 if __name__ == '__main__':